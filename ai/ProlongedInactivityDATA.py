@@ -1,7 +1,8 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+
+# matplotlib and seaborn are only needed for the plots in main(), so they are
+# imported there and the generators can be reused without them.
 
 
 
@@ -221,6 +222,9 @@ def assemble_dataset(features, save_path=None):
 
 def plot_feature_vs_hour(df, feature_name, title, y_label):
     """Generic function to plot a feature against the hour of the day."""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     plt.figure(figsize=(12, 6))
     sns.scatterplot(data=df, x='hour', y=feature_name, alpha=0.3, label='Individual Samples')
     
@@ -273,6 +277,9 @@ def main():
     print(user_activity_df['displacement_m'].describe())
 
     # --- 4. Visualization ---
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     plt.style.use('seaborn-v0_8-whitegrid')
 
     # Plot Displacement
@@ -1,7 +1,9 @@
+import os
 import pandas as pd
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 import joblib
+from model_artifact import export_model
 
 def load_and_preprocess_data(filepath):
     """
@@ -70,6 +72,11 @@ def train_and_save_model(data_scaled, scaler, columns, model_path, scaler_path):
     joblib.dump(scaler_and_columns, scaler_path)
     print(f"Scaler and column info saved to {scaler_path}")
 
+    # Export the pickle-free artifact that the inference service loads
+    artifact_path = os.path.splitext(model_path)[0] + '.safx'
+    export_model(model, scaler_and_columns, artifact_path)
+    print(f"Model artifact exported to {artifact_path}")
+
 
 if __name__ == '__main__':
     TRAINING_DATA_FILE = 'user_activity_data.csv'
@@ -0,0 +1,271 @@
+"""
+Outbound alerts for HIGH risk anomalies.
+
+The prediction endpoints hand every result to AlertPipeline.offer (the wire
+batch endpoints and the streams to offer_batch), which keeps only anomalies at
+HIGH risk, drops repeats for the same device and model within `dedup_seconds`,
+and puts the event on each sink's bounded asyncio queue without waiting. Every
+sink has its own task on the event loop that collects events into batches (up
+to `batch_size`, or whatever arrived within `flush_interval`) and ships them,
+retrying failures with exponential backoff, so a slow or failing webhook never
+holds up the file and queue sinks. Events that do not fit in a sink's queue,
+or that it still rejects after the last retry, are dropped and counted for
+that sink, so alerting never adds latency or unbounded memory to the request
+path.
+
+Sinks, all from the environment:
+
+    SAFARX_ALERT_WEBHOOK   URL that batches are POSTed to as {"alerts": [...]}
+    SAFARX_ALERT_FILE      NDJSON file that events are appended to
+    SAFARX_ALERT_QUEUE     in-memory queue of this many events, read via
+                           GET /admin/alerts/queue (stand-in for a message broker)
+    SAFARX_ALERT_DEDUP     seconds a device's repeat alerts are suppressed (default 300)
+"""
+
+import os
+import json
+import time
+import asyncio
+import threading
+import collections
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+ALERT_RISK_LEVEL = 'HIGH'
+
+
+class WebhookSink:
+    name = 'webhook'
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        # Imported here so the service does not load httpx without a webhook.
+        import httpx
+        self.url = url
+        self._client = httpx.AsyncClient(timeout=timeout)
+
+    async def send(self, events: List[dict]) -> None:
+        response = await self._client.post(self.url, json={'alerts': events})
+        response.raise_for_status()
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+class FileSink:
+    name = 'file'
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _append(self, events: List[dict]) -> None:
+        with open(self.path, 'a') as f:
+            f.writelines(json.dumps(event) + '\n' for event in events)
+
+    async def send(self, events: List[dict]) -> None:
+        await asyncio.to_thread(self._append, events)
+
+    async def close(self) -> None:
+        pass
+
+
+class QueueSink:
+    """Keeps the most recent `max_events` events for consumers to take."""
+    name = 'queue'
+
+    def __init__(self, max_events: int = 10_000):
+        self.events = collections.deque(maxlen=max_events)
+        self.overwritten = 0
+
+    async def send(self, events: List[dict]) -> None:
+        self.overwritten += max(len(self.events) + len(events) - self.events.maxlen, 0)
+        self.events.extend(events)
+
+    def take(self, limit: int) -> List[dict]:
+        return [self.events.popleft() for _ in range(min(limit, len(self.events)))]
+
+    async def close(self) -> None:
+        pass
+
+
+class AlertPipeline:
+    def __init__(self, sinks: list, queue_size: int = 10_000, batch_size: int = 100, flush_interval: float = 1.0,
+                 dedup_seconds: float = 300.0, max_dedup_entries: int = 100_000, max_retries: int = 5,
+                 retry_backoff: float = 0.5):
+        """
+        Args:
+            sinks: Objects with async send(events) and close()
+            queue_size: Events waiting to be batched per sink, at most
+            batch_size: Events shipped to the sinks together, at most
+            flush_interval: Seconds a partial batch waits for more events
+            dedup_seconds: Repeat alerts for a device and model within this
+                window are suppressed; alerts without a device id never are
+            max_dedup_entries: Devices remembered for deduplication, at most
+            max_retries: Retries of a failed send before the batch is dropped
+            retry_backoff: Seconds before the first retry, doubled on each one
+        """
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dedup_seconds = dedup_seconds
+        self.max_dedup_entries = max_dedup_entries
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.stats = collections.Counter()
+        self.sink_stats = {sink.name: collections.Counter() for sink in sinks}
+        self._queues = {sink.name: asyncio.Queue(maxsize=queue_size) for sink in sinks}
+        self._last_alert = collections.OrderedDict()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._tasks = {}
+        # The batch each sink is collecting or delivering, shipped again by
+        # stop() if its task is cancelled before it is done.
+        self._batches = {sink.name: [] for sink in sinks}
+
+    def start(self) -> None:
+        """Start one dispatch task per sink on the running event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        for sink in self.sinks:
+            task = self._tasks.get(sink.name)
+            if task is None or task.done():
+                self._tasks[sink.name] = self._loop.create_task(self._run(sink))
+
+    def offer(self, model: str, device_id: Optional[str], result: dict, payload_data: dict) -> None:
+        """Queue an alert if `result` is a HIGH risk anomaly. Never blocks; safe to call from any thread."""
+        if not result['is_anomaly'] or result['risk_level'] != ALERT_RISK_LEVEL or self._loop is None:
+            return
+        event = {
+            'model': model,
+            'device_id': device_id,
+            'risk_level': result['risk_level'],
+            'timestamp': time.time(),
+            'payload': payload_data,
+        }
+        if threading.get_ident() == self._loop_thread:
+            self._enqueue(event)
+        else:
+            self._loop.call_soon_threadsafe(self._enqueue, event)
+
+    def offer_batch(self, model: str, is_anomaly: np.ndarray, risk_levels: np.ndarray,
+                    row: Callable[[int], Tuple[Optional[str], dict]]) -> None:
+        """
+        `offer` for the results of a batch. Never blocks; safe to call from any thread.
+
+        Args:
+            model: Name of the model that scored the batch
+            is_anomaly: Anomaly flag per row
+            risk_levels: Risk level per row
+            row: Maps a row index to its (device id, payload); only called for HIGH risk anomalies
+        """
+        if self._loop is None:
+            return
+        alerting = np.flatnonzero(np.asarray(is_anomaly) & (np.asarray(risk_levels) == ALERT_RISK_LEVEL))
+        for i in alerting:
+            device_id, payload_data = row(int(i))
+            self.offer(model, device_id, {'is_anomaly': True, 'risk_level': ALERT_RISK_LEVEL}, payload_data)
+
+    def _is_repeat(self, event: dict) -> bool:
+        if event['device_id'] is None:
+            return False
+        key = (event['model'], event['device_id'])
+        last = self._last_alert.get(key)
+        if last is not None and event['timestamp'] - last < self.dedup_seconds:
+            return True
+        self._last_alert[key] = event['timestamp']
+        self._last_alert.move_to_end(key)
+        if len(self._last_alert) > self.max_dedup_entries:
+            self._last_alert.popitem(last=False)
+        return False
+
+    def _enqueue(self, event: dict) -> None:
+        if self._is_repeat(event):
+            self.stats['deduplicated'] += 1
+            return
+        self.stats['queued'] += 1
+        for name, sink_queue in self._queues.items():
+            try:
+                sink_queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.sink_stats[name]['dropped'] += 1
+
+    async def _next_batch(self, sink) -> List[dict]:
+        sink_queue = self._queues[sink.name]
+        batch = self._batches[sink.name] = [await sink_queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(sink_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self, sink):
+        while True:
+            batch = await self._next_batch(sink)
+            await self._ship(sink, batch)
+
+    async def _ship(self, sink, batch: List[dict]) -> None:
+        await self._deliver(sink, batch)
+        self.sink_stats[sink.name]['batches'] += 1
+        self._batches[sink.name] = []
+
+    async def _deliver(self, sink, batch: List[dict]) -> None:
+        stats = self.sink_stats[sink.name]
+        for attempt in range(self.max_retries + 1):
+            try:
+                await sink.send(batch)
+                stats['delivered'] += len(batch)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    stats['failed'] += len(batch)
+                    print(f"Error delivering {len(batch)} alerts to the {sink.name} sink: {e}")
+                    return
+                stats['retries'] += 1
+                await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+
+    async def stop(self) -> None:
+        """Stop the dispatch tasks, ship what is still queued and close the sinks."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = {}
+        await asyncio.gather(*(self._drain(sink) for sink in self.sinks))
+        for sink in self.sinks:
+            await sink.close()
+
+    async def _drain(self, sink) -> None:
+        if self._batches[sink.name]:
+            # A batch the sink may already have taken is sent again.
+            await self._ship(sink, self._batches[sink.name])
+        sink_queue = self._queues[sink.name]
+        while not sink_queue.empty():
+            await self._ship(sink, [sink_queue.get_nowait() for _ in range(min(self.batch_size, sink_queue.qsize()))])
+
+    def status(self) -> dict:
+        return {
+            'running': any(not task.done() for task in self._tasks.values()),
+            **{key: self.stats[key] for key in ('queued', 'deduplicated')},
+            'sinks': {
+                name: {'queued_now': self._queues[name].qsize(), **stats}
+                for name, stats in self.sink_stats.items()
+            },
+        }
+
+
+def from_env() -> Optional[AlertPipeline]:
+    sinks = []
+    if os.environ.get('SAFARX_ALERT_WEBHOOK'):
+        sinks.append(WebhookSink(os.environ['SAFARX_ALERT_WEBHOOK']))
+    if os.environ.get('SAFARX_ALERT_FILE'):
+        sinks.append(FileSink(os.environ['SAFARX_ALERT_FILE']))
+    if int(os.environ.get('SAFARX_ALERT_QUEUE', '0')) > 0:
+        sinks.append(QueueSink(int(os.environ['SAFARX_ALERT_QUEUE'])))
+    if not sinks:
+        return None
+    return AlertPipeline(sinks, dedup_seconds=float(os.environ.get('SAFARX_ALERT_DEDUP', '300')))
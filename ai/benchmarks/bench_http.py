@@ -0,0 +1,73 @@
+"""
+End-to-end HTTP benchmarks against the FastAPI app through an in-process ASGI
+client (no sockets), covering routing, validation, prediction and serialization,
+for JSON and the packed record wire format (single requests and batches).
+"""
+
+import asyncio
+import time
+from typing import Dict
+
+import httpx
+
+from harness import DROPOFF_PAYLOAD, INACTIVITY_PAYLOAD, summarize
+import main
+import wire
+
+CONCURRENCY = 16
+BATCH_SIZE = 256
+
+
+async def _sequential(client: httpx.AsyncClient, path: str, payload, number: int) -> Dict[str, float]:
+    samples = []
+    kwargs = {'json': payload}
+    if isinstance(payload, bytes):
+        kwargs = {'content': payload, 'headers': {'content-type': wire.RECORD, 'accept': wire.RECORD}}
+    for _ in range(number):
+        start = time.perf_counter()
+        response = await client.post(path, **kwargs)
+        samples.append(time.perf_counter() - start)
+        response.raise_for_status()
+    return summarize(samples)
+
+
+async def _concurrent(client: httpx.AsyncClient, path: str, payload: dict, number: int) -> Dict[str, float]:
+    start = time.perf_counter()
+    for _ in range(number):
+        responses = await asyncio.gather(*(client.post(path, json=payload) for _ in range(CONCURRENCY)))
+        for response in responses:
+            response.raise_for_status()
+    elapsed = time.perf_counter() - start
+    return {
+        'requests_per_second': number * CONCURRENCY / elapsed,
+        'concurrency': CONCURRENCY,
+        'unit': 'requests/s',
+        'metric': 'requests_per_second',
+        'better': 'higher',
+    }
+
+
+async def _run(quick: bool) -> Dict[str, dict]:
+    await main.startup_event()
+    number = 10 if quick else 50
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        await client.post('/api/dropoff', json=DROPOFF_PAYLOAD)
+        dropoff_record = wire.encode_records(wire.DROPOFF_SCHEMA, [DROPOFF_PAYLOAD])
+        inactivity_batch = [INACTIVITY_PAYLOAD] * BATCH_SIZE
+        return {
+            'dropoff_request': await _sequential(client, '/api/dropoff', DROPOFF_PAYLOAD, number),
+            'dropoff_request_record': await _sequential(client, '/api/dropoff', dropoff_record, number),
+            'inactivity_request': await _sequential(client, '/api/inactivity', INACTIVITY_PAYLOAD, number),
+            'inactivity_batch_json': await _sequential(client, '/api/inactivity/batch', inactivity_batch, number),
+            'inactivity_batch_record': await _sequential(
+                client, '/api/inactivity/batch',
+                wire.encode_records(wire.INACTIVITY_SCHEMA, inactivity_batch), number
+            ),
+            'dropoff_throughput': await _concurrent(client, '/api/dropoff', DROPOFF_PAYLOAD, 2 if quick else 5),
+            'inactivity_throughput': await _concurrent(client, '/api/inactivity', INACTIVITY_PAYLOAD, 2 if quick else 5),
+        }
+
+
+def run(quick: bool = False) -> Dict[str, dict]:
+    return asyncio.run(_run(quick))
@@ -0,0 +1,66 @@
+"""
+Cold-start import cost of the service, from `python -X importtime -c "import main"`.
+
+Besides timing, the serving path must not pull in the heavy libraries that only
+training, plotting or the safety-score path need; any that show up are listed
+under `heavy_modules` and counted so compare.py flags them as a regression.
+"""
+
+import sys
+import subprocess
+from typing import Dict, List, Tuple
+
+from harness import AI_DIR, summarize
+
+HEAVY_MODULES = ('pandas', 'sklearn', 'joblib', 'scipy', 'matplotlib', 'seaborn', 'requests', 'httpx')
+TOP_N = 10
+
+
+def import_time_report(module: str = 'main') -> Tuple[float, Dict[str, int], List[str]]:
+    """
+    Run a fresh interpreter with -X importtime.
+
+    Returns:
+        Tuple of (wall seconds, own import microseconds summed per top-level package, all imported modules)
+    """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import time; t = time.perf_counter(); import {module}; '
+                                                    f'print(time.perf_counter() - t)'],
+        cwd=AI_DIR, capture_output=True, text=True, check=True
+    )
+    wall = float(completed.stdout.strip().splitlines()[-1])
+
+    packages: Dict[str, int] = {}
+    modules: List[str] = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        modules.append(name)
+        top_level = name.split('.')[0]
+        packages[top_level] = packages.get(top_level, 0) + int(self_us)
+    return wall, packages, modules
+
+
+def run(quick: bool = False) -> Dict[str, dict]:
+    walls = []
+    for _ in range(3 if quick else 7):
+        wall, packages, modules = import_time_report()
+        walls.append(wall)
+
+    heavy = sorted({name.split('.')[0] for name in modules} & set(HEAVY_MODULES))
+    if heavy:
+        print(f"WARNING: the serving path imports {', '.join(heavy)}")
+
+    top = dict(sorted(packages.items(), key=lambda item: item[1], reverse=True)[:TOP_N])
+    return {
+        'import_main': summarize(walls),
+        'import_breakdown_us': top,
+        'heavy_modules': {
+            'count': len(heavy),
+            'modules': heavy,
+            'metric': 'count',
+            'better': 'lower',
+        },
+    }
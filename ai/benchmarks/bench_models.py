@@ -0,0 +1,82 @@
+"""Benchmarks for the anomaly model handlers: single predictions and batch scoring."""
+
+from typing import Dict
+
+import pandas as pd
+
+from harness import DROPOFF_PAYLOAD, INACTIVITY_PAYLOAD, measure
+from model_handler import model_handler, inactivity_model_handler, DropoffModelHandler
+
+DROPOFF_BATCH_CSV = 'tourist_safety_dataset_test.csv'
+INACTIVITY_BATCH_CSV = 'user_activity_data.csv'
+
+
+def score_frame(handler, frame: pd.DataFrame, prefix: str):
+    """Score a whole frame in one decision_function call, as the *-test.py scripts do."""
+    one_hot_encoded = pd.get_dummies(frame['area_risk'], prefix=prefix)
+    df_processed = pd.concat([frame.drop('area_risk', axis=1), one_hot_encoded], axis=1)
+    df_aligned = df_processed.reindex(columns=handler.scaler_info['columns'], fill_value=0)
+    data_scaled = handler.scaler_info['scaler'].transform(df_aligned.astype(float))
+    return handler.model.decision_function(data_scaled)
+
+
+def run(quick: bool = False) -> Dict[str, dict]:
+    artifact_handler = DropoffModelHandler()
+    joblib_handler = DropoffModelHandler()
+    joblib_handler.artifact_path = ''
+    load_results = {
+        'dropoff_load_artifact': measure(artifact_handler.load_model_and_scaler, number=5 if quick else 20),
+        'dropoff_load_joblib': measure(joblib_handler.load_model_and_scaler, number=2 if quick else 5),
+    }
+
+    model_handler.load_model_and_scaler()
+    inactivity_model_handler.load_model_and_scaler()
+    number = 10 if quick else 50
+
+    dropoff_frame = pd.read_csv(DROPOFF_BATCH_CSV).drop(columns=['is_anomaly'])
+    inactivity_frame = pd.read_csv(INACTIVITY_BATCH_CSV)
+
+    # Cached results repeat one payload, so they measure the hit path only.
+    model_handler.configure_cache(max_entries=4096)
+    inactivity_model_handler.configure_cache(max_entries=4096)
+    cached_results = {
+        'dropoff_predict_cached': measure(lambda: model_handler.predict(DROPOFF_PAYLOAD), number=number),
+        'inactivity_predict_cached': measure(
+            lambda: inactivity_model_handler.predict(INACTIVITY_PAYLOAD), number=number
+        ),
+    }
+    model_handler.configure_cache(max_entries=0)
+    inactivity_model_handler.configure_cache(max_entries=0)
+
+    results = {
+        'dropoff_predict': measure(lambda: model_handler.predict(DROPOFF_PAYLOAD), number=number),
+        'inactivity_predict': measure(lambda: inactivity_model_handler.predict(INACTIVITY_PAYLOAD), number=number),
+        'dropoff_predict_explain': measure(
+            lambda: model_handler.predict(DROPOFF_PAYLOAD, explain=True), number=number
+        ),
+        'inactivity_predict_explain': measure(
+            lambda: inactivity_model_handler.predict(INACTIVITY_PAYLOAD, explain=True), number=number
+        ),
+        'dropoff_batch_score': measure(
+            lambda: score_frame(model_handler, dropoff_frame, 'area_risk'), number=2 if quick else 5
+        ),
+        'inactivity_batch_score': measure(
+            lambda: score_frame(inactivity_model_handler, inactivity_frame, 'risk'), number=2 if quick else 5
+        ),
+    }
+    for handler, frame, prefix in ((model_handler, dropoff_frame, 'area_risk'),
+                                   (inactivity_model_handler, inactivity_frame, 'risk')):
+        reduced = type(handler)()
+        reduced.model, reduced.scaler_info = handler.model, handler.scaler_info
+        reduced.use_float32()
+        results[f'{handler.name}_batch_score_float32'] = measure(
+            lambda: score_frame(reduced, frame, prefix), number=2 if quick else 5
+        )
+        results[f'{handler.name}_batch_score_float32']['rows'] = len(frame)
+    results.update(cached_results)
+    results.update(load_results)
+    model_handler.configure_cache()
+    inactivity_model_handler.configure_cache()
+    results['dropoff_batch_score']['rows'] = len(dropoff_frame)
+    results['inactivity_batch_score']['rows'] = len(inactivity_frame)
+    return results
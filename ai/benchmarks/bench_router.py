@@ -0,0 +1,79 @@
+"""
+Throughput of the consistent-hash worker pool (router.py) with 1, 2 and 4
+inference worker processes, driven directly through WorkerPool.submit so the
+serving process's HTTP stack is not the bottleneck. Payloads vary per device,
+so with SAFARX_RESULT_CACHE_SIZE set the workers' result caches see the same
+hit rate at every pool size.
+
+Scaling is only linear up to the number of cores; `cpu_count` is recorded in
+the result metadata.
+"""
+
+import os
+import time
+import collections
+from typing import Dict
+
+from harness import DROPOFF_PAYLOAD
+import router
+
+WORKER_COUNTS = (1, 2, 4)
+DEVICES = 1000
+# Requests in flight per worker.
+WINDOW = 64
+
+
+def _payload(device: int) -> dict:
+    return dict(DROPOFF_PAYLOAD, time_since_last_successful_ping=device % 120,
+                gps_accuracy=[5.0 + device % 17, 9.2, 11.1, 7.8, 10.4])
+
+
+def _throughput(n_workers: int, number: int) -> Dict[str, float]:
+    pool = router.WorkerPool(n_workers)
+    try:
+        devices = [f"device-{i}" for i in range(DEVICES)]
+        payloads = [_payload(i) for i in range(DEVICES)]
+        # Wait for the workers to load their models before timing.
+        for i in range(DEVICES):
+            pool.submit(devices[i], 'dropoff', payloads[i]).result(timeout=120)
+
+        in_flight = collections.deque()
+        start = time.perf_counter()
+        for i in range(number):
+            if len(in_flight) >= WINDOW * n_workers:
+                in_flight.popleft().result()
+            in_flight.append(pool.submit(devices[i % DEVICES], 'dropoff', payloads[i % DEVICES]))
+        for future in in_flight:
+            future.result()
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.close()
+    return {
+        'requests_per_second': number / elapsed,
+        'workers': n_workers,
+        'unit': 'requests/s',
+        'metric': 'requests_per_second',
+        'better': 'higher',
+    }
+
+
+def _rebalance() -> Dict[str, float]:
+    """Fraction of devices that move when a fifth worker joins a ring of four."""
+    ring = router.HashRing([f"worker-{i}" for i in range(4)])
+    keys = [f"device-{i}" for i in range(20000)]
+    before = [ring.node_for(key) for key in keys]
+    ring.add('worker-4')
+    moved = sum(ring.node_for(key) != owner for key, owner in zip(keys, before))
+    return {'moved_fraction': moved / len(keys), 'ideal_fraction': 1 / 5}
+
+
+def run(quick: bool = False) -> Dict[str, dict]:
+    number = 4000 if quick else 40000
+    results = {f"pool_{n}_workers": _throughput(n, number) for n in WORKER_COUNTS}
+    single = results['pool_1_workers']['requests_per_second']
+    for n in WORKER_COUNTS:
+        entry = results[f"pool_{n}_workers"]
+        entry['speedup'] = entry['requests_per_second'] / single
+        entry['cores'] = min(n, os.cpu_count() or 1)
+    results['ring_rebalance'] = _rebalance()
+    return results
@@ -0,0 +1,71 @@
+"""
+Benchmarks for LocationSafetyCalculator. Remoteness runs against synthetic
+tower sets of increasing size; the network-bound components talk to the local
+stub servers in stubs.py.
+"""
+
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from harness import SEED, measure
+from stubs import StubServer
+from safetyscore import LocationSafetyCalculator
+
+LAT, LON = 13.0827, 80.2707
+TOWER_COUNTS = (1_000, 10_000, 100_000, 1_000_000)
+
+
+def synthetic_towers(count: int) -> pd.DataFrame:
+    """Towers spread over India's bounding box with a dense cluster around the query point."""
+    rng = np.random.default_rng(SEED)
+    clustered = count // 10
+    return pd.DataFrame({
+        'lat': np.concatenate([rng.uniform(8.0, 35.0, count - clustered), rng.normal(LAT, 0.05, clustered)]),
+        'long': np.concatenate([rng.uniform(68.0, 97.0, count - clustered), rng.normal(LON, 0.05, clustered)]),
+    })
+
+
+def run(quick: bool = False) -> Dict[str, dict]:
+    results = {}
+    tower_counts = TOWER_COUNTS[:3] if quick else TOWER_COUNTS
+
+    with StubServer() as stub:
+        calculator = LocationSafetyCalculator(
+            cell_tower_csv_path='',
+            overpass_url=stub.overpass_url,
+            weather_url=stub.weather_url
+        )
+
+        for count in tower_counts:
+            calculator.cell_towers_df = synthetic_towers(count)
+            results[f'remoteness_{count}_towers'] = measure(
+                lambda: calculator._calculate_remoteness_score(LAT, LON), number=3 if count >= 1_000_000 else 10
+            )
+
+        # The uncached cases clear the lookup cache first, so every call goes to the stubs.
+        cache = calculator.lookup_cache
+        number = 5 if quick else 20
+        results['accessibility_stubbed'] = measure(
+            lambda: (cache.clear(), calculator._calculate_accessibility_score(LAT, LON)), number=number
+        )
+        results['environment_stubbed'] = measure(
+            lambda: (cache.clear(), calculator._get_environmental_hazard_score(LAT, LON)), number=number
+        )
+
+        calculator.cell_towers_df = synthetic_towers(TOWER_COUNTS[1])
+        requests_before = stub.requests
+        results['safety_score_stubbed'] = measure(
+            lambda: (cache.clear(), calculator.calculate_safety_score(LAT, LON, False)), number=number
+        )
+        results['safety_score_stubbed']['stub_requests'] = stub.requests - requests_before
+        requests_before = stub.requests
+        results['safety_score_cached'] = measure(lambda: calculator.calculate_safety_score(LAT, LON, False), number=number)
+        results['safety_score_cached']['stub_requests'] = stub.requests - requests_before
+
+        # ~10 km route sampled every 200 m, against the warm lookup cache after the first run
+        route = [(LAT, LON), (LAT + 0.05, LON + 0.03), (LAT + 0.09, LON + 0.02)]
+        results['route_10km_200m'] = measure(lambda: list(calculator.score_route(route, spacing_m=200)), number=number)
+
+    return results
@@ -0,0 +1,63 @@
+"""
+Compares two benchmark result files and reports regressions.
+
+Usage:
+    python benchmarks/compare.py BASELINE.json CURRENT.json [--threshold 0.10]
+
+Exits with status 1 when any benchmark got worse by more than the threshold.
+"""
+
+import sys
+import json
+import argparse
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline: dict, current: dict, threshold: float):
+    """
+    Yields (name, old, new, change, regressed) for every benchmark present in
+    both runs that declares a comparison metric. `change` is the relative
+    change oriented so that positive always means worse.
+    """
+    for name in sorted(set(baseline) & set(current)):
+        old, new = baseline[name], current[name]
+        metric = new.get('metric')
+        if metric is None or metric != old.get('metric') or metric not in old:
+            continue
+        if old[metric]:
+            change = (new[metric] - old[metric]) / old[metric]
+        else:
+            # A count that used to be zero (e.g. heavy imports) regresses on any increase.
+            change = float('inf') if new[metric] > old[metric] else 0.0
+        if new.get('better') == 'higher':
+            change = -change
+        yield name, old[metric], new[metric], change, change > threshold
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.10, help='allowed relative slowdown (default 0.10)')
+    args = parser.parse_args()
+
+    baseline, current = load(args.baseline), load(args.current)
+    print(f"baseline: {baseline['metadata'].get('commit', '')[:12]}  current: {current['metadata'].get('commit', '')[:12]}")
+
+    regressions = 0
+    for name, old, new, change, regressed in compare(baseline['benchmarks'], current['benchmarks'], args.threshold):
+        regressions += regressed
+        flag = 'REGRESSION' if regressed else ''
+        print(f"{name:45s} {old:14.6g} -> {new:14.6g}  {change * 100:+7.1f}% worse  {flag}")
+
+    if regressions:
+        print(f"\n{regressions} benchmark(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
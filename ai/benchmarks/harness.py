@@ -0,0 +1,125 @@
+"""
+Shared helpers for the benchmark suite: path setup, timing, fixtures and the
+JSON result format consumed by compare.py.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import statistics
+import subprocess
+from typing import Callable, Dict, List
+
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(AI_DIR, 'benchmarks', 'results')
+
+# The handlers load their artifacts from paths relative to ai/.
+if AI_DIR not in sys.path:
+    sys.path.insert(0, AI_DIR)
+os.chdir(AI_DIR)
+
+SEED = 42
+
+DROPOFF_PAYLOAD = {
+    'network_connectivity_state': 1,
+    'acc_vs_loc': 1,
+    'time_since_last_successful_ping': 12,
+    'gps_accuracy': [8.5, 9.2, 11.1, 7.8, 10.4],
+    'area_risk': 'low'
+}
+
+INACTIVITY_PAYLOAD = {
+    'hour': 14,
+    'motion_state': 1,
+    'displacement_m': 450.0,
+    'time_since_last_interaction_min': 30,
+    'missed_ping_count': 0,
+    'area_risk': 'low',
+    'battery_level_percent': 70,
+    'is_expected_active': 1
+}
+
+
+def measure(fn: Callable[[], object], number: int = 20, repeat: int = 5, warmup: int = 1) -> Dict[str, float]:
+    """
+    Time `fn` and summarize the per-call latency in seconds.
+
+    Args:
+        fn: Zero-argument callable to benchmark
+        number: Calls per timed round
+        repeat: Number of timed rounds
+        warmup: Untimed calls made first
+
+    Returns:
+        Dictionary with min/median/mean/p95/max seconds per call
+    """
+    for _ in range(warmup):
+        fn()
+    samples: List[float] = []
+    for _ in range(repeat):
+        for _ in range(number):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """
+    Summarize latency samples. `metric` names the field compare.py checks for
+    regressions and `better` its direction; entries without `metric` are
+    informational only.
+    """
+    ordered = sorted(samples)
+    return {
+        'min': ordered[0],
+        'median': statistics.median(ordered),
+        'mean': statistics.fmean(ordered),
+        'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'max': ordered[-1],
+        'samples': len(ordered),
+        'unit': 'seconds',
+        'metric': 'median',
+        'better': 'lower',
+    }
+
+
+def _git(*args: str) -> str:
+    try:
+        return subprocess.run(
+            ['git', *args], cwd=AI_DIR, capture_output=True, text=True, timeout=10
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def _version(module_name: str) -> str:
+    module = sys.modules.get(module_name)
+    return getattr(module, '__version__', '') if module else ''
+
+
+def metadata() -> dict:
+    return {
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain')),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'versions': {name: _version(name) for name in ('numpy', 'pandas', 'sklearn', 'fastapi', 'pydantic')},
+    }
+
+
+def write_results(results: Dict[str, dict], path: str = None) -> str:
+    """Store benchmark results as JSON, by default under results/<commit>.json."""
+    meta = metadata()
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        name = (meta['commit'][:12] or 'nocommit') + ('-dirty' if meta['dirty'] else '')
+        path = os.path.join(RESULTS_DIR, f"{name}.json")
+    with open(path, 'w') as f:
+        json.dump({'metadata': meta, 'benchmarks': results}, f, indent=2, sort_keys=True)
+    return path
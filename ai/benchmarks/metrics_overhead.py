@@ -0,0 +1,60 @@
+"""
+Measures what the metrics instrumentation costs on the prediction hot path.
+
+Part of the benchmark suite (`python benchmarks/run.py --only metrics`), and
+runnable on its own:
+    python benchmarks/metrics_overhead.py
+"""
+
+import time
+import timeit
+from typing import Dict
+
+from harness import DROPOFF_PAYLOAD, INACTIVITY_PAYLOAD, summarize
+import metrics
+from model_handler import model_handler, inactivity_model_handler
+
+
+def per_call(fn, number: int, repeat: int = 5) -> dict:
+    seconds = min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+    return {'per_call': seconds, 'unit': 'seconds', 'metric': 'per_call', 'better': 'lower'}
+
+
+def run(quick: bool = False) -> Dict[str, dict]:
+    model_handler.load_model_and_scaler()
+    inactivity_model_handler.load_model_and_scaler()
+    number = 10 if quick else 50
+    op_number = 20000 if quick else 100000
+
+    results = {
+        'counter_inc': per_call(lambda: metrics.REQUESTS.inc('bench'), op_number),
+        'histogram_observe': per_call(lambda: metrics.STAGE_LATENCY.observe(0.0004, 'bench', 'preprocess'), op_number),
+    }
+
+    for handler, payload in ((model_handler, DROPOFF_PAYLOAD), (inactivity_model_handler, INACTIVITY_PAYLOAD)):
+        # Alternate instrumented and uninstrumented rounds so drift on a busy
+        # machine affects both sides equally.
+        samples = {True: [], False: []}
+        for _ in range(5):
+            for enabled in (True, False):
+                metrics.REGISTRY.enabled = enabled
+                for _ in range(number):
+                    start = time.perf_counter()
+                    handler.predict(payload)
+                    samples[enabled].append(time.perf_counter() - start)
+        metrics.REGISTRY.enabled = True
+        enabled, disabled = summarize(samples[True]), summarize(samples[False])
+        results[f'{handler.name}_predict_instrumented'] = enabled
+        results[f'{handler.name}_predict_uninstrumented'] = disabled
+        results[f'{handler.name}_overhead'] = {
+            'percent': (enabled['median'] - disabled['median']) / disabled['median'] * 100
+        }
+
+    metrics.REGISTRY.reset()
+    return results
+
+
+if __name__ == '__main__':
+    from run import format_entry
+    for key, value in run().items():
+        print(f"{key:40s} {format_entry(value)}")
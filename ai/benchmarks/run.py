@@ -0,0 +1,65 @@
+"""
+Runs the benchmark suite and stores the results as JSON.
+
+Usage (from the `ai/` directory):
+    python benchmarks/run.py                      # everything, saved to benchmarks/results/<commit>.json
+    python benchmarks/run.py --quick --only models,safety
+    python benchmarks/compare.py benchmarks/results/<old>.json benchmarks/results/<new>.json
+"""
+
+import argparse
+import importlib
+import warnings
+
+import harness
+
+SUITES = {
+    'models': 'bench_models',
+    'safety': 'bench_safety',
+    'http': 'bench_http',
+    'metrics': 'metrics_overhead',
+    'imports': 'bench_imports',
+    'router': 'bench_router',
+}
+
+
+def format_entry(entry: dict) -> str:
+    metric = entry.get('metric')
+    if metric is None:
+        return ', '.join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in entry.items())
+    value = entry[metric]
+    if entry.get('unit') == 'seconds':
+        if value < 1e-3:
+            return f"{metric}={value * 1e6:.3f} us"
+        return f"{metric}={value * 1e3:.3f} ms"
+    return f"{metric}={value:g} {entry.get('unit', '')}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', help=f"comma separated subset of: {', '.join(SUITES)}")
+    parser.add_argument('--quick', action='store_true', help='fewer iterations, smaller inputs')
+    parser.add_argument('--output', help='result file (default: benchmarks/results/<commit>.json)')
+    args = parser.parse_args()
+
+    selected = args.only.split(',') if args.only else list(SUITES)
+    unknown = set(selected) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+    # sklearn warns on every load that the pickles were written by another version.
+    warnings.filterwarnings('ignore', category=UserWarning)
+
+    results = {}
+    for suite in selected:
+        print(f"--- {suite} ---")
+        for name, entry in importlib.import_module(SUITES[suite]).run(quick=args.quick).items():
+            results[f"{suite}.{name}"] = entry
+            print(f"{name:40s} {format_entry(entry)}")
+
+    path = harness.write_results(results, args.output)
+    print(f"\nResults saved to {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Local stand-ins for the Overpass and met.no APIs so the safety-score benchmarks
+measure our own code instead of the public internet.
+"""
+
+import re
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_AROUND = re.compile(r'around:(\d+),([-\d.]+),([-\d.]+)')
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; with Nagle's algorithm on, a
+    # kept-alive connection would stall each response on the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        # Overpass: answer with a handful of features scattered around the query point.
+        length = int(self.headers.get('Content-Length', 0))
+        query = parse_qs(self.rfile.read(length).decode()).get('data', [''])[0]
+        self.server.requests += 1
+        match = _AROUND.search(query)
+        lat, lon = (float(match.group(2)), float(match.group(3))) if match else (0.0, 0.0)
+        elements = [
+            {'type': 'node', 'id': i, 'lat': lat + 0.002 * i, 'lon': lon - 0.003 * i, 'tags': {'name': f'feature {i}'}}
+            for i in range(1, self.server.features + 1)
+        ]
+        self._send_json({'elements': elements})
+
+    def do_GET(self):
+        # met.no locationforecast/compact.
+        self.server.requests += 1
+        params = parse_qs(urlparse(self.path).query)
+        self._send_json({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [float(params.get('lon', ['0'])[0]), float(params.get('lat', ['0'])[0])]},
+            'properties': {
+                'timeseries': [
+                    {'time': '2025-01-01T00:00:00Z', 'data': {'next_1_hours': {'summary': {'symbol_code': 'lightrain'}}}}
+                ]
+            }
+        })
+
+
+class StubServer:
+    """
+    Serves both fake APIs from one local port. Use as a context manager; the
+    Overpass endpoint is `overpass_url` and the weather endpoint `weather_url`.
+    """
+
+    def __init__(self, latency: float = 0.0, features: int = 5):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+        self._server.latency = latency
+        self._server.features = features
+        self._server.requests = 0
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def overpass_url(self) -> str:
+        return f"{self.base_url}/api/interpreter"
+
+    @property
+    def weather_url(self) -> str:
+        return f"{self.base_url}/weatherapi/locationforecast/2.0/compact"
+
+    @property
+    def requests(self) -> int:
+        return self._server.requests
+
+    def __enter__(self) -> 'StubServer':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
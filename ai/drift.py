@@ -0,0 +1,205 @@
+"""
+Constant-memory drift monitoring of the model inputs and scores.
+
+Each handler's DriftMonitor keeps a fixed-bin histogram of every model column
+(after one-hot encoding, before scaling) and of the decision_function score.
+Bin edges are the quantiles of the training CSV the model was fitted on, so
+the reference distribution is computed once at startup with the same binning.
+The request path only appends the row and score to a queue; queued rows are
+binned together, with one vectorized comparison against the padded edge table,
+every `flush_every` rows and before a report, which amortizes the numpy
+overhead to a couple of microseconds per request.
+
+Live counts are kept for the current window and the one before it; a report
+compares the two windows' combined counts with the reference using the
+population stability index (PSI) and the Kolmogorov-Smirnov distance over the
+bins. PSI below 0.1 is 'stable', up to 0.25 'moderate', above that 'drift';
+columns get no status until MIN_OBSERVATIONS live rows have been seen.
+
+    SAFARX_DRIFT          0 disables the sketches (default 1)
+    SAFARX_DRIFT_WINDOW   seconds per window (default 3600)
+"""
+
+import os
+import csv
+import time
+import threading
+import collections
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+SCORE_COLUMN = 'decision_function'
+DEFAULT_BINS = 20
+PSI_MODERATE = 0.1
+PSI_DRIFT = 0.25
+# Below this many live rows, PSI mostly measures sampling noise.
+MIN_OBSERVATIONS = 200
+# Added to empty bins so PSI stays finite.
+_EPSILON = 1e-4
+
+
+def read_training_matrix(handler, path: str) -> np.ndarray:
+    """
+    The training CSV as the handler's model columns, encoded like the training
+    scripts' get_dummies: one-hot columns come from `area_risk`, the other
+    columns are read as numbers.
+    """
+    one_hot_prefix = f"{handler.one_hot_prefix}_"
+    with open(path, newline='') as f:
+        records = list(csv.DictReader(f))
+    data = np.zeros((len(records), len(handler.scaler_info['columns'])))
+    for i, column in enumerate(handler.scaler_info['columns']):
+        if column.startswith(one_hot_prefix):
+            category = column[len(one_hot_prefix):]
+            data[:, i] = [record['area_risk'] == category for record in records]
+        else:
+            data[:, i] = [float(record[column]) for record in records]
+    return data
+
+
+class HistogramSketch:
+    """Fixed-bin counts for several columns, binned against per-column edges."""
+
+    def __init__(self, columns: Sequence[str], edges: List[np.ndarray]):
+        self.columns = list(columns)
+        self.edges = edges
+        width = max(len(column_edges) for column_edges in edges)
+        # Padding with +inf keeps every column's count of edges <= x correct.
+        self._edge_table = np.full((len(columns), width), np.inf)
+        for i, column_edges in enumerate(edges):
+            self._edge_table[i, :len(column_edges)] = column_edges
+        self._n_bins = width + 1
+        self._offsets = np.arange(len(columns)) * self._n_bins
+
+    @classmethod
+    def from_reference(cls, columns: Sequence[str], data: np.ndarray, n_bins: int = DEFAULT_BINS) -> 'HistogramSketch':
+        quantiles = np.quantile(data, np.linspace(0, 1, n_bins + 1), axis=0)
+        return cls(columns, [np.unique(quantiles[:, i]) for i in range(len(columns))])
+
+    def empty(self) -> np.ndarray:
+        return np.zeros((len(self.columns), self._n_bins), dtype=np.int64)
+
+    def bins(self, data: np.ndarray) -> np.ndarray:
+        """Flat bin index of every value of `data` (rows x columns) into a counts array."""
+        indices = (data[:, :, None] >= self._edge_table[None]).sum(axis=2)
+        return (indices + self._offsets).ravel()
+
+    def count(self, data: np.ndarray) -> np.ndarray:
+        counts = np.bincount(self.bins(data), minlength=len(self.columns) * self._n_bins)
+        return counts.reshape(len(self.columns), self._n_bins)
+
+
+def compare(reference: np.ndarray, live: np.ndarray) -> Dict[str, float]:
+    """PSI and KS distance between two count vectors over the same bins."""
+    p_ref = reference / max(reference.sum(), 1)
+    p_live = live / max(live.sum(), 1)
+    smoothed_ref = np.maximum(p_ref, _EPSILON)
+    smoothed_live = np.maximum(p_live, _EPSILON)
+    psi = float(np.sum((smoothed_live - smoothed_ref) * np.log(smoothed_live / smoothed_ref)))
+    ks = float(np.max(np.abs(np.cumsum(p_live) - np.cumsum(p_ref))))
+    return {'psi': round(psi, 4), 'ks': round(ks, 4)}
+
+
+def classify(psi: float) -> str:
+    if psi < PSI_MODERATE:
+        return 'stable'
+    if psi < PSI_DRIFT:
+        return 'moderate'
+    return 'drift'
+
+
+class DriftMonitor:
+    def __init__(self, name: str, sketch: HistogramSketch, reference: np.ndarray, window_seconds: float = 3600.0,
+                 flush_every: int = 256):
+        self.name = name
+        self.sketch = sketch
+        self.reference = reference
+        self.window_seconds = window_seconds
+        self.flush_every = flush_every
+        self._pending = collections.deque()
+        self._current = sketch.empty().ravel()
+        self._previous = sketch.empty().ravel()
+        self._window_start = time.time()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_training_csv(cls, handler, path: str, n_bins: int = DEFAULT_BINS,
+                          window_seconds: float = 3600.0) -> 'DriftMonitor':
+        """Bin edges and reference counts from the handler's training CSV and its model's scores on it."""
+        data = read_training_matrix(handler, path)
+        scores = handler.model.decision_function(handler.scaler_info['scaler'].transform(data))
+        data = np.column_stack([data, scores])
+        sketch = HistogramSketch.from_reference(list(handler.scaler_info['columns']) + [SCORE_COLUMN], data, n_bins)
+        return cls(handler.name, sketch, sketch.count(data), window_seconds)
+
+    def observe(self, rows: np.ndarray, scores) -> None:
+        """Queue raw feature rows and their scores. Called on the request path."""
+        self._pending.append((rows, scores))
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        """Bin the queued rows into the current window."""
+        with self._lock:
+            # deque.popleft is atomic, so rows queued meanwhile wait for the next flush.
+            batch = [self._pending.popleft() for _ in range(len(self._pending))]
+            if not batch:
+                return
+            data = np.column_stack([
+                np.concatenate([rows for rows, _ in batch]),
+                np.concatenate([np.asarray(scores, dtype=float) for _, scores in batch]),
+            ])
+            now = time.time()
+            if now - self._window_start >= self.window_seconds:
+                self._rotate(now)
+            self._current += np.bincount(self.sketch.bins(data), minlength=len(self._current))
+
+    def _rotate(self, now: float) -> None:
+        # After a whole window without traffic, the previous window is empty.
+        elapsed_windows = (now - self._window_start) // self.window_seconds
+        self._previous = self._current if elapsed_windows < 2 else self.sketch.empty().ravel()
+        self._current = self.sketch.empty().ravel()
+        self._window_start += elapsed_windows * self.window_seconds
+
+    def reset(self) -> None:
+        with self._lock:
+            self._pending.clear()
+            self._current = self.sketch.empty().ravel()
+            self._previous = self.sketch.empty().ravel()
+            self._window_start = time.time()
+
+    def report(self) -> dict:
+        self.flush()
+        with self._lock:
+            if time.time() - self._window_start >= self.window_seconds:
+                self._rotate(time.time())
+            live = (self._current + self._previous).reshape(self.reference.shape)
+        observed = int(live[0].sum())
+        columns = {}
+        for i, column in enumerate(self.sketch.columns):
+            comparison = compare(self.reference[i], live[i]) if observed else {'psi': None, 'ks': None}
+            columns[column] = {
+                **comparison,
+                'status': classify(comparison['psi']) if observed >= MIN_OBSERVATIONS else None,
+            }
+        drifted = [column for column, stats in columns.items() if stats['status'] == 'drift']
+        return {
+            'model': self.name,
+            'observed': observed,
+            'window_seconds': self.window_seconds,
+            'drifted': drifted,
+            'columns': columns,
+        }
+
+
+def from_env(handler, path: str) -> Optional[DriftMonitor]:
+    if os.environ.get('SAFARX_DRIFT', '1') == '0':
+        return None
+    try:
+        return DriftMonitor.from_training_csv(
+            handler, path, window_seconds=float(os.environ.get('SAFARX_DRIFT_WINDOW', '3600'))
+        )
+    except Exception as e:
+        print(f"Warning: drift monitoring disabled for {handler.name}: {e}")
+        return None
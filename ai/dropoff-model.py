@@ -2,6 +2,7 @@ import pandas as pd
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 import joblib
+from model_artifact import export_model
 
 df = pd.read_csv('./dropoff_data.csv')
 
@@ -45,3 +46,7 @@ scaler_and_columns = {
 }
 joblib.dump(scaler_and_columns, scaler_path)
 print(f"Scaler and column info saved to {scaler_path}")
+
+artifact_path = 'isolation_forest_model_dropoff.safx'
+export_model(model, scaler_and_columns, artifact_path)
+print(f"Model artifact exported to {artifact_path}")
@@ -0,0 +1,55 @@
+"""
+Fused scoring of one device snapshot with both anomaly models.
+
+A snapshot carries the union of the dropoff and inactivity payload fields; each
+handler's extract_features picks the fields it needs from the same dict, so both
+feature vectors come from a single parse. `area_risk` is shared by the two
+models and can be supplied by the client, looked up in the precomputed geo risk
+layer (geo_risk.py), or derived from the location's safety score risk level
+('low'/'med'/'high', the same vocabulary the models use).
+
+The unified verdict is the higher of the two models' risk levels, raised to
+HIGH when both models flag the snapshot independently.
+"""
+
+from typing import Optional
+
+RISK_LEVELS = ('LOW', 'MEDIUM', 'HIGH')
+
+
+def unified_verdict(dropoff: dict, inactivity: dict) -> dict:
+    if dropoff['is_anomaly'] and inactivity['is_anomaly']:
+        risk_level = 'HIGH'
+    else:
+        risk_level = max(dropoff['risk_level'], inactivity['risk_level'], key=RISK_LEVELS.index)
+    return {
+        'is_anomaly': dropoff['is_anomaly'] or inactivity['is_anomaly'],
+        'risk_level': risk_level,
+    }
+
+
+def score_snapshot(payload_data: dict, dropoff_handler, inactivity_handler,
+                   safety_score: Optional[float] = None, area_risk_source: str = 'payload') -> dict:
+    """
+    Score a snapshot with both handlers and combine the results.
+
+    Args:
+        payload_data: Union of the dropoff and inactivity payload fields, including area_risk
+        dropoff_handler: Handler for the drop-off model
+        inactivity_handler: Handler for the inactivity model
+        safety_score: The safety score area_risk was derived from, if any
+        area_risk_source: Where area_risk came from ('payload', 'geo_layer' or 'safety_score')
+
+    Returns:
+        Dictionary with the unified verdict and each model's result
+    """
+    dropoff = dropoff_handler.predict(payload_data)
+    inactivity = inactivity_handler.predict(payload_data)
+    return {
+        **unified_verdict(dropoff, inactivity),
+        'dropoff': dropoff,
+        'inactivity': inactivity,
+        'area_risk': payload_data['area_risk'],
+        'area_risk_source': area_risk_source,
+        'safety_score': safety_score,
+    }
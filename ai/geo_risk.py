@@ -0,0 +1,198 @@
+"""
+Precomputed area risk layer, so clients can send lat/lon instead of area_risk.
+
+The layer is a dense lat/lon raster of 'low'/'med'/'high' codes (one byte per
+cell) built offline from LocationSafetyCalculator risk levels and stored in the
+same .safx container as the models (see model_artifact.py). Loading maps it
+read-only and a lookup is two multiplications and an index, with no external
+calls on the request path. Cells outside the raster or without a score resolve
+to None. A geofenced point is at least GEOFENCED_RISK whatever its cell
+scored, since cells are scored at their centre (see `geofenced`).
+
+Usage (from the `ai/` directory):
+    python geo_risk.py build MIN_LAT MIN_LON MAX_LAT MAX_LON [--cell DEG] [--remoteness-only]
+                             [--towers CSV] [--geofences GEOJSON] [--out geo_risk.safx]
+    python geo_risk.py lookup LAT LON [--layer geo_risk.safx]
+
+A full build calls the Overpass and met.no APIs for every cell, so it is only
+practical for small areas; --remoteness-only scores cells from the cell tower
+CSV (and geofences) alone, through the same weighting as the full score with
+the accessibility and environment components taken as 0. Remoteness carries
+only 0.2 of that weight, so such a layer is a lower bound on the full layer's
+risk: cells come out 'low', or 'med' inside geofences, never 'high'.
+"""
+
+import os
+import sys
+import argparse
+from typing import Optional
+
+import numpy as np
+
+from model_artifact import read_artifact, write_artifact
+
+AREA_RISKS = ('low', 'med', 'high')
+NO_DATA = 255
+LAYER_PATH = os.environ.get('SAFARX_GEO_RISK_LAYER', './geo_risk.safx')
+# The geofence weight (0.4) alone takes the safety score below 80, so no
+# geofenced point is 'low' (see LocationSafetyCalculator._combine_scores).
+GEOFENCED_RISK = 'med'
+
+
+class GeoRiskLayer:
+    def __init__(self, codes: np.ndarray, min_lat: float, min_lon: float, cell_deg: float):
+        self.codes = codes
+        self.min_lat = min_lat
+        self.min_lon = min_lon
+        self.cell_deg = cell_deg
+        self._inverse_cell = 1.0 / cell_deg
+        self._categories = np.array(AREA_RISKS + (None,), dtype=object)
+
+    @classmethod
+    def load(cls, path: str) -> 'GeoRiskLayer':
+        metadata, arrays = read_artifact(path)
+        if metadata.get('kind') != 'geo_risk':
+            raise ValueError(f"{path} does not contain a geo risk layer")
+        if tuple(metadata['categories']) != AREA_RISKS:
+            raise ValueError(f"Unexpected area risk categories {metadata['categories']} in {path}")
+        return cls(arrays['codes'], metadata['min_lat'], metadata['min_lon'], metadata['cell_deg'])
+
+    def save(self, path: str) -> None:
+        rows, cols = self.codes.shape
+        metadata = {
+            'kind': 'geo_risk',
+            'categories': list(AREA_RISKS),
+            'min_lat': self.min_lat,
+            'min_lon': self.min_lon,
+            'cell_deg': self.cell_deg,
+            'max_lat': self.min_lat + rows * self.cell_deg,
+            'max_lon': self.min_lon + cols * self.cell_deg,
+        }
+        write_artifact(path, metadata, {'codes': self.codes.astype(np.uint8)})
+
+    def lookup(self, lat: float, lon: float) -> Optional[str]:
+        row = int((lat - self.min_lat) * self._inverse_cell)
+        col = int((lon - self.min_lon) * self._inverse_cell)
+        rows, cols = self.codes.shape
+        if lat < self.min_lat or lon < self.min_lon or row >= rows or col >= cols:
+            return None
+        code = self.codes[row, col]
+        return AREA_RISKS[code] if code < len(AREA_RISKS) else None
+
+    def lookup_many(self, lats, lons) -> np.ndarray:
+        """Vectorized lookup; returns an object array with None where there is no data."""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        rows = np.floor((lats - self.min_lat) * self._inverse_cell).astype(np.int64)
+        cols = np.floor((lons - self.min_lon) * self._inverse_cell).astype(np.int64)
+        inside = (rows >= 0) & (cols >= 0) & (rows < self.codes.shape[0]) & (cols < self.codes.shape[1])
+        codes = np.full(lats.shape, NO_DATA, dtype=np.int64)
+        codes[inside] = self.codes[rows[inside], cols[inside]]
+        return self._categories[np.minimum(codes, len(AREA_RISKS))]
+
+
+def build_layer(score_cell, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                cell_deg: float) -> GeoRiskLayer:
+    """
+    Evaluate `score_cell(lat, lon) -> area risk` at the centre of every cell.
+
+    Args:
+        score_cell: Returns 'low', 'med', 'high', or None for no data
+        min_lat, min_lon, max_lat, max_lon: Bounding box in degrees
+        cell_deg: Cell size in degrees
+
+    Returns:
+        The populated GeoRiskLayer
+    """
+    rows = int(np.ceil((max_lat - min_lat) / cell_deg))
+    cols = int(np.ceil((max_lon - min_lon) / cell_deg))
+    codes = np.full((rows, cols), NO_DATA, dtype=np.uint8)
+    for row in range(rows):
+        lat = min_lat + (row + 0.5) * cell_deg
+        for col in range(cols):
+            lon = min_lon + (col + 0.5) * cell_deg
+            risk = score_cell(lat, lon)
+            if risk is not None:
+                codes[row, col] = AREA_RISKS.index(risk)
+        print(f"Row {row + 1}/{rows} done")
+    return GeoRiskLayer(codes, min_lat, min_lon, cell_deg)
+
+
+def _remoteness_risk(calculator):
+    def score_cell(lat: float, lon: float) -> str:
+        # The lookups the build skips count as no risk, as _combine_scores does
+        # when they fail.
+        return calculator._combine_scores({
+            'remoteness_score': calculator._calculate_remoteness_score(lat, lon),
+            'accessibility_score': None,
+            'environmental_hazard_score': None,
+            'geofence_score': 1.0 if calculator.is_geofenced(lat, lon) else 0.0,
+        })[1]
+    return score_cell
+
+
+layer: Optional[GeoRiskLayer] = None
+
+
+def load_layer(path: str = LAYER_PATH) -> bool:
+    global layer
+    if not os.path.exists(path):
+        print(f"Warning: geo risk layer not found at {path}, payloads must send area_risk")
+        return False
+    try:
+        layer = GeoRiskLayer.load(path)
+        return True
+    except Exception as e:
+        print(f"Error loading geo risk layer: {e}")
+        return False
+
+
+def lookup(lat: float, lon: float) -> Optional[str]:
+    """Area risk at (lat, lon) from the loaded layer, or None."""
+    if layer is None:
+        return None
+    return layer.lookup(lat, lon)
+
+
+def geofenced(area_risk: Optional[str]) -> str:
+    """Area risk of a geofenced point whose cell scored `area_risk` (None for no data)."""
+    if area_risk is None:
+        return GEOFENCED_RISK
+    return max(area_risk, GEOFENCED_RISK, key=AREA_RISKS.index)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the precomputed area risk layer.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build')
+    build.add_argument('bbox', nargs=4, type=float, metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'))
+    build.add_argument('--cell', type=float, default=0.01, help="cell size in degrees (default 0.01, ~1 km)")
+    build.add_argument('--remoteness-only', action='store_true', help="score from the cell tower CSV and geofences only (a lower bound on the risk)")
+    build.add_argument('--towers', default='./safetyscore/cell tower coverage/404.csv')
+    build.add_argument('--geofences', default=os.environ.get('SAFARX_GEOFENCES') or None,
+                       help="GeoJSON geofence polygons (default: $SAFARX_GEOFENCES)")
+    build.add_argument('--out', default=LAYER_PATH)
+    query = commands.add_parser('lookup')
+    query.add_argument('lat', type=float)
+    query.add_argument('lon', type=float)
+    query.add_argument('--layer', default=LAYER_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == 'lookup':
+        print(GeoRiskLayer.load(args.layer).lookup(args.lat, args.lon))
+        return
+
+    from safetyscore import LocationSafetyCalculator
+
+    calculator = LocationSafetyCalculator(cell_tower_csv_path=args.towers, geofence_path=args.geofences)
+    if args.remoteness_only:
+        score_cell = _remoteness_risk(calculator)
+    else:
+        score_cell = lambda lat, lon: calculator.calculate_safety_score(lat, lon)[1]
+    built = build_layer(score_cell, *args.bbox, args.cell)
+    built.save(args.out)
+    print(f"Wrote {built.codes.shape[0]}x{built.codes.shape[1]} cells to {args.out}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
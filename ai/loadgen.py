@@ -0,0 +1,263 @@
+"""
+Load generator that simulates a fleet of devices against a running service.
+
+Payloads come from the same generators the models were trained on: inactivity
+features from ProlongedInactivityDATA.py (hourly activity, motion,
+displacement, interaction gaps, missed pings, battery) and dropoff features
+from generate_anamolous_data.py (connectivity, ping gaps, GPS accuracy and its
+anomaly scenarios). Each device keeps its device id and area risk for the
+whole run, and a simulated clock advances the hour of day the inactivity
+features are drawn for.
+
+Requests are sent open-loop at the target rate, so a slow server shows up as
+latency rather than as a lower send rate; requests that would exceed
+--max-in-flight are counted as skipped instead. During anomaly bursts a random
+subset of devices sends anomalous payloads.
+
+Usage (from the `ai/` directory, with the service running):
+    python loadgen.py --url http://localhost:8000 --devices 1000 --rps 200 --duration 60
+    python loadgen.py --rps 500 --burst-every 20 --burst-duration 5 --json report.json
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+import collections
+from typing import Dict, List, Optional
+
+import numpy as np
+import httpx
+
+import ProlongedInactivityDATA as inactivity_data
+import generate_anamolous_data as dropoff_data
+
+PERCENTILES = (50, 90, 95, 99, 99.9)
+ENDPOINTS = {'inactivity': '/api/inactivity', 'dropoff': '/api/dropoff'}
+
+
+def inactivity_samples(hour: int) -> List[dict]:
+    """A pool of N_SAMPLES inactivity payloads for one hour of the day, drawn like the training data."""
+    n = inactivity_data.N_SAMPLES
+    active_hours = np.full(n, hour)
+    _, _, circadian_rhythm = inactivity_data.create_cyclical_time_features(active_hours)
+    motion_state = inactivity_data.generate_motion_state(circadian_rhythm)
+    displacement_m = inactivity_data.generate_displacement(circadian_rhythm, motion_state)
+    columns = {
+        'hour': active_hours,
+        'motion_state': motion_state,
+        'displacement_m': displacement_m,
+        'time_since_last_interaction_min': inactivity_data.generate_time_since_last_interaction(circadian_rhythm),
+        'missed_ping_count': inactivity_data.generate_missed_ping_count(active_hours, circadian_rhythm),
+        'battery_level_percent': inactivity_data.generate_battery_level(active_hours),
+        'is_expected_active': inactivity_data.generate_expected_activity(circadian_rhythm, displacement_m),
+    }
+    return [{name: values[i].item() for name, values in columns.items()} for i in range(n)]
+
+
+def anomalous_inactivity_sample(hour: int) -> dict:
+    """Prolonged inactivity: no movement or interaction for hours while the user should be active."""
+    return {
+        'hour': hour,
+        'motion_state': 0,
+        'displacement_m': round(random.uniform(0, inactivity_data.MIN_MOVEMENT_M), 2),
+        'time_since_last_interaction_min': random.randint(1700, 3000),
+        'missed_ping_count': random.randint(4, 10),
+        'battery_level_percent': random.randint(5, 30),
+        'is_expected_active': 1,
+    }
+
+
+def dropoff_sample(anomalous: bool) -> dict:
+    values = dropoff_data.generate_anomalous_sample() if anomalous else dropoff_data.generate_normal_sample()
+    return {
+        'network_connectivity_state': values[0],
+        'acc_vs_loc': values[1],
+        'time_since_last_successful_ping': values[2],
+        'gps_accuracy': [round(reading, 2) for reading in values[3:8]],
+        'area_risk': values[8],
+    }
+
+
+class Fleet:
+    def __init__(self, n_devices: int, start_hour: float = 8.0, sim_speed: float = 900.0):
+        """
+        Args:
+            n_devices: Simulated devices
+            start_hour: Hour of day the simulated clock starts at
+            sim_speed: Simulated seconds per real second (900: a 15 minute
+                reporting window per second)
+        """
+        self.device_ids = [f"loadgen-{i:06d}" for i in range(n_devices)]
+        self.area_risk = list(inactivity_data.generate_area_risk_labels(n_devices))
+        self.start_hour = start_hour
+        self.sim_speed = sim_speed
+        self.bursting: set = set()
+        self._pools: Dict[int, List[dict]] = {}
+        self._order = collections.deque()
+
+    def hour(self, elapsed: float) -> int:
+        return int(self.start_hour + elapsed * self.sim_speed / 3600) % inactivity_data.HOURS_IN_DAY
+
+    def next_device(self) -> int:
+        """Devices report in a shuffled round robin, like pings at the end of each window."""
+        if not self._order:
+            order = list(range(len(self.device_ids)))
+            random.shuffle(order)
+            self._order.extend(order)
+        return self._order.popleft()
+
+    def start_burst(self, fraction: float) -> None:
+        self.bursting = set(random.sample(range(len(self.device_ids)), max(int(len(self.device_ids) * fraction), 1)))
+
+    def payload(self, model: str, device: int, elapsed: float) -> dict:
+        anomalous = device in self.bursting
+        if model == 'dropoff':
+            payload = dropoff_sample(anomalous)
+            if not anomalous:
+                payload['area_risk'] = self.area_risk[device]
+        else:
+            hour = self.hour(elapsed)
+            if anomalous:
+                payload = anomalous_inactivity_sample(hour)
+            else:
+                pool = self._pools.get(hour)
+                if not pool:
+                    pool = self._pools[hour] = inactivity_samples(hour)
+                payload = pool.pop()
+            payload['area_risk'] = self.area_risk[device]
+        payload['device_id'] = self.device_ids[device]
+        return payload
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.defaultdict(collections.Counter)
+        self.anomalies = collections.Counter()
+        self.skipped = 0
+
+    def record(self, key: tuple, latency: float, error: Optional[str], is_anomaly: Optional[bool]) -> None:
+        self.latencies[key].append(latency)
+        if error is not None:
+            self.errors[key][error] += 1
+        elif is_anomaly:
+            self.anomalies[key] += 1
+
+    def report(self, elapsed: float) -> dict:
+        report = {'duration_seconds': round(elapsed, 2), 'skipped': self.skipped, 'endpoints': {}}
+        for model, burst in sorted(self.latencies):
+            samples = np.asarray(self.latencies[(model, burst)]) * 1e3
+            errors = sum(self.errors[(model, burst)].values())
+            report['endpoints'][f"{model}{'_burst' if burst else ''}"] = {
+                'requests': len(samples),
+                'requests_per_second': round(len(samples) / elapsed, 1),
+                'error_rate': round(errors / len(samples), 4),
+                'errors': dict(self.errors[(model, burst)]),
+                'anomaly_rate': round(self.anomalies[(model, burst)] / max(len(samples) - errors, 1), 4),
+                'latency_ms': {
+                    **{f"p{p:g}": round(float(np.percentile(samples, p)), 2) for p in PERCENTILES},
+                    'max': round(float(samples.max()), 2),
+                },
+            }
+        return report
+
+
+async def _send(client: httpx.AsyncClient, recorder: Recorder, key: tuple, payload: dict,
+                in_flight: asyncio.Semaphore) -> None:
+    start = time.perf_counter()
+    error = is_anomaly = None
+    try:
+        response = await client.post(ENDPOINTS[key[0]], json=payload)
+        if response.status_code == 200:
+            is_anomaly = response.json()['is_anomaly']
+        else:
+            error = f"http_{response.status_code}"
+    except httpx.HTTPError as e:
+        error = type(e).__name__
+    finally:
+        in_flight.release()
+    recorder.record(key, time.perf_counter() - start, error, is_anomaly)
+
+
+async def run(url: str, fleet: Fleet, rps: float, duration: float, inactivity_share: float = 0.5,
+              max_in_flight: int = 1000, burst_every: float = 0.0, burst_duration: float = 5.0,
+              burst_devices: float = 0.05, timeout: float = 10.0) -> dict:
+    recorder = Recorder()
+    in_flight = asyncio.Semaphore(max_in_flight)
+    tasks = set()
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        for i in range(int(rps * duration)):
+            # Open loop: request i goes out at start + i / rps whatever the server's latency.
+            delay = start + i / rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elapsed = time.perf_counter() - start
+            burst = bool(burst_every) and elapsed % burst_every >= burst_every - burst_duration
+            if burst and not fleet.bursting:
+                fleet.start_burst(burst_devices)
+            elif not burst and fleet.bursting:
+                fleet.bursting = set()
+
+            if in_flight.locked():
+                recorder.skipped += 1
+                continue
+            await in_flight.acquire()
+            device = fleet.next_device()
+            model = 'inactivity' if random.random() < inactivity_share else 'dropoff'
+            key = (model, device in fleet.bursting)
+            task = asyncio.create_task(_send(client, recorder, key, fleet.payload(model, device, elapsed), in_flight))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        return recorder.report(time.perf_counter() - start)
+
+
+def print_report(report: dict) -> None:
+    print(f"{'endpoint':18s} {'requests':>9s} {'req/s':>8s} {'errors':>8s} {'anomaly':>8s} "
+          + ' '.join(f"{'p' + format(p, 'g'):>8s}" for p in PERCENTILES) + f" {'max':>8s}  (ms)")
+    for name, stats in report['endpoints'].items():
+        latency = stats['latency_ms']
+        print(f"{name:18s} {stats['requests']:9d} {stats['requests_per_second']:8.1f} {stats['error_rate']:8.2%} "
+              f"{stats['anomaly_rate']:8.2%} "
+              + ' '.join(f"{latency['p' + format(p, 'g')]:8.2f}" for p in PERCENTILES) + f" {latency['max']:8.2f}")
+    print(f"skipped (over --max-in-flight): {report['skipped']}, duration: {report['duration_seconds']}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--rps', type=float, default=100.0, help='target requests per second')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds')
+    parser.add_argument('--inactivity-share', type=float, default=0.5, help='fraction of requests to /api/inactivity')
+    parser.add_argument('--max-in-flight', type=int, default=1000)
+    parser.add_argument('--start-hour', type=float, default=8.0, help='simulated hour of day at the start')
+    parser.add_argument('--sim-speed', type=float, default=900.0, help='simulated seconds per real second')
+    parser.add_argument('--burst-every', type=float, default=0.0, help='seconds between anomaly bursts (0: none)')
+    parser.add_argument('--burst-duration', type=float, default=5.0, help='seconds')
+    parser.add_argument('--burst-devices', type=float, default=0.05, help='fraction of devices in a burst')
+    parser.add_argument('--seed', type=int, help='seed for reproducible payloads')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+    fleet = Fleet(args.devices, args.start_hour, args.sim_speed)
+    report = asyncio.run(run(
+        args.url, fleet, args.rps, args.duration, args.inactivity_share, args.max_in_flight,
+        args.burst_every, args.burst_duration, args.burst_devices,
+    ))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
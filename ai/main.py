@@ -1,60 +1,369 @@
-from fastapi import FastAPI, HTTPException
+import os
+import hmac
+import json
+import asyncio
+import threading
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, WebSocket
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from fastapi.routing import APIRoute
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Literal, Optional, Tuple
+import metrics
+import wire
+import streaming
+import fusion
+import geo_risk
+import online_learning
+import drift
+import shadow
+import router
+import alerts
+import prediction_log
+import model_pool
+from profiling import profiler
 from model_handler import model_handler
 from model_handler import inactivity_model_handler
+from safetyscore import DiskCache, LocationSafetyCalculator, LookupCache
+from safetyscore.route import route_length_m
+
+CELL_TOWER_CSV_PATH = os.environ.get('SAFARX_CELL_TOWER_CSV', './safetyscore/cell tower coverage/404.csv')
+GEOFENCE_PATH = os.environ.get('SAFARX_GEOFENCES') or None
+# Number of most-queried cells whose weather and amenity data is refreshed in
+# the background; 0 (the default) disables pre-warming. Each process refreshes
+# on its own, so the Overpass and met.no rate limits apply per process.
+PREWARM_HOTSPOTS = int(os.environ.get('SAFARX_PREWARM_HOTSPOTS', '0'))
+# SQLite file shared by all workers that persists Overpass and weather lookups;
+# unset (the default) keeps them in memory only.
+LOOKUP_CACHE_DB = os.environ.get('SAFARX_LOOKUP_CACHE_DB') or None
+# Shared token the /admin routes require as "Authorization: Bearer <token>";
+# unset, the admin routes are disabled.
+ADMIN_TOKEN = os.environ.get('SAFARX_ADMIN_TOKEN') or None
+MAX_ROUTE_SAMPLES = int(os.environ.get('SAFARX_MAX_ROUTE_SAMPLES', '5000'))
+# Refresh the models from live traffic (see online_learning.py for the budgets).
+ONLINE_LEARNING = os.environ.get('SAFARX_ONLINE_LEARNING', '0') == '1'
+MODEL_HANDLERS = {'dropoff': model_handler, 'inactivity': inactivity_model_handler}
+# Requests with a device_id are scored by the worker process the device hashes
+# to when SAFARX_WORKERS > 0 (see router.py).
+inference_pool: Optional[router.WorkerPool] = None
+# Ships HIGH risk anomalies to the SAFARX_ALERT_* sinks (see alerts.py).
+alert_pipeline: Optional[alerts.AlertPipeline] = None
+# Parquet log of every scored request (SAFARX_PREDICTION_LOG_DIR, see prediction_log.py).
+predictions: Optional[prediction_log.PredictionLog] = None
+
+
+class InstrumentedRoute(APIRoute):
+    """
+    Times every request. Body parsing and pydantic validation run inside
+    FastAPI's handler before the endpoint is entered, so the endpoint marks the
+    'validation' stage as its first action, and everything after the endpoint
+    returns is recorded as the 'response' stage.
+
+    Routes listed in WIRE_ENDPOINTS hand msgpack and packed-record bodies to
+    their wire handler instead, bypassing the pydantic request model.
+    """
+
+    def get_route_handler(self):
+        route_handler = super().get_route_handler()
+        endpoint = self.name
+
+        async def instrumented_handler(request):
+            clock, token = metrics.start_request(endpoint)
+            try:
+                wire_handler = WIRE_ENDPOINTS.get(endpoint)
+                if wire_handler is not None and wire.is_binary(request.headers.get('content-type')):
+                    response = await wire_handler(request)
+                else:
+                    response = await route_handler(request)
+                if clock.last != clock.start:
+                    # Only endpoints that marked their stages get a response stage.
+                    clock.mark('response')
+                return response
+            except RequestValidationError:
+                metrics.ERRORS.inc(endpoint, 'validation')
+                raise
+            except HTTPException as e:
+                metrics.ERRORS.inc(endpoint, 'http_%d' % e.status_code)
+                raise
+            except Exception:
+                metrics.ERRORS.inc(endpoint, 'internal')
+                raise
+            finally:
+                metrics.finish_request(clock, token)
+
+        return instrumented_handler
+
 
 app = FastAPI()
+app.router.route_class = InstrumentedRoute
+
+async def require_admin_token(authorization: Optional[str] = Header(None)):
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=403, detail="Admin routes are disabled (set SAFARX_ADMIN_TOKEN)")
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+ADMIN = [Depends(require_admin_token)]
+
+# The categories of wire.AREA_RISKS; anything else is a 422.
+AreaRisk = Literal['low', 'med', 'high']
 
 class DataPayload(BaseModel):
+    # Routes the request to the device's inference worker, if workers are enabled.
+    device_id: Optional[str] = Field(None, max_length=128)
     network_connectivity_state: int
     acc_vs_loc: int
     time_since_last_successful_ping: int
     gps_accuracy: List[float] = Field(..., min_items=5, max_items=5)
-    area_risk: str
+    # Either area_risk, or lat/lon to look it up in the geo risk layer.
+    area_risk: Optional[AreaRisk] = None
+    lat: Optional[float] = Field(None, ge=-90, le=90)
+    lon: Optional[float] = Field(None, ge=-180, le=180)
+    # Scores with the region's model, if one is deployed (see model_pool.py);
+    # without it the region is looked up from lat/lon.
+    region: Optional[str] = Field(None, max_length=128)
+
+class Driver(BaseModel):
+    feature: str
+    # Mean per-tree shortening of the isolation path credited to the feature
+    contribution: float
 
 class PredictionResponse(BaseModel):
     is_anomaly: bool
     risk_level: str
+    # Only with ?explain=true
+    drivers: Optional[List[Driver]] = None
 
 class InactivityPayload(BaseModel):
+    device_id: Optional[str] = Field(None, max_length=128)
     hour: int = Field(..., ge=0, le=23)
     motion_state: int = Field(..., ge=0, le=1)
     displacement_m: float
     time_since_last_interaction_min: int
     missed_ping_count: int
-    area_risk: str
+    area_risk: Optional[AreaRisk] = None
+    lat: Optional[float] = Field(None, ge=-90, le=90)
+    lon: Optional[float] = Field(None, ge=-180, le=180)
     battery_level_percent: int = Field(..., ge=0, le=100)
     is_expected_active: int = Field(..., ge=0, le=1)
+    region: Optional[str] = Field(None, max_length=128)
 
 class InactivityResponse(BaseModel):
     is_anomaly: bool
     risk_level: str
+    drivers: Optional[List[Driver]] = None
+
+class SafetyPayload(BaseModel):
+    lat: float = Field(..., ge=-90, le=90)
+    lon: float = Field(..., ge=-180, le=180)
+    # None: resolved from the geofence polygons (SAFARX_GEOFENCES), if loaded.
+    is_area_geofenced: Optional[bool] = None
+
+class SafetyResponse(BaseModel):
+    safety_score: float
+    risk_level: str
+
+class RoutePayload(BaseModel):
+    # (lat, lon) vertices of the route
+    points: List[Tuple[float, float]] = Field(..., min_items=2)
+    spacing_m: float = Field(200.0, gt=0)
+    # None: resolved per sample from the geofence polygons, if loaded.
+    is_area_geofenced: Optional[bool] = None
+
+class DeviceSnapshotPayload(BaseModel):
+    device_id: Optional[str] = Field(None, max_length=128)
+    network_connectivity_state: int
+    acc_vs_loc: int
+    time_since_last_successful_ping: int
+    gps_accuracy: List[float] = Field(..., min_items=5, max_items=5)
+    hour: int = Field(..., ge=0, le=23)
+    motion_state: int = Field(..., ge=0, le=1)
+    displacement_m: float
+    time_since_last_interaction_min: int
+    missed_ping_count: int
+    battery_level_percent: int = Field(..., ge=0, le=100)
+    is_expected_active: int = Field(..., ge=0, le=1)
+    # Either area_risk, or lat/lon to resolve it from the geo risk layer, falling
+    # back to computing the location's safety score.
+    area_risk: Optional[AreaRisk] = None
+    lat: Optional[float] = Field(None, ge=-90, le=90)
+    lon: Optional[float] = Field(None, ge=-180, le=180)
+    is_area_geofenced: Optional[bool] = None
+    region: Optional[str] = Field(None, max_length=128)
+
+class DeviceRiskResponse(BaseModel):
+    is_anomaly: bool
+    risk_level: str
+    dropoff: PredictionResponse
+    inactivity: InactivityResponse
+    area_risk: str
+    area_risk_source: str
+    safety_score: Optional[float] = None
+
+class ProfilingConfig(BaseModel):
+    enabled: Optional[bool] = None
+    sample_every: Optional[int] = Field(None, ge=1)
+    interval_ms: Optional[float] = Field(None, gt=0)
+    mode: Optional[str] = None
+
+class ShadowConfig(BaseModel):
+    # File name of a .safx artifact in the SAFARX_SHADOW_MODELS directory
+    artifact: str
+    sample_rate: float = Field(0.1, ge=0, le=1)
+    canary_fraction: float = Field(0.0, ge=0, le=1)
+
+safety_calculator: Optional[LocationSafetyCalculator] = None
+_safety_calculator_lock = threading.Lock()
+
+def profile_safety():
+    # Labelled by the endpoint, e.g. 'safety' or 'device'; the thread the
+    # calculator works in carries the request's context.
+    return profiler.profile(metrics.request_endpoint('safety'))
+
+def get_safety_calculator() -> LocationSafetyCalculator:
+    # Built on first use: loading the tower CSV imports pandas, which the
+    # prediction endpoints never need.
+    global safety_calculator
+    with _safety_calculator_lock:
+        if safety_calculator is None:
+            lookup_cache = LookupCache(store=DiskCache(LOOKUP_CACHE_DB) if LOOKUP_CACHE_DB else None)
+            safety_calculator = LocationSafetyCalculator(
+                cell_tower_csv_path=CELL_TOWER_CSV_PATH, geofence_path=GEOFENCE_PATH,
+                lookup_cache=lookup_cache, profile=profile_safety
+            )
+            if PREWARM_HOTSPOTS > 0:
+                safety_calculator.start_prewarm(top_n=PREWARM_HOTSPOTS)
+    return safety_calculator
 
 @app.on_event("startup")
 async def startup_event():
     model_handler.load_model_and_scaler()
     inactivity_model_handler.load_model_and_scaler()
+    geo_risk.load_layer()
+    for handler in MODEL_HANDLERS.values():
+        if handler.model is not None and handler.drift is None:
+            handler.drift = drift.from_env(handler, handler.training_data_path)
+    if ONLINE_LEARNING:
+        for handler in MODEL_HANDLERS.values():
+            if handler.model is not None and handler.online is None:
+                handler.online = online_learning.from_env(handler)
+                handler.online.on_swap = publish_model
+                handler.online.start()
+    global inference_pool, alert_pipeline, predictions
+    if predictions is None:
+        predictions = prediction_log.from_env()
+    for handler in MODEL_HANDLERS.values():
+        handler.prediction_log = predictions
+    if model_pool.regions is None:
+        model_pool.load_regions()
+    for handler in MODEL_HANDLERS.values():
+        if handler.model is not None and handler.regions is None:
+            handler.regions = model_pool.from_env(handler)
+    if inference_pool is None:
+        inference_pool = router.from_env(observe=observe_routed)
+    if alert_pipeline is None:
+        alert_pipeline = alerts.from_env()
+    if alert_pipeline is not None:
+        alert_pipeline.start()
+    metrics.REGISTRY.start_flusher()
 
-@app.post("/api/dropoff", response_model=PredictionResponse)
-async def predict_dropoff_anomaly(payload: DataPayload):
+@app.on_event("shutdown")
+async def shutdown_event():
+    if inference_pool is not None:
+        await asyncio.to_thread(inference_pool.close)
+    if alert_pipeline is not None:
+        await alert_pipeline.stop()
+    for handler in MODEL_HANDLERS.values():
+        if handler.regions is not None:
+            await asyncio.to_thread(handler.regions.close)
+    if predictions is not None:
+        await asyncio.to_thread(predictions.close)
+
+async def predict_routed(handler, device_id: str, payload_data: dict) -> dict:
+    """
+    Score a request on the device's inference worker. Candidates are only
+    loaded here, so canary requests are answered in this process, and the
+    shadow copy is queued here; the worker's feature row and score reach this
+    process's drift monitor and online learner through observe_routed.
+    """
+    evaluator = shadow.evaluators.get(handler.name)
+    canary = evaluator is not None and evaluator.pick_canary()
+    if canary:
+        result = evaluator.candidate.predict(payload_data)
+    else:
+        result = await inference_pool.predict(device_id, handler.name, payload_data)
+    if evaluator is not None:
+        evaluator.shadow(payload_data, canary)
+    return result
+
+def publish_model(handler) -> None:
+    """Send a model swapped in this process (an online refresh) to the inference workers."""
+    if inference_pool is not None:
+        inference_pool.swap_model(handler.name, handler.model, handler.model_version)
+
+def observe_routed(model: str, rows, anomaly_scores) -> None:
+    MODEL_HANDLERS[model].observe(rows, anomaly_scores)
+
+async def resolve_area_risk(area_risk: Optional[str], lat: Optional[float], lon: Optional[float]) -> str:
+    if area_risk is not None:
+        return area_risk
+    if lat is None or lon is None:
+        raise HTTPException(status_code=422, detail="Either area_risk or lat and lon are required")
+    area_risk = geo_risk.lookup(lat, lon)
+    # No live scoring here (unlike /api/device): a geofenced point whose cell
+    # centre fell outside the geofence is raised to the geofenced minimum.
+    if GEOFENCE_PATH:
+        calculator = safety_calculator or await asyncio.to_thread(get_safety_calculator)
+        if calculator.is_geofenced(lat, lon):
+            area_risk = geo_risk.geofenced(area_risk)
+    if area_risk is None:
+        raise HTTPException(status_code=422, detail=f"No area risk known for ({lat}, {lon})")
+    return area_risk
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/api/dropoff", response_model=PredictionResponse, response_model_exclude_none=True, name="dropoff")
+async def predict_dropoff_anomaly(payload: DataPayload, explain: bool = False):
+    clock = metrics.stage_clock()
+    clock.mark('validation')
+    area_risk = await resolve_area_risk(payload.area_risk, payload.lat, payload.lon)
     try:
         payload_data = {
             'network_connectivity_state': payload.network_connectivity_state,
             'acc_vs_loc': payload.acc_vs_loc,
             'time_since_last_successful_ping': payload.time_since_last_successful_ping,
             'gps_accuracy': payload.gps_accuracy,
-            'area_risk': payload.area_risk
+            'area_risk': area_risk,
+            'region': payload.region,
+            'lat': payload.lat,
+            'lon': payload.lon
         }
-        result = model_handler.predict(payload_data)
-        print(result)
+        if explain:
+            # Attribution is computed by the production model in this process.
+            with profiler.profile('dropoff'):
+                result = model_handler.predict(payload_data, explain=True)
+        elif inference_pool is not None and payload.device_id is not None:
+            result = await predict_routed(model_handler, payload.device_id, payload_data)
+        else:
+            with profiler.profile('dropoff'):
+                result = shadow.predict(model_handler, payload_data)
+        if alert_pipeline is not None:
+            alert_pipeline.offer('dropoff', payload.device_id, result, payload_data)
+        clock.lap()
         return PredictionResponse(**result)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
-@app.post("/api/inactivity", response_model=InactivityResponse)
-async def predict_inactivity_anomaly(payload: InactivityPayload):
+@app.post("/api/inactivity", response_model=InactivityResponse, response_model_exclude_none=True, name="inactivity")
+async def predict_inactivity_anomaly(payload: InactivityPayload, explain: bool = False):
+    clock = metrics.stage_clock()
+    clock.mark('validation')
+    area_risk = await resolve_area_risk(payload.area_risk, payload.lat, payload.lon)
     try:
         payload_data = {
             'hour': payload.hour,
@@ -62,18 +371,420 @@ async def predict_inactivity_anomaly(payload: InactivityPayload):
             'displacement_m': payload.displacement_m,
             'time_since_last_interaction_min': payload.time_since_last_interaction_min,
             'missed_ping_count': payload.missed_ping_count,
-            'area_risk': payload.area_risk,
+            'area_risk': area_risk,
             'battery_level_percent': payload.battery_level_percent,
-            'is_expected_active': payload.is_expected_active
+            'is_expected_active': payload.is_expected_active,
+            'region': payload.region,
+            'lat': payload.lat,
+            'lon': payload.lon
         }
         
-        result = inactivity_model_handler.predict(payload_data)
-        print(result)
+        if explain:
+            with profiler.profile('inactivity'):
+                result = inactivity_model_handler.predict(payload_data, explain=True)
+        elif inference_pool is not None and payload.device_id is not None:
+            result = await predict_routed(inactivity_model_handler, payload.device_id, payload_data)
+        else:
+            with profiler.profile('inactivity'):
+                result = shadow.predict(inactivity_model_handler, payload_data)
+        if alert_pipeline is not None:
+            alert_pipeline.offer('inactivity', payload.device_id, result, payload_data)
+        clock.lap()
         return InactivityResponse(**result)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Inactivity prediction error: {str(e)}")
 
+async def predict_wire(request: Request, handler, schema: wire.WireSchema, single: bool) -> Response:
+    clock = metrics.stage_clock()
+    try:
+        columns = wire.decode(await request.body(), request.headers.get('content-type'), schema, single)
+    except wire.WireFormatError as e:
+        raise RequestValidationError(e.errors)
+    except wire.UnsupportedMediaType as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    clock.mark('validation')
+    try:
+        with profiler.profile(handler.name):
+            _, is_anomaly, risk_levels = handler.predict_batch(columns)
+        if alert_pipeline is not None:
+            # The wire formats carry no device id, so these alerts are never deduplicated.
+            alert_pipeline.offer_batch(handler.name, is_anomaly, risk_levels, lambda i: (None, wire.row(columns, i)))
+        clock.lap()
+        body, media_type = wire.encode_results(is_anomaly, risk_levels, request.headers.get('accept'), single)
+        return Response(content=body, media_type=media_type)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch prediction error: {str(e)}")
+
+async def predict_dropoff_wire(request: Request) -> Response:
+    return await predict_wire(request, model_handler, wire.DROPOFF_SCHEMA, single=True)
+
+async def predict_inactivity_wire(request: Request) -> Response:
+    return await predict_wire(request, inactivity_model_handler, wire.INACTIVITY_SCHEMA, single=True)
+
+WIRE_ENDPOINTS = {
+    'dropoff': predict_dropoff_wire,
+    'inactivity': predict_inactivity_wire,
+}
+
+# Batch endpoints take a list of payloads as JSON, msgpack or packed records
+# (see wire.py) and return the results in the same order.
+@app.post("/api/dropoff/batch", response_model=List[PredictionResponse], name="dropoff_batch")
+async def predict_dropoff_batch(request: Request):
+    return await predict_wire(request, model_handler, wire.DROPOFF_SCHEMA, single=False)
+
+@app.post("/api/inactivity/batch", response_model=List[InactivityResponse], name="inactivity_batch")
+async def predict_inactivity_batch(request: Request):
+    return await predict_wire(request, inactivity_model_handler, wire.INACTIVITY_SCHEMA, single=False)
+
+STREAM_HANDLERS = {
+    'dropoff': (model_handler, wire.DROPOFF_SCHEMA),
+    'inactivity': (inactivity_model_handler, wire.INACTIVITY_SCHEMA),
+}
+
+def _decode_stream_message(data) -> object:
+    if isinstance(data, bytes):
+        return wire._msgpack().unpackb(data, raw=False)
+    return json.loads(data)
+
+# Gateways push many devices' payloads over one connection; see streaming.py
+# for the message format, batching and backpressure.
+@app.websocket("/ws/telemetry")
+async def telemetry_websocket(websocket: WebSocket):
+    await websocket.accept()
+    session = streaming.StreamSession(STREAM_HANDLERS, alerts=alert_pipeline)
+
+    async def receive_messages():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                data = message.get('text') if message.get('text') is not None else message.get('bytes')
+                try:
+                    decoded = _decode_stream_message(data)
+                except Exception as e:
+                    await session.reject(f"Could not decode message: {e}")
+                    continue
+                await session.submit(decoded)
+        finally:
+            await session.close()
+
+    with streaming.connections:
+        receiver = asyncio.create_task(receive_messages())
+        try:
+            async for results in session.results():
+                await websocket.send_text(json.dumps(results))
+        except Exception as e:
+            print(f"Telemetry websocket closed: {e}")
+        finally:
+            receiver.cancel()
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    A StreamingResponse that does not listen for disconnects: the endpoint is
+    still reading the request body while results stream out, and both cannot
+    consume the ASGI receive channel. A disconnect ends the body read instead.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+@app.post("/api/stream", name="stream")
+async def stream_ndjson(request: Request):
+    session = streaming.StreamSession(STREAM_HANDLERS, alerts=alert_pipeline)
+
+    async def submit_line(line: bytes):
+        if not line.strip():
+            return
+        try:
+            decoded = json.loads(line)
+        except ValueError as e:
+            await session.reject(f"Could not decode line: {e}")
+            return
+        await session.submit(decoded)
+
+    async def receive_lines():
+        buffer = b''
+        try:
+            async for chunk in request.stream():
+                buffer += chunk
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    await submit_line(line)
+            await submit_line(buffer)
+        finally:
+            await session.close()
+
+    async def send_results():
+        with streaming.connections:
+            receiver = asyncio.create_task(receive_lines())
+            try:
+                async for results in session.results():
+                    yield ''.join(json.dumps(result) + '\n' for result in results)
+                yield json.dumps(session.stats()) + '\n'
+            finally:
+                receiver.cancel()
+
+    return DuplexStreamingResponse(send_results(), media_type="application/x-ndjson")
+
+# Streams one NDJSON line per sample as its chunk is scored, a summary line per
+# route segment and a final route summary.
+@app.post("/api/route", name="route")
+async def score_route(payload: RoutePayload):
+    metrics.stage_clock().mark('validation')
+    for lat, lon in payload.points:
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise HTTPException(status_code=422, detail=f"Invalid route point ({lat}, {lon})")
+    samples = int(route_length_m(payload.points) // payload.spacing_m) + 2
+    if samples > MAX_ROUTE_SAMPLES:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Route needs {samples} samples at {payload.spacing_m} m spacing, the limit is {MAX_ROUTE_SAMPLES}"
+        )
+
+    async def send_records():
+        try:
+            async for record in get_safety_calculator().score_route_async(
+                payload.points, payload.spacing_m, payload.is_area_geofenced
+            ):
+                yield json.dumps(record) + '\n'
+        except Exception as e:
+            yield json.dumps({'type': 'error', 'detail': f"Route scoring error: {str(e)}"}) + '\n'
+
+    return StreamingResponse(send_records(), media_type="application/x-ndjson")
+
+# The Overpass and met.no lookups go through the calculator's pooled async
+# HTTP client, so the endpoint awaits them instead of holding a threadpool slot.
+# The tower density part of the score runs in a worker thread, where it is
+# profiled as 'safety' (see profile_safety); the awaits themselves are not.
+@app.post("/api/safety", response_model=SafetyResponse, name="safety")
+async def calculate_safety_score(payload: SafetyPayload):
+    clock = metrics.stage_clock()
+    clock.mark('validation')
+    try:
+        safety_score, risk_level = await get_safety_calculator().calculate_safety_score_async(
+            payload.lat, payload.lon, payload.is_area_geofenced
+        )
+        clock.lap()
+        return SafetyResponse(safety_score=safety_score, risk_level=risk_level)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Safety score error: {str(e)}")
+
+# One snapshot scored by both models. Deriving area_risk awaits the safety score
+# lookups as /api/safety does.
+@app.post("/api/device", response_model=DeviceRiskResponse, response_model_exclude_none=True, name="device")
+async def score_device_snapshot(payload: DeviceSnapshotPayload):
+    clock = metrics.stage_clock()
+    clock.mark('validation')
+    payload_data = payload.dict()
+    safety_score = None
+    area_risk_source = 'payload'
+    if payload.area_risk is None:
+        if payload.lat is None or payload.lon is None:
+            raise HTTPException(status_code=422, detail="Either area_risk or lat and lon are required")
+        # The layer is built for non-geofenced areas, so geofenced snapshots are scored live.
+        is_area_geofenced = payload.is_area_geofenced
+        if is_area_geofenced is None and GEOFENCE_PATH:
+            calculator = safety_calculator or await asyncio.to_thread(get_safety_calculator)
+            is_area_geofenced = calculator.is_geofenced(payload.lat, payload.lon)
+        if not is_area_geofenced:
+            payload_data['area_risk'] = geo_risk.lookup(payload.lat, payload.lon)
+            area_risk_source = 'geo_layer'
+    if payload_data['area_risk'] is None:
+        calculator = safety_calculator or await asyncio.to_thread(get_safety_calculator)
+        try:
+            safety_score, payload_data['area_risk'] = await calculator.calculate_safety_score_async(
+                payload.lat, payload.lon, payload.is_area_geofenced
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Safety score error: {str(e)}")
+        area_risk_source = 'safety_score'
+        clock.mark('area_risk')
+    try:
+        with profiler.profile('device'):
+            result = fusion.score_snapshot(
+                payload_data, model_handler, inactivity_model_handler,
+                safety_score=safety_score, area_risk_source=area_risk_source
+            )
+        if alert_pipeline is not None:
+            alert_pipeline.offer('device', payload.device_id, result, payload_data)
+        clock.lap()
+        return DeviceRiskResponse(**result)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Device prediction error: {str(e)}")
+
+@app.get("/admin/profiling", dependencies=ADMIN)
+async def get_profiling_status():
+    return profiler.status()
+
+@app.put("/admin/profiling", dependencies=ADMIN)
+async def configure_profiling(config: ProfilingConfig):
+    was_enabled = profiler.enabled
+    try:
+        status = profiler.configure(
+            enabled=config.enabled,
+            sample_every=config.sample_every,
+            interval=config.interval_ms / 1000 if config.interval_ms is not None else None,
+            mode=config.mode
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if was_enabled and not profiler.enabled:
+        status['output'] = profiler.dump()
+    return status
+
+@app.get("/admin/profiling/stacks", response_class=PlainTextResponse, dependencies=ADMIN)
+async def get_profiling_stacks():
+    return PlainTextResponse(profiler.collapsed())
+
+@app.post("/admin/profiling/dump", dependencies=ADMIN)
+async def dump_profiling_stacks():
+    output = profiler.dump()
+    if output is None:
+        raise HTTPException(status_code=404, detail="No profile directory configured (SAFARX_PROFILE_DIR)")
+    return {"output": output}
+
+@app.delete("/admin/profiling/stacks", dependencies=ADMIN)
+async def reset_profiling_stacks():
+    profiler.reset()
+    return profiler.status()
+
+@app.get("/admin/online-learning", dependencies=ADMIN)
+async def get_online_learning_status():
+    return {
+        name: handler.online.status() if handler.online is not None else None
+        for name, handler in MODEL_HANDLERS.items()
+    }
+
+@app.post("/admin/online-learning/{model}/refresh", dependencies=ADMIN)
+async def refresh_online_model(model: str):
+    handler = MODEL_HANDLERS.get(model)
+    if handler is None or handler.online is None:
+        raise HTTPException(status_code=404, detail=f"Online learning is not enabled for '{model}'")
+    swapped = await asyncio.to_thread(handler.online.refresh_once)
+    return {"swapped": swapped, **handler.online.status()}
+
+@app.get("/admin/drift", dependencies=ADMIN)
+async def get_drift_report():
+    return {
+        name: handler.drift.report() if handler.drift is not None else None
+        for name, handler in MODEL_HANDLERS.items()
+    }
+
+@app.delete("/admin/drift", dependencies=ADMIN)
+async def reset_drift_sketches():
+    for handler in MODEL_HANDLERS.values():
+        if handler.drift is not None:
+            handler.drift.reset()
+    return await get_drift_report()
+
+@app.get("/admin/shadow", dependencies=ADMIN)
+async def get_shadow_status():
+    return {
+        name: shadow.evaluators[handler.name].status() if handler.name in shadow.evaluators else None
+        for name, handler in MODEL_HANDLERS.items()
+    }
+
+@app.put("/admin/shadow/{model}", dependencies=ADMIN)
+async def start_shadow_evaluation(model: str, config: ShadowConfig):
+    handler = MODEL_HANDLERS.get(model)
+    if handler is None:
+        raise HTTPException(status_code=404, detail=f"Unknown model '{model}'")
+    try:
+        candidate = await asyncio.to_thread(
+            shadow.load_candidate, handler, config.artifact
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    previous = shadow.evaluators.pop(handler.name, None)
+    if previous is not None:
+        previous.stop()
+    evaluator = shadow.ShadowEvaluator(handler, candidate, config.sample_rate, config.canary_fraction)
+    shadow.evaluators[handler.name] = evaluator
+    return evaluator.status()
+
+@app.delete("/admin/shadow/{model}", dependencies=ADMIN)
+async def stop_shadow_evaluation(model: str):
+    handler = MODEL_HANDLERS.get(model)
+    evaluator = shadow.evaluators.pop(handler.name, None) if handler is not None else None
+    if evaluator is None:
+        raise HTTPException(status_code=404, detail=f"No shadow evaluation running for '{model}'")
+    evaluator.stop()
+    return evaluator.status()
+
+@app.get("/admin/workers", dependencies=ADMIN)
+async def get_worker_status():
+    if inference_pool is None:
+        return {"enabled": False}
+    return {"enabled": True, **inference_pool.status()}
+
+@app.post("/admin/workers", dependencies=ADMIN)
+async def add_inference_worker():
+    if inference_pool is None:
+        raise HTTPException(status_code=404, detail="Inference workers are not enabled (SAFARX_WORKERS)")
+    try:
+        name = await asyncio.to_thread(inference_pool.add_worker)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"added": name, **inference_pool.status()}
+
+@app.delete("/admin/workers/{name}", dependencies=ADMIN)
+async def remove_inference_worker(name: str):
+    if inference_pool is None:
+        raise HTTPException(status_code=404, detail="Inference workers are not enabled (SAFARX_WORKERS)")
+    try:
+        inference_pool.remove_worker(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown worker '{name}'")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return inference_pool.status()
+
+@app.get("/admin/alerts", dependencies=ADMIN)
+async def get_alert_status():
+    if alert_pipeline is None:
+        return {"enabled": False}
+    return {"enabled": True, **alert_pipeline.status()}
+
+@app.get("/admin/alerts/queue", dependencies=ADMIN)
+async def take_queued_alerts(limit: int = 100):
+    sink = next((sink for sink in alert_pipeline.sinks if isinstance(sink, alerts.QueueSink)), None) \
+        if alert_pipeline is not None else None
+    if sink is None:
+        raise HTTPException(status_code=404, detail="The alert queue is not enabled (SAFARX_ALERT_QUEUE)")
+    return {"alerts": sink.take(limit), "remaining": len(sink.events), "overwritten": sink.overwritten}
+
+@app.get("/admin/prediction-log", dependencies=ADMIN)
+async def get_prediction_log_status():
+    if predictions is None:
+        return {"enabled": False}
+    return {"enabled": True, **predictions.status()}
+
+@app.get("/admin/regions", dependencies=ADMIN)
+async def get_region_models_status():
+    return {
+        name: handler.regions.status() if handler.regions is not None else {"enabled": False}
+        for name, handler in MODEL_HANDLERS.items()
+    }
+
+@app.post("/admin/regions/{model}/rescan", dependencies=ADMIN)
+async def rescan_region_models(model: str):
+    handler = MODEL_HANDLERS.get(model)
+    if handler is None or handler.regions is None:
+        raise HTTPException(status_code=404, detail=f"No regional models for {model}")
+    await asyncio.to_thread(handler.regions.rescan)
+    return handler.regions.status()
+
+@app.get("/admin/prewarm", dependencies=ADMIN)
+async def get_prewarm_status():
+    if safety_calculator is None or safety_calculator.prewarmer is None:
+        return {"running": False, "cache": None}
+    return safety_calculator.prewarmer.status()
+
 class TestPayload(BaseModel):
     message: str
 
@@ -0,0 +1,440 @@
+"""
+Prometheus-style metrics for the inference service.
+
+Every thread writes into its own shard (a plain dict of lists), so the hot path
+never takes a lock. Shards are merged when `/metrics` is scraped. When several
+uvicorn workers share a host, set SAFARX_METRICS_DIR and each worker
+periodically dumps its merged snapshot there; the worker that serves the
+scrape adds the other workers' snapshots to its own live values. Snapshots
+of processes that have exited are deleted rather than counted.
+
+Set SAFARX_METRICS=0 to turn all recording into a no-op.
+"""
+
+import os
+import json
+import collections
+import time
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+
+class Registry:
+    def __init__(self, multiprocess_dir: Optional[str] = None, enabled: bool = True):
+        self.enabled = enabled
+        self.multiprocess_dir = multiprocess_dir
+        self._metrics: Dict[str, '_Metric'] = {}
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._shards_lock = threading.Lock()
+        self._gauge_values: Dict[Tuple[str, Tuple[str, ...]], float] = {}
+        self._flusher: Optional[threading.Thread] = None
+
+    def register(self, metric: '_Metric') -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric name: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.values
+        except AttributeError:
+            values = {}
+            self._local.values = values
+            # Only the first write from a new thread takes the lock.
+            with self._shards_lock:
+                self._shards.append(values)
+            return values
+
+    def _local_snapshot(self) -> Dict[Tuple[str, Tuple[str, ...]], List[float]]:
+        merged: Dict[Tuple[str, Tuple[str, ...]], List[float]] = {}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            # dict() copies in C, so a concurrent insert on the owning thread
+            # cannot break the iteration below.
+            for key, cell in dict(shard).items():
+                total = merged.get(key)
+                if total is None:
+                    merged[key] = list(cell)
+                else:
+                    for i, v in enumerate(cell):
+                        total[i] += v
+        for key, value in dict(self._gauge_values).items():
+            merged[key] = [value]
+        return merged
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.multiprocess_dir, f"metrics-{pid}.json")
+
+    def remove_snapshot(self, pid: int) -> None:
+        """Delete an exited worker's snapshot so its values stop being added."""
+        if not self.multiprocess_dir:
+            return
+        try:
+            os.remove(self._snapshot_path(pid))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error removing metrics snapshot of {pid}: {e}")
+
+    def write_snapshot(self) -> None:
+        """Dump this worker's merged values for the other workers to read."""
+        if not self.multiprocess_dir:
+            return
+        entries = [[name, list(labels), cell] for (name, labels), cell in self._local_snapshot().items()]
+        path = self._snapshot_path(os.getpid())
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, path)
+
+    def start_flusher(self, interval: float = 1.0) -> None:
+        """Start the background thread that keeps this worker's snapshot fresh."""
+        if not self.multiprocess_dir or self._flusher is not None:
+            return
+        os.makedirs(self.multiprocess_dir, exist_ok=True)
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write_snapshot()
+                except OSError as e:
+                    print(f"Error writing metrics snapshot: {e}")
+
+        self._flusher = threading.Thread(target=run, name='metrics-flusher', daemon=True)
+        self._flusher.start()
+
+    def collect(self) -> Dict[Tuple[str, Tuple[str, ...]], List[float]]:
+        """Merge all local shards plus, in multiprocess mode, other workers' snapshots."""
+        merged = self._local_snapshot()
+        if not self.multiprocess_dir or not os.path.isdir(self.multiprocess_dir):
+            return merged
+
+        own_path = self._snapshot_path(os.getpid())
+        for filename in os.listdir(self.multiprocess_dir):
+            path = os.path.join(self.multiprocess_dir, filename)
+            if not filename.endswith('.json') or path == own_path:
+                continue
+            pid = _snapshot_pid(filename)
+            if pid is not None and not _process_alive(pid):
+                # A worker that exited without its pool removing the file.
+                self.remove_snapshot(pid)
+                continue
+            try:
+                with open(path) as f:
+                    entries = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, labels, cell in entries:
+                key = (name, tuple(labels))
+                total = merged.get(key)
+                if total is None:
+                    merged[key] = list(cell)
+                elif len(total) == len(cell):
+                    for i, v in enumerate(cell):
+                        total[i] += v
+        return merged
+
+    def render(self) -> str:
+        """Render every registered metric in the Prometheus text format."""
+        samples = self.collect()
+        by_metric: Dict[str, list] = {}
+        for (name, labels), cell in samples.items():
+            by_metric.setdefault(name, []).append((labels, cell))
+
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render(sorted(by_metric.get(metric.name, [])), samples))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self) -> None:
+        """Drop all recorded values (used by benchmarks)."""
+        with self._shards_lock:
+            for shard in self._shards:
+                shard.clear()
+        self._gauge_values.clear()
+
+
+def _snapshot_pid(filename: str) -> Optional[int]:
+    stem = filename[len('metrics-'):-len('.json')] if filename.startswith('metrics-') else ''
+    return int(stem) if stem.isdigit() else None
+
+
+def _process_alive(pid: int) -> bool:
+    if os.name == 'nt':
+        # os.kill would terminate the process there; leave cleanup to the pool.
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # e.g. EPERM: the process exists but belongs to another user.
+        return True
+    return True
+
+
+def _format_labels(labelnames: Tuple[str, ...], labelvalues: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{k}="{v}"' for k, v in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), registry: Registry = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._registry = registry or REGISTRY
+        self._registry.register(self)
+
+    def render(self, samples: list, all_samples: dict) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(cell[0])}"
+            for labels, cell in samples
+        ]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        registry = self._registry
+        if not registry.enabled:
+            return
+        values = registry._shard()
+        key = (self.name, labelvalues)
+        cell = values.get(key)
+        if cell is None:
+            values[key] = [amount]
+        else:
+            cell[0] += amount
+
+
+class Gauge(_Metric):
+    """
+    A gauge is either set directly or computed at scrape time from the merged
+    samples of other metrics (see `set_function`). Directly set values from
+    several workers are summed.
+    """
+    kind = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable[[dict], Dict[Tuple[str, ...], float]]] = None
+
+    def set(self, value: float, *labelvalues: str) -> None:
+        if self._registry.enabled:
+            self._registry._gauge_values[(self.name, labelvalues)] = float(value)
+
+    def set_function(self, function: Callable[[dict], Dict[Tuple[str, ...], float]]) -> None:
+        self._function = function
+
+    def render(self, samples: list, all_samples: dict) -> List[str]:
+        if self._function is None:
+            return super().render(samples, all_samples)
+        computed = self._function(all_samples)
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(computed.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # Cell layout: one count per bucket (non-cumulative), then sum, then count.
+        self._cell_size = len(self.buckets) + 2
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        registry = self._registry
+        if not registry.enabled:
+            return
+        values = registry._shard()
+        key = (self.name, labelvalues)
+        cell = values.get(key)
+        if cell is None:
+            cell = [0.0] * self._cell_size
+            values[key] = cell
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def render(self, samples: list, all_samples: dict) -> List[str]:
+        lines = []
+        for labels, cell in samples:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, cell):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                label_str = _format_labels(self.labelnames, labels, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{label_str} {_format_value(cumulative)}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {repr(cell[-2])}")
+            lines.append(f"{self.name}_count{label_str} {_format_value(cell[-1])}")
+        return lines
+
+
+REGISTRY = Registry(
+    multiprocess_dir=os.environ.get('SAFARX_METRICS_DIR') or None,
+    enabled=os.environ.get('SAFARX_METRICS', '1') != '0',
+)
+
+REQUESTS = Counter('safarx_requests_total', 'HTTP requests handled.', ('endpoint',))
+ERRORS = Counter('safarx_errors_total', 'Failed HTTP requests by kind.', ('endpoint', 'kind'))
+REQUEST_LATENCY = Histogram('safarx_request_latency_seconds', 'End-to-end request handling time.', ('endpoint',))
+STAGE_LATENCY = Histogram('safarx_stage_latency_seconds', 'Time spent in each request stage.', ('endpoint', 'stage'))
+PREDICTIONS = Counter('safarx_predictions_total', 'Predictions served by risk level.', ('endpoint', 'risk_level'))
+ANOMALIES = Counter('safarx_anomalies_total', 'Predictions flagged as anomalous.', ('endpoint',))
+ANOMALY_RATE = Gauge('safarx_anomaly_rate', 'Fraction of predictions flagged as anomalous.', ('endpoint',))
+RESULT_CACHE_LOOKUPS = Counter('safarx_result_cache_lookups_total', 'Result cache lookups by outcome.', ('endpoint', 'outcome'))
+RESULT_CACHE_HIT_RATE = Gauge('safarx_result_cache_hit_rate', 'Fraction of result cache lookups that hit.', ('endpoint',))
+STREAM_CONNECTIONS = Gauge('safarx_stream_connections', 'Open streaming (WebSocket/NDJSON) connections.')
+STREAM_MESSAGES = Counter('safarx_stream_messages_total', 'Streamed payloads by model and outcome.', ('model', 'outcome'))
+STREAM_BATCH_SIZE = Histogram(
+    'safarx_stream_batch_size', 'Payloads scored together per streaming batch.', ('model',),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024),
+)
+
+ONLINE_REFRESHES = Counter('safarx_online_refreshes_total', 'Online model refresh attempts by outcome.', ('model', 'outcome'))
+ONLINE_TRAINING_SECONDS = Histogram(
+    'safarx_online_training_seconds', 'Time to retrain the replaced trees in an online refresh.', ('model',),
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+REGION_MODEL_LOOKUPS = Counter(
+    'safarx_region_model_lookups_total', 'Regional model lookups by outcome (hit, or why the global model served).',
+    ('model', 'outcome'),
+)
+REGION_MODEL_LOADS = Counter('safarx_region_model_loads_total', 'Regional model loads by outcome.', ('model', 'outcome'))
+REGION_MODEL_EVICTIONS = Counter(
+    'safarx_region_model_evictions_total', 'Regional models evicted to stay within the memory budget.', ('model',)
+)
+REGION_MODEL_LOAD_SECONDS = Histogram(
+    'safarx_region_model_load_seconds', 'Time to load a regional model.', ('model',),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+REGION_MODELS_LOADED = Gauge('safarx_region_models_loaded', 'Regional models held in memory.', ('model',))
+REGION_MODEL_BYTES = Gauge('safarx_region_model_bytes', 'Bytes of the regional models held in memory.', ('model',))
+
+
+def _anomaly_rates(samples: dict) -> Dict[Tuple[str, ...], float]:
+    totals: Dict[Tuple[str, ...], float] = {}
+    for (name, labels), cell in samples.items():
+        if name == PREDICTIONS.name:
+            endpoint = labels[:1]
+            totals[endpoint] = totals.get(endpoint, 0.0) + cell[0]
+    return {
+        endpoint: samples.get((ANOMALIES.name, endpoint), [0.0])[0] / total
+        for endpoint, total in totals.items() if total
+    }
+
+
+ANOMALY_RATE.set_function(_anomaly_rates)
+
+
+def _cache_hit_rates(samples: dict) -> Dict[Tuple[str, ...], float]:
+    lookups: Dict[Tuple[str, ...], List[float]] = {}
+    for (name, labels), cell in samples.items():
+        if name == RESULT_CACHE_LOOKUPS.name:
+            counts = lookups.setdefault(labels[:1], [0.0, 0.0])
+            counts[labels[1] == 'hit'] += cell[0]
+    return {
+        endpoint: hits / (misses + hits)
+        for endpoint, (misses, hits) in lookups.items() if misses + hits
+    }
+
+
+RESULT_CACHE_HIT_RATE.set_function(_cache_hit_rates)
+
+
+def record_prediction(endpoint: str, risk_level: str, is_anomaly: bool) -> None:
+    PREDICTIONS.inc(endpoint, risk_level)
+    if is_anomaly:
+        ANOMALIES.inc(endpoint)
+
+
+def record_predictions(endpoint: str, risk_levels, is_anomaly) -> None:
+    """Batch form of record_prediction for sequences of risk levels and anomaly flags."""
+    for risk_level, count in collections.Counter(list(risk_levels)).items():
+        PREDICTIONS.inc(endpoint, str(risk_level), amount=count)
+    anomalies = int(sum(is_anomaly))
+    if anomalies:
+        ANOMALIES.inc(endpoint, amount=anomalies)
+
+
+class StageClock:
+    """Measures consecutive stages of a single request."""
+    __slots__ = ('endpoint', 'start', 'last')
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.start = self.last = perf_counter()
+
+    def mark(self, stage: str) -> None:
+        """Record the time since the previous mark as `stage`."""
+        now = perf_counter()
+        STAGE_LATENCY.observe(now - self.last, self.endpoint, stage)
+        self.last = now
+
+    def lap(self) -> None:
+        """Restart the stage timer without recording anything."""
+        self.last = perf_counter()
+
+
+class _NullClock:
+    def mark(self, stage: str) -> None:
+        pass
+
+    def lap(self) -> None:
+        pass
+
+
+_NULL_CLOCK = _NullClock()
+_current_clock: ContextVar = ContextVar('safarx_stage_clock', default=_NULL_CLOCK)
+
+
+def stage_clock():
+    """The clock of the request being handled, or a no-op clock outside a request."""
+    return _current_clock.get()
+
+
+def request_endpoint(default: str) -> str:
+    """Endpoint label of the request being handled, or `default` outside a request."""
+    clock = _current_clock.get()
+    return default if clock is _NULL_CLOCK else clock.endpoint
+
+
+def start_request(endpoint: str):
+    clock = StageClock(endpoint)
+    return clock, _current_clock.set(clock)
+
+
+def finish_request(clock: StageClock, token) -> None:
+    _current_clock.reset(token)
+    REQUESTS.inc(clock.endpoint)
+    REQUEST_LATENCY.observe(perf_counter() - clock.start, clock.endpoint)
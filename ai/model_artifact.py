@@ -0,0 +1,416 @@
+"""
+Pickle-free model artifacts for the IsolationForest handlers.
+
+A `.safx` file stores a trained IsolationForest (flattened into node arrays)
+together with the StandardScaler parameters and the training column order:
+
+    8 bytes    magic b'SAFXART1'
+    4 bytes    little-endian uint32: length of the JSON header
+    header     UTF-8 JSON: metadata plus {array name: dtype, shape, offset}
+    arrays     raw little-endian buffers, each aligned to 64 bytes
+
+Loading maps the file read-only, so the arrays are views into the page cache
+that every uvicorn worker on the host shares, and nothing is unpickled.
+
+Thresholds, leaf values and scaler parameters are exported as float64, or
+with --float32 as float32; a float32 artifact is scored in float32 end to end
+(see CompiledForest.astype, and precision_check.py to compare the two).
+
+Usage (from the `ai/` directory, needs joblib + scikit-learn):
+    python model_artifact.py [--float32]                                   # export both repo models
+    python model_artifact.py [--float32] MODEL.joblib SCALER.joblib OUT.safx
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+from typing import Dict, Tuple
+
+import numpy as np
+
+MAGIC = b'SAFXART1'
+FORMAT_VERSION = 1
+_ALIGNMENT = 64
+_HEADER_LENGTH = struct.Struct('<I')
+
+
+def write_artifact(path: str, metadata: dict, arrays: Dict[str, np.ndarray]) -> None:
+    """Write `arrays` and JSON-serializable `metadata` to `path` atomically."""
+    table = {}
+    offset = 0
+    buffers = []
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        array = array.astype(array.dtype.newbyteorder('<'), copy=False)
+        offset = -(-offset // _ALIGNMENT) * _ALIGNMENT
+        table[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        buffers.append((offset, array))
+        offset += array.nbytes
+
+    header = json.dumps({'format_version': FORMAT_VERSION, 'metadata': metadata, 'arrays': table}).encode()
+    data_start = -(-(len(MAGIC) + _HEADER_LENGTH.size + len(header)) // _ALIGNMENT) * _ALIGNMENT
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+        for array_offset, array in buffers:
+            f.seek(data_start + array_offset)
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_artifact(path: str) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """Map `path` read-only and return (metadata, arrays) without copying the arrays."""
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a safx artifact")
+    (header_length,) = _HEADER_LENGTH.unpack_from(buffer, len(MAGIC))
+    header_start = len(MAGIC) + _HEADER_LENGTH.size
+    header = json.loads(bytes(buffer[header_start:header_start + header_length]))
+    if header['format_version'] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact version {header['format_version']} in {path}")
+    data_start = -(-(header_start + header_length) // _ALIGNMENT) * _ALIGNMENT
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape'], dtype=np.int64))
+        arrays[name] = np.frombuffer(
+            buffer, dtype=dtype, count=count, offset=data_start + spec['offset']
+        ).reshape(spec['shape'])
+    return header['metadata'], arrays
+
+
+def average_path_length(n_samples: np.ndarray) -> np.ndarray:
+    """Expected path length of an unsuccessful BST search, as used by IsolationForest."""
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    result = np.zeros_like(n_samples)
+    result[n_samples == 2] = 1.0
+    large = n_samples > 2
+    n = n_samples[large]
+    result[large] = 2.0 * (np.log(n - 1.0) + np.euler_gamma) - 2.0 * (n - 1.0) / n
+    return result
+
+
+class CompiledForest:
+    """
+    An IsolationForest flattened into node arrays shared by all trees.
+
+    Leaves point back at themselves, so every sample walks exactly `max_depth`
+    steps and the whole batch is traversed with a handful of vectorized numpy
+    operations per level. `leaf_value` holds each leaf's depth plus the average
+    path length correction for the samples it holds, so the score is a sum.
+    `threshold` and `leaf_value` are float64 or float32 (see astype).
+    """
+
+    ARRAYS = ('left', 'right', 'feature', 'threshold', 'leaf_value', 'roots')
+
+    def __init__(self, left, right, feature, threshold, leaf_value, roots,
+                 max_depth: int, offset: float, max_samples: int, n_features: int):
+        self.left = left
+        self.right = right
+        self.feature = feature
+        self.threshold = threshold
+        self.leaf_value = leaf_value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.offset_ = offset
+        self.max_samples_ = max_samples
+        self.n_features_in_ = n_features
+        self._denominator = len(roots) * float(average_path_length([max_samples])[0])
+        self._path_contributions = None
+
+    @classmethod
+    def from_sklearn(cls, model) -> 'CompiledForest':
+        lefts, rights, features, thresholds, leaf_values, roots = [], [], [], [], [], []
+        max_depth = 0
+        base = 0
+        for estimator, estimator_features in zip(model.estimators_, model.estimators_features_):
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            is_leaf = tree.children_left == -1
+            node_ids = np.arange(n_nodes)
+
+            depth = np.zeros(n_nodes, dtype=np.int64)
+            for node in range(n_nodes):
+                if not is_leaf[node]:
+                    depth[tree.children_left[node]] = depth[node] + 1
+                    depth[tree.children_right[node]] = depth[node] + 1
+            max_depth = max(max_depth, int(depth.max()))
+
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left) + base)
+            rights.append(np.where(is_leaf, node_ids, tree.children_right) + base)
+            features.append(np.where(is_leaf, 0, np.asarray(estimator_features)[np.maximum(tree.feature, 0)]))
+            thresholds.append(np.where(is_leaf, 0.0, tree.threshold))
+            leaf_values.append(np.where(is_leaf, depth + average_path_length(tree.n_node_samples), 0.0))
+            roots.append(base)
+            base += n_nodes
+
+        return cls(
+            left=np.concatenate(lefts).astype(np.int32),
+            right=np.concatenate(rights).astype(np.int32),
+            feature=np.concatenate(features).astype(np.int32),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            leaf_value=np.concatenate(leaf_values).astype(np.float64),
+            roots=np.asarray(roots, dtype=np.int32),
+            max_depth=max_depth,
+            offset=float(model.offset_),
+            max_samples=int(model.max_samples_),
+            n_features=int(model.n_features_in_),
+        )
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.threshold.dtype
+
+    def astype(self, dtype) -> 'CompiledForest':
+        """
+        The forest with thresholds and leaf values in `dtype`. Features are
+        compared as float32, and for a float32 x, x <= t exactly when x is <= the
+        largest float32 not above t, so thresholds are rounded down and every
+        sample still reaches the same leaves as with float64 thresholds.
+        """
+        dtype = np.dtype(dtype)
+        if dtype == self.dtype:
+            return self
+        threshold = self.threshold.astype(dtype)
+        rounded_up = threshold > self.threshold
+        threshold[rounded_up] = np.nextafter(threshold[rounded_up], dtype.type(-np.inf))
+        return CompiledForest(
+            left=self.left,
+            right=self.right,
+            feature=self.feature,
+            threshold=threshold,
+            leaf_value=self.leaf_value.astype(dtype),
+            roots=self.roots,
+            max_depth=self.max_depth,
+            offset=self.offset_,
+            max_samples=self.max_samples_,
+            n_features=self.n_features_in_,
+        )
+
+    def metadata(self) -> dict:
+        return {
+            'max_depth': self.max_depth,
+            'offset': self.offset_,
+            'max_samples': self.max_samples_,
+            'n_features': self.n_features_in_,
+            'n_trees': len(self.roots),
+        }
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, metadata: dict, arrays: Dict[str, np.ndarray]) -> 'CompiledForest':
+        return cls(
+            **{name: arrays[name] for name in cls.ARRAYS},
+            max_depth=metadata['max_depth'],
+            offset=metadata['offset'],
+            max_samples=metadata['max_samples'],
+            n_features=metadata['n_features'],
+        )
+
+    def tree_nodes(self, tree: int) -> slice:
+        """Range of node indices that belong to one tree."""
+        end = self.roots[tree + 1] if tree + 1 < len(self.roots) else len(self.left)
+        return slice(int(self.roots[tree]), int(end))
+
+    def replace_trees(self, trees, other: 'CompiledForest') -> 'CompiledForest':
+        """
+        A new forest in which the trees at the indices `trees` are replaced, in
+        order, by the trees of `other`. Both forests must be built with the same
+        `max_samples` so the path lengths share one normalization. The result
+        keeps this forest's dtype.
+        """
+        other = other.astype(self.dtype)
+        trees = [int(tree) for tree in trees]
+        if len(trees) != len(other.roots):
+            raise ValueError(f"{len(trees)} trees to replace but {len(other.roots)} replacements")
+        if other.max_samples_ != self.max_samples_ or other.n_features_in_ != self.n_features_in_:
+            raise ValueError("Replacement trees differ in max_samples or n_features")
+        replacements = dict(zip(trees, range(len(trees))))
+
+        parts = {name: [] for name in ('left', 'right', 'feature', 'threshold', 'leaf_value')}
+        roots = []
+        base = 0
+        for tree in range(len(self.roots)):
+            source = other if tree in replacements else self
+            nodes = source.tree_nodes(replacements.get(tree, tree))
+            # Child indices (and leaves' self-references) move with the tree.
+            shift = base - nodes.start
+            parts['left'].append(source.left[nodes] + shift)
+            parts['right'].append(source.right[nodes] + shift)
+            parts['feature'].append(source.feature[nodes])
+            parts['threshold'].append(source.threshold[nodes])
+            parts['leaf_value'].append(source.leaf_value[nodes])
+            roots.append(base)
+            base += nodes.stop - nodes.start
+
+        return CompiledForest(
+            left=np.concatenate(parts['left']).astype(np.int32),
+            right=np.concatenate(parts['right']).astype(np.int32),
+            feature=np.concatenate(parts['feature']).astype(np.int32),
+            threshold=np.concatenate(parts['threshold']),
+            leaf_value=np.concatenate(parts['leaf_value']),
+            roots=np.asarray(roots, dtype=np.int32),
+            max_depth=max(self.max_depth, other.max_depth),
+            offset=self.offset_,
+            max_samples=self.max_samples_,
+            n_features=self.n_features_in_,
+        )
+
+    def apply(self, X: np.ndarray) -> np.ndarray:
+        """Index of the leaf each sample reaches in each tree, shape (n_samples, n_trees)."""
+        # Trees compare float32 features against the thresholds, like sklearn;
+        # float32 thresholds are rounded so the comparison is the same (see astype).
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots)))
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def score_samples(self, X: np.ndarray) -> np.ndarray:
+        return self._score(self.apply(X))
+
+    def _score(self, leaves: np.ndarray) -> np.ndarray:
+        depths = self.leaf_value[leaves].sum(axis=1, dtype=np.float64)
+        return -np.power(2.0, -depths / self._denominator)
+
+    def path_contributions(self) -> np.ndarray:
+        """
+        Per node, how much each feature's splits on the way from the root
+        shortened the expected path length, shape (n_nodes, n_features).
+
+        A node holding n training samples has expected remaining path length
+        c(n) (average_path_length). The split that sends a sample from a node
+        with n samples to a child with m samples is credited with
+        c(n) - 1 - c(m) for the split feature: positive when the sample is
+        isolated faster than the average sample at that node. Along a path the
+        credits add up to c(max_samples) minus the leaf's path length, so a
+        leaf's row decomposes exactly how much shorter than expected the path
+        through it is. Sample counts are recovered from the leaf values.
+        """
+        if self._path_contributions is not None:
+            return self._path_contributions
+        n_nodes = len(self.left)
+        is_leaf = self.left == np.arange(n_nodes)
+        depth = np.zeros(n_nodes, dtype=np.int64)
+        levels = []
+        frontier = self.roots.astype(np.int64)
+        while len(frontier):
+            depth[frontier] = len(levels)
+            levels.append(frontier[~is_leaf[frontier]])
+            frontier = np.concatenate([self.left[levels[-1]], self.right[levels[-1]]]).astype(np.int64)
+
+        # leaf_value = depth + c(n_leaf), and c is increasing in n; half the
+        # smallest step of c absorbs the rounding of float32 leaf values.
+        table = average_path_length(np.arange(1, self.max_samples_ + 1))
+        tolerance = np.diff(table).min() / 2 if len(table) > 1 else 0.5
+        path_lengths = self.leaf_value[is_leaf].astype(np.float64) - depth[is_leaf]
+        n_samples = np.zeros(n_nodes)
+        n_samples[is_leaf] = np.searchsorted(table, path_lengths - tolerance) + 1
+        for parents in reversed(levels):
+            n_samples[parents] = n_samples[self.left[parents]] + n_samples[self.right[parents]]
+        expected = average_path_length(n_samples)
+
+        contributions = np.zeros((n_nodes, self.n_features_in_))
+        for parents in levels:
+            for children in (self.left[parents], self.right[parents]):
+                contributions[children] = contributions[parents]
+                contributions[children, self.feature[parents]] += expected[parents] - 1.0 - expected[children]
+        self._path_contributions = contributions
+        return contributions
+
+    def decision_function_with_contributions(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        decision_function and, from the same traversal, each feature's
+        contribution averaged over the trees (see path_contributions), shape
+        (n_samples, n_features). Positive contributions push towards anomaly;
+        a sample's contributions sum to c(max_samples) minus its mean path length.
+        """
+        leaves = self.apply(X)
+        contributions = self.path_contributions()[leaves].mean(axis=1)
+        return self._score(leaves) - self.offset_, contributions
+
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        return self.score_samples(X) - self.offset_
+
+
+class CompiledScaler:
+    """The transform half of a fitted StandardScaler."""
+
+    def __init__(self, mean: np.ndarray, scale: np.ndarray):
+        self.mean_ = mean
+        self.scale_ = scale
+
+    @classmethod
+    def from_sklearn(cls, scaler) -> 'CompiledScaler':
+        n_features = scaler.n_features_in_
+        mean = scaler.mean_ if scaler.with_mean else np.zeros(n_features)
+        scale = scaler.scale_ if scaler.with_std else np.ones(n_features)
+        return cls(np.asarray(mean, dtype=np.float64), np.asarray(scale, dtype=np.float64))
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.mean_.dtype
+
+    def astype(self, dtype) -> 'CompiledScaler':
+        if np.dtype(dtype) == self.dtype:
+            return self
+        return CompiledScaler(self.mean_.astype(dtype), self.scale_.astype(dtype))
+
+    def transform(self, X) -> np.ndarray:
+        """Scale X in the scaler's dtype."""
+        return (np.asarray(X, dtype=self.dtype) - self.mean_) / self.scale_
+
+
+def export_model(model, scaler_info: dict, path: str, dtype=np.float64) -> None:
+    """Write a fitted IsolationForest and its scaler/column dict as a .safx artifact in `dtype`."""
+    forest = CompiledForest.from_sklearn(model).astype(dtype)
+    scaler = CompiledScaler.from_sklearn(scaler_info['scaler']).astype(dtype)
+    arrays = forest.arrays()
+    arrays['scaler_mean'] = scaler.mean_
+    arrays['scaler_scale'] = scaler.scale_
+    metadata = {'kind': 'isolation_forest', 'columns': list(scaler_info['columns']), 'forest': forest.metadata()}
+    write_artifact(path, metadata, arrays)
+
+
+def load_model(path: str) -> Tuple[CompiledForest, dict]:
+    """Load a .safx artifact as (model, scaler_info), mirroring the joblib pair."""
+    metadata, arrays = read_artifact(path)
+    if metadata.get('kind') != 'isolation_forest':
+        raise ValueError(f"{path} does not contain an isolation forest")
+    forest = CompiledForest.from_arrays(metadata['forest'], arrays)
+    scaler = CompiledScaler(arrays['scaler_mean'], arrays['scaler_scale'])
+    return forest, {'scaler': scaler, 'columns': metadata['columns']}
+
+
+def export_joblib(model_path: str, scaler_path: str, artifact_path: str, dtype=np.float64) -> None:
+    import joblib
+
+    export_model(joblib.load(model_path), joblib.load(scaler_path), artifact_path, dtype)
+    print(f"Exported {model_path} and {scaler_path} to {artifact_path} ({np.dtype(dtype).name})")
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--float32']
+    dtype = np.float32 if len(args) < len(sys.argv) - 1 else np.float64
+    if len(args) == 3:
+        export_joblib(*args, dtype=dtype)
+    elif len(args) == 0:
+        export_joblib('isolation_forest_model_dropoff.joblib', 'scaler_and_columns_dropoff.joblib',
+                      'isolation_forest_model_dropoff.safx', dtype)
+        export_joblib('isolation_forest_model.joblib', 'scaler_and_columns.joblib',
+                      'isolation_forest_model.safx', dtype)
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -1,102 +1,381 @@
-import pandas as pd
 import numpy as np
-import joblib
 import os
+import hashlib
+from time import perf_counter
 from typing import Tuple, Optional
 
-class DropoffModelHandler:
+import metrics
+from model_artifact import CompiledForest, CompiledScaler, load_model
+from result_cache import ResultCache, max_entries_from_env, precision_from_env
+
+def file_digest(*paths: str) -> str:
+    """Short content hash of the model files, used as the model version."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+class BaseModelHandler:
+    """
+    Shared loading and scoring for the IsolationForest handlers. Subclasses set
+    the artifact paths and thresholds and map a payload to named raw features.
+
+    The pickle-free .safx artifact (see model_artifact.py) is preferred; the
+    joblib model/scaler pair is used when no artifact has been exported.
+
+    With SAFARX_RESULT_CACHE_SIZE set, scores are cached per quantized raw
+    feature vector (see result_cache.py);
+    `cache_precision` gives the rounding step of each model column. With an
+    OnlineLearner attached as `online` (see online_learning.py), every scored
+    feature vector is offered to its window, a DriftMonitor attached as
+    `drift` (see drift.py) sketches the features and scores, and a
+    PredictionLog attached as `prediction_log` (see prediction_log.py) persists
+    every scored row with `model_version`, a digest of the loaded model files.
+    With a ModelPool attached as `regions` (see model_pool.py), predictions
+    and batch rows for a region that has its own model loaded are scored by it.
+
+    A float32 artifact, or any model with SAFARX_FLOAT32=1 (see use_float32),
+    is scored in float32 from the feature buffers on; see precision_check.py
+    for how its risk levels compare with float64.
+    """
+    name = None
+    model_path = None
+    scaler_path = None
+    artifact_path = None
+    training_data_path = None
+    anomaly_threshold = None
+    high_risk_threshold = None
+    one_hot_prefix = None
+    cache_precision = {}
+    # Model columns reported under a payload field's name by explain; one-hot
+    # area risk columns are always reported as 'area_risk'.
+    attribution_fields = {}
+
     def __init__(self):
         self.model = None
         self.scaler_info = None
-        self.model_path = './isolation_forest_model_dropoff.joblib'
-        self.scaler_path = './scaler_and_columns_dropoff.joblib'
-    
+        self.result_cache = None
+        self.online = None
+        self.drift = None
+        self.prediction_log = None
+        self.regions = None
+        self.model_version = None
+        self._compiled = None
+        self._compiled_from = None
+
     def load_model_and_scaler(self) -> bool:
         try:
-            if not os.path.exists(self.model_path) or not os.path.exists(self.scaler_path):
-                raise FileNotFoundError(f"Model files not found")
-            
-            self.model = joblib.load(self.model_path)
-            self.scaler_info = joblib.load(self.scaler_path)
+            if os.path.exists(self.artifact_path):
+                self.model, self.scaler_info = load_model(self.artifact_path)
+                self.model_version = file_digest(self.artifact_path)
+            elif os.path.exists(self.model_path) and os.path.exists(self.scaler_path):
+                # joblib (and sklearn, through the pickles) only load on this fallback path.
+                import joblib
+                self.model = joblib.load(self.model_path)
+                self.scaler_info = joblib.load(self.scaler_path)
+                self.model_version = file_digest(self.model_path, self.scaler_path)
+            else:
+                raise FileNotFoundError(f"{self.name} model files not found")
+            if os.environ.get('SAFARX_FLOAT32', '0') == '1':
+                self.use_float32()
+            # A new model invalidates every cached score.
+            self.configure_cache()
             return True
         except Exception as e:
-            print(f"Error loading model: {e}")
+            print(f"Error loading {self.name} model: {e}")
             return False
-    
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Precision of the feature buffers: the forest's, float64 for an sklearn model."""
+        model = self.model
+        return model.dtype if isinstance(model, CompiledForest) else np.dtype(np.float64)
+
+    def use_float32(self) -> None:
+        """Score in float32: the forest, the scaler and the feature buffers (see CompiledForest.astype)."""
+        scaler = self.scaler_info['scaler']
+        if not isinstance(scaler, CompiledScaler):
+            scaler = CompiledScaler.from_sklearn(scaler)
+        self.model = self.compiled_forest().astype(np.float32)
+        self.scaler_info = {**self.scaler_info, 'scaler': scaler.astype(np.float32)}
+
+    def configure_cache(self, max_entries: Optional[int] = None, precision: Optional[dict] = None) -> None:
+        """Replace the result cache; defaults come from the class and the environment, 0 entries disables it."""
+        if max_entries is None:
+            max_entries = max_entries_from_env()
+        if precision is None:
+            precision = {**self.cache_precision, **precision_from_env()}
+            precision = {column: step for column, step in precision.items() if column in self.scaler_info['columns']}
+        if max_entries > 0:
+            self.result_cache = ResultCache(self.name, self.scaler_info['columns'], max_entries, precision)
+        else:
+            self.result_cache = None
+
+    def extract_features(self, payload_data: dict) -> dict:
+        """
+        Map a payload to named raw features. Must work both for a single payload
+        (scalar fields) and for a batch given as columns (one array per field).
+        """
+        raise NotImplementedError
+
+    def feature_row(self, payload_data: dict) -> np.ndarray:
+        # Same result as the training scripts' get_dummies + reindex(fill_value=0),
+        # without building a DataFrame: area_risk is one-hot encoded and any
+        # column the payload does not provide is 0.
+        features = self.extract_features(payload_data)
+        features[f"{self.one_hot_prefix}_{payload_data['area_risk']}"] = 1.0
+        required_columns = self.scaler_info['columns']
+        return np.array([[features.get(column, 0.0) for column in required_columns]], dtype=self.dtype)
+
     def preprocess_data(self, payload_data: dict) -> np.ndarray:
-        data = {
-            'network_connectivity_state': [payload_data['network_connectivity_state']],
-            'acc_vs_loc': [payload_data['acc_vs_loc']],
-            'time_since_last_successful_ping': [payload_data['time_since_last_successful_ping']],
-            'gps_accuracy_1': [payload_data['gps_accuracy'][0]],
-            'gps_accuracy_2': [payload_data['gps_accuracy'][1]],
-            'gps_accuracy_3': [payload_data['gps_accuracy'][2]],
-            'gps_accuracy_4': [payload_data['gps_accuracy'][3]],
-            'gps_accuracy_5': [payload_data['gps_accuracy'][4]],
-            'area_risk': [payload_data['area_risk']]
-        }
-        
-        df = pd.DataFrame(data)
-        
-        one_hot_encoded = pd.get_dummies(df['area_risk'], prefix='area_risk')
-        df_processed = df.drop('area_risk', axis=1)
-        df_processed = pd.concat([df_processed, one_hot_encoded], axis=1)
+        scaler = self.scaler_info['scaler']
+        return scaler.transform(self.feature_row(payload_data))
+
+    def feature_matrix(self, columns: dict) -> np.ndarray:
+        """Vectorized feature_row for a batch given as one array per payload field."""
+        features = self.extract_features(columns)
+        area_risk = np.asarray(columns['area_risk'])
+        one_hot_prefix = f"{self.one_hot_prefix}_"
         required_columns = self.scaler_info['columns']
-        
-        df_aligned = df_processed.reindex(columns=required_columns, fill_value=0)
-        
+
+        data = np.zeros((len(area_risk), len(required_columns)), dtype=self.dtype)
+        for i, column in enumerate(required_columns):
+            if column in features:
+                data[:, i] = features[column]
+            elif column.startswith(one_hot_prefix):
+                data[:, i] = area_risk == column[len(one_hot_prefix):]
+        return data
+
+    def preprocess_batch(self, columns: dict) -> np.ndarray:
         scaler = self.scaler_info['scaler']
-        data_scaled = scaler.transform(df_aligned.astype(float))
-        
-        return data_scaled
-    
+        return scaler.transform(self.feature_matrix(columns))
+
     def predict_anomaly(self, scaled_data: np.ndarray) -> Tuple[float, bool]:
         anomaly_score = self.model.decision_function(scaled_data)[0]
-        is_anomaly = anomaly_score < -0.15
-        
+        is_anomaly = anomaly_score < self.anomaly_threshold
+
         return anomaly_score, is_anomaly
-    
+
     def get_risk_level(self, anomaly_score: float) -> str:
-        if anomaly_score < -0.3:
+        if anomaly_score < self.high_risk_threshold:
             return "HIGH"
-        elif anomaly_score < -0.15:
+        elif anomaly_score < self.anomaly_threshold:
             return "MEDIUM"
         else:
             return "LOW"
-    
-    def predict(self, payload_data: dict) -> dict:
-        
-        scaled_data = self.preprocess_data(payload_data)
-        anomaly_score, is_anomaly = self.predict_anomaly(scaled_data)
+
+    def compiled_forest(self) -> CompiledForest:
+        """The model as a CompiledForest; a joblib-loaded model is compiled once."""
+        model = self.model
+        if isinstance(model, CompiledForest):
+            return model
+        if self._compiled_from is not model:
+            self._compiled = CompiledForest.from_sklearn(model)
+            self._compiled_from = model
+        return self._compiled
+
+    def compile_model(self) -> None:
+        """Replace a joblib-loaded model by its CompiledForest, releasing the sklearn model."""
+        self.model = self.compiled_forest()
+        self._compiled = self._compiled_from = None
+
+    def drivers(self, contributions: np.ndarray, top_n: int = 3) -> list:
+        """The payload fields whose splits pushed a prediction most towards anomaly."""
+        one_hot_prefix = f"{self.one_hot_prefix}_"
+        totals = {}
+        for column, contribution in zip(self.scaler_info['columns'], contributions):
+            field = 'area_risk' if column.startswith(one_hot_prefix) else self.attribution_fields.get(column, column)
+            totals[field] = totals.get(field, 0.0) + contribution
+        ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top_n]
+        return [
+            {"feature": field, "contribution": round(float(contribution), 4)}
+            for field, contribution in ranked if contribution > 0
+        ]
+
+    def predict(self, payload_data: dict, explain: bool = False) -> dict:
+        """
+        Score one payload. With `explain`, the result also lists the top
+        'drivers' (see CompiledForest.path_contributions), computed in the same
+        traversal as the score; the result cache is bypassed.
+        """
+        if self.regions is not None:
+            regional = self.regions.handler_for(payload_data)
+            if regional is not None:
+                return regional.predict(payload_data, explain)
+        cache = self.result_cache
+        start = perf_counter()
+        row = self.feature_row(payload_data)
+        if explain:
+            scaled_data = self.scaler_info['scaler'].transform(row)
+            preprocessed = perf_counter()
+            scores, contributions = self.compiled_forest().decision_function_with_contributions(scaled_data)
+            anomaly_score = scores[0]
+            is_anomaly = anomaly_score < self.anomaly_threshold
+            scored = perf_counter()
+        elif cache is None:
+            scaled_data = self.scaler_info['scaler'].transform(row)
+            preprocessed = perf_counter()
+            anomaly_score, is_anomaly = self.predict_anomaly(scaled_data)
+            scored = perf_counter()
+        else:
+            keys = cache.keys(row)
+            (anomaly_score,) = cache.get_many(keys)
+            preprocessed = perf_counter()
+            if anomaly_score is None:
+                anomaly_score, _ = self.predict_anomaly(self.scaler_info['scaler'].transform(row))
+                cache.put_many(keys, [anomaly_score])
+            is_anomaly = anomaly_score < self.anomaly_threshold
+            scored = perf_counter()
         risk_level = self.get_risk_level(anomaly_score)
-        
-        return {
+        self.observe(row, np.array([anomaly_score]))
+        if self.prediction_log is not None:
+            self.prediction_log.record(self, row, [anomaly_score], [risk_level], perf_counter() - start)
+
+        # Labelled by the endpoint being served (e.g. 'device' scores both models).
+        endpoint = metrics.request_endpoint(self.name)
+        metrics.STAGE_LATENCY.observe(preprocessed - start, endpoint, 'preprocess')
+        metrics.STAGE_LATENCY.observe(scored - preprocessed, endpoint, 'decision_function')
+        metrics.record_prediction(self.name, risk_level, is_anomaly)
+
+        result = {
             "is_anomaly": bool(is_anomaly),
             "risk_level": risk_level
         }
+        if explain:
+            result["drivers"] = self.drivers(contributions[0])
+        return result
+
+    def predict_batch(self, columns: dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Score a batch given as columns.
+
+        Returns:
+            Tuple of (anomaly_scores, is_anomaly, risk_levels) arrays
+        """
+        if self.regions is not None and columns.get('region') is not None:
+            return self._predict_regions(columns)
+        start = perf_counter()
+        data = rows = self.feature_matrix(columns)
+        cache = self.result_cache
+        if cache is not None:
+            keys = cache.keys(data)
+            cached = np.array(cache.get_many(keys), dtype=float)
+            misses = np.flatnonzero(np.isnan(cached))
+            data = data[misses]
+        scaled_data = self.scaler_info['scaler'].transform(data)
+        preprocessed = perf_counter()
+        anomaly_scores = self.model.decision_function(scaled_data) if len(scaled_data) else np.empty(0)
+        if cache is not None:
+            cache.put_many([keys[i] for i in misses], anomaly_scores)
+            cached[misses] = anomaly_scores
+            anomaly_scores = cached
+        scored = perf_counter()
+        is_anomaly = anomaly_scores < self.anomaly_threshold
+        risk_levels = self.risk_levels(anomaly_scores)
+        self.observe(rows, anomaly_scores)
+        if self.prediction_log is not None:
+            self.prediction_log.record(self, rows, anomaly_scores, risk_levels, perf_counter() - start, len(rows))
+
+        endpoint = metrics.request_endpoint(self.name)
+        metrics.STAGE_LATENCY.observe(preprocessed - start, endpoint, 'preprocess')
+        metrics.STAGE_LATENCY.observe(scored - preprocessed, endpoint, 'decision_function')
+        metrics.record_predictions(self.name, risk_levels, is_anomaly)
+
+        return anomaly_scores, is_anomaly, risk_levels
+
+    def _predict_regions(self, columns: dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """predict_batch with the rows grouped by `region`, each group scored by its region's loaded model."""
+        regions = np.asarray(columns['region'], dtype=object)
+        columns = {name: values for name, values in columns.items() if name != 'region'}
+        anomaly_scores = np.empty(len(regions))
+        is_anomaly = np.empty(len(regions), dtype=bool)
+        risk_levels = np.empty(len(regions), dtype='<U6')
+        remaining = np.ones(len(regions), dtype=bool)
+        for region in {region for region in regions if region is not None}:
+            handler = self.regions.get(region)
+            if handler is None:
+                continue
+            rows = regions == region
+            remaining &= ~rows
+            anomaly_scores[rows], is_anomaly[rows], risk_levels[rows] = handler.predict_batch(
+                {name: values[rows] for name, values in columns.items()}
+            )
+        if remaining.all():
+            return self.predict_batch(columns)
+        if remaining.any():
+            anomaly_scores[remaining], is_anomaly[remaining], risk_levels[remaining] = self.predict_batch(
+                {name: values[remaining] for name, values in columns.items()}
+            )
+        return anomaly_scores, is_anomaly, risk_levels
+
+    def observe(self, rows: np.ndarray, anomaly_scores: np.ndarray) -> None:
+        """Hand scored feature rows to the online learner and the drift monitor, if attached."""
+        if self.online is not None:
+            self.online.observe(rows, anomaly_scores < self.anomaly_threshold)
+        if self.drift is not None:
+            self.drift.observe(rows, anomaly_scores)
+
+    def risk_levels(self, anomaly_scores: np.ndarray) -> np.ndarray:
+        """Vectorized get_risk_level."""
+        return np.where(
+            anomaly_scores < self.high_risk_threshold, "HIGH",
+            np.where(anomaly_scores < self.anomaly_threshold, "MEDIUM", "LOW")
+        )
+
+    def score_batch(self, columns: dict) -> np.ndarray:
+        """
+        Anomaly scores for a batch given as columns, bypassing the cache,
+        metrics and observers, and the regional models: shadow evaluation
+        compares global models.
+        """
+        return self.model.decision_function(self.preprocess_batch(columns))
+
+#===========================================================
+
+class DropoffModelHandler(BaseModelHandler):
+    name = 'dropoff'
+    model_path = './isolation_forest_model_dropoff.joblib'
+    scaler_path = './scaler_and_columns_dropoff.joblib'
+    artifact_path = './isolation_forest_model_dropoff.safx'
+    training_data_path = './dropoff_data.csv'
+    anomaly_threshold = -0.15
+    high_risk_threshold = -0.3
+    one_hot_prefix = 'area_risk'
+    cache_precision = {f'gps_accuracy_{i}': 0.01 for i in range(1, 6)}
+    attribution_fields = {f'gps_accuracy_{i}': 'gps_accuracy' for i in range(1, 6)}
+
+    def extract_features(self, payload_data: dict) -> dict:
+        # [..., i] picks the i-th reading for one payload and the i-th column for a batch.
+        gps_accuracy = np.asarray(payload_data['gps_accuracy'], dtype=self.dtype)
+        return {
+            'network_connectivity_state': payload_data['network_connectivity_state'],
+            'acc_vs_loc': payload_data['acc_vs_loc'],
+            'time_since_last_successful_ping': payload_data['time_since_last_successful_ping'],
+            'gps_accuracy_1': gps_accuracy[..., 0],
+            'gps_accuracy_2': gps_accuracy[..., 1],
+            'gps_accuracy_3': gps_accuracy[..., 2],
+            'gps_accuracy_4': gps_accuracy[..., 3],
+            'gps_accuracy_5': gps_accuracy[..., 4]
+        }
 
 model_handler = DropoffModelHandler()
 
 #===========================================================
 
-class InactivityModelHandler:
-    def __init__(self):
-        self.model = None
-        self.scaler_info = None
-        self.model_path = './isolation_forest_model.joblib'
-        self.scaler_path = './scaler_and_columns.joblib'
-    
-    def load_model_and_scaler(self) -> bool:
-        try:
-            if not os.path.exists(self.model_path) or not os.path.exists(self.scaler_path):
-                raise FileNotFoundError(f"Inactivity model files not found")
-            self.model = joblib.load(self.model_path)
-            self.scaler_info = joblib.load(self.scaler_path)
-            return True
-        except Exception as e:
-            print(f"Error loading inactivity model: {e}")
-            return False
-    
+class InactivityModelHandler(BaseModelHandler):
+    name = 'inactivity'
+    model_path = './isolation_forest_model.joblib'
+    scaler_path = './scaler_and_columns.joblib'
+    artifact_path = './isolation_forest_model.safx'
+    training_data_path = './user_activity_data.csv'
+    anomaly_threshold = -0.1
+    high_risk_threshold = -0.2
+    one_hot_prefix = 'risk'
+    cache_precision = {'displacement_m': 0.01}
+    attribution_fields = {'hour_sin': 'hour', 'hour_cos': 'hour'}
+
     def create_cyclical_time_features(self, hour: int) -> Tuple[float, float]:
         angle = (hour / 24) * 2 * np.pi
         phase_shift = (7 / 24) * 2 * np.pi
@@ -107,59 +386,18 @@ class InactivityModelHandler:
         
         return hour_sin, hour_cos
     
-    def preprocess_data(self, payload_data: dict) -> np.ndarray:
+    def extract_features(self, payload_data: dict) -> dict:
         hour_sin, hour_cos = self.create_cyclical_time_features(payload_data['hour'])
-        
-        data = {
-            'hour_sin': [hour_sin],
-            'hour_cos': [hour_cos],
-            'motion_state': [payload_data['motion_state']],
-            'displacement_m': [payload_data['displacement_m']],
-            'time_since_last_interaction_min': [payload_data['time_since_last_interaction_min']],
-            'missed_ping_count': [payload_data['missed_ping_count']],
-            'area_risk': [payload_data['area_risk']],
-            'battery_level_percent': [payload_data['battery_level_percent']],
-            'is_expected_active': [payload_data['is_expected_active']]
-        }
-        
-        df = pd.DataFrame(data)
-        
-        one_hot_encoded = pd.get_dummies(df['area_risk'], prefix='risk')
-        df_processed = df.drop('area_risk', axis=1)
-        df_processed = pd.concat([df_processed, one_hot_encoded], axis=1)
-        required_columns = self.scaler_info['columns']
-
-        df_aligned = df_processed.reindex(columns=required_columns, fill_value=0)
-
-        scaler = self.scaler_info['scaler']
-        data_scaled = scaler.transform(df_aligned.astype(float))
-        
-        return data_scaled
-    
-    def predict_anomaly(self, scaled_data: np.ndarray) -> Tuple[float, bool]:
-        anomaly_score = self.model.decision_function(scaled_data)[0]
-        
-        is_anomaly = anomaly_score < -0.1
-        
-        return anomaly_score, is_anomaly
-    
-    def get_risk_level(self, anomaly_score: float) -> str:
-        if anomaly_score < -0.2:
-            return "HIGH"
-        elif anomaly_score < -0.1:
-            return "MEDIUM"
-        else:
-            return "LOW"
-    
-    def predict(self, payload_data: dict) -> dict:
-
-        scaled_data = self.preprocess_data(payload_data)
-        anomaly_score, is_anomaly = self.predict_anomaly(scaled_data)
-        risk_level = self.get_risk_level(anomaly_score)
 
         return {
-            "is_anomaly": bool(is_anomaly),
-            "risk_level": risk_level
+            'hour_sin': hour_sin,
+            'hour_cos': hour_cos,
+            'motion_state': payload_data['motion_state'],
+            'displacement_m': payload_data['displacement_m'],
+            'time_since_last_interaction_min': payload_data['time_since_last_interaction_min'],
+            'missed_ping_count': payload_data['missed_ping_count'],
+            'battery_level_percent': payload_data['battery_level_percent'],
+            'is_expected_active': payload_data['is_expected_active']
         }
 
 # Global instance
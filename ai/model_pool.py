@@ -0,0 +1,237 @@
+"""
+Per-region models for the anomaly handlers, loaded lazily under a memory budget.
+
+With SAFARX_REGION_MODELS set, each handler gets a ModelPool of the regional
+models found in <dir>/<model>/ (dropoff/, inactivity/), one per region:
+
+    <region>.safx                              a model_artifact.py export, or
+    <region>.joblib + <region>.scaler.joblib   a model and scaler/columns pair
+
+A payload's region is its `region` field or, when it only has `lat`/`lon`,
+the name of the SAFARX_REGIONS GeoJSON polygon containing it; batches (the
+JSON/msgpack `/batch` bodies and the streams) are grouped on their `region`
+column. The handler scores it with that region's model if the pool holds it, and with its own
+(global) model otherwise: when the region has no model, failed to load, or
+is still loading. Loads run on a background thread so a request never waits
+on disk unless `load_timeout` allows it; joblib models are compiled to a
+CompiledForest on load. Loaded models are kept in LRU order and the least
+recently used are evicted once their arrays exceed the memory budget.
+
+    SAFARX_REGION_MODELS       directory of <model>/<region> models; unset disables the pools
+    SAFARX_REGION_MODELS_MB    memory budget of each model's pool in MiB (default 256)
+    SAFARX_REGIONS             GeoJSON polygons with a "name" property per region, used
+                               to find the region of payloads that send lat/lon
+"""
+
+import os
+import time
+import threading
+import collections
+import concurrent.futures
+from typing import Callable, Dict, Optional
+
+import metrics
+from model_artifact import CompiledScaler
+
+ARTIFACT_SUFFIX = '.safx'
+MODEL_SUFFIX = '.joblib'
+SCALER_SUFFIX = '.scaler.joblib'
+REGIONS_PATH = os.environ.get('SAFARX_REGIONS') or None
+
+regions = None
+
+
+def load_regions(path: Optional[str] = REGIONS_PATH) -> bool:
+    """Load the region polygons that payloads with only lat/lon are routed by."""
+    global regions
+    if not path:
+        return False
+    try:
+        from safetyscore import GeofenceIndex
+        regions = GeofenceIndex.from_geojson(path)
+        return True
+    except Exception as e:
+        print(f"Error loading regions from {path}: {e}")
+        return False
+
+
+def region_for(lat: float, lon: float) -> Optional[str]:
+    """Name of the first loaded region polygon containing (lat, lon), or None."""
+    if regions is None:
+        return None
+    names = [name for name in regions.find(lat, lon) if name]
+    return names[0] if names else None
+
+
+def payload_region(payload_data: dict) -> Optional[str]:
+    """The payload's `region`, or the region its lat/lon fall in."""
+    region = payload_data.get('region')
+    if region is None and payload_data.get('lat') is not None and payload_data.get('lon') is not None:
+        region = region_for(payload_data['lat'], payload_data['lon'])
+    return region
+
+
+def model_bytes(handler) -> int:
+    forest = handler.compiled_forest()
+    size = sum(array.nbytes for array in forest.arrays().values())
+    scaler = handler.scaler_info['scaler']
+    if isinstance(scaler, CompiledScaler):
+        size += scaler.mean_.nbytes + scaler.scale_.nbytes
+    return size
+
+
+class ModelPool:
+    def __init__(self, handler, directory: str, max_bytes: int = 256 * 2**20,
+                 key: Callable[[dict], Optional[str]] = payload_region, load_timeout: float = 0.0):
+        """
+        Args:
+            handler: The global handler; regional models are handlers of its class
+            directory: Directory holding the <region> model files
+            max_bytes: Memory budget of the loaded models' arrays
+            key: Maps a payload to its region, or None for the global model
+            load_timeout: Seconds a request waits for its region's model to
+                load before the global model serves it (0: never waits)
+        """
+        self.handler = handler
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.key = key
+        self.load_timeout = load_timeout
+        self.available: Dict[str, tuple] = {}
+        self.failed: Dict[str, str] = {}
+        self.loaded_bytes = 0
+        self.stats = collections.Counter()
+        # region -> (handler, bytes), least recently used first
+        self._models = collections.OrderedDict()
+        self._loading: Dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f'model-pool-{handler.name}'
+        )
+        self.rescan()
+
+    def rescan(self) -> None:
+        """Find the regional model files again; regions that failed to load are retried."""
+        available = {}
+        for filename in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, filename)
+            if filename.endswith(ARTIFACT_SUFFIX):
+                available[filename[:-len(ARTIFACT_SUFFIX)]] = (path, '', '')
+            elif filename.endswith(MODEL_SUFFIX) and not filename.endswith(SCALER_SUFFIX):
+                region = filename[:-len(MODEL_SUFFIX)]
+                scaler_path = os.path.join(self.directory, region + SCALER_SUFFIX)
+                if region not in available and os.path.exists(scaler_path):
+                    available[region] = ('', path, scaler_path)
+        with self._lock:
+            self.available = available
+            self.failed = {}
+
+    def handler_for(self, payload_data: dict):
+        """The handler of the payload's region if it is loaded, else None (use the global model)."""
+        region = self.key(payload_data)
+        if region is None:
+            return None
+        return self.get(region)
+
+    def get(self, region: str):
+        """The handler for `region`, starting its load on a miss; None while it is not loaded."""
+        with self._lock:
+            entry = self._models.get(region)
+            if entry is not None:
+                self._models.move_to_end(region)
+                outcome = 'hit'
+            elif region not in self.available:
+                outcome = 'no_model'
+            elif region in self.failed:
+                outcome = 'failed'
+            else:
+                outcome = 'loading'
+                future = self._loading.get(region)
+                if future is None:
+                    future = self._loading[region] = self._executor.submit(
+                        self._load, region, *self.available[region]
+                    )
+        if outcome == 'loading' and self.load_timeout > 0:
+            try:
+                entry = future.result(self.load_timeout)
+                outcome = 'hit' if entry is not None else 'failed'
+            except concurrent.futures.TimeoutError:
+                pass
+        self.stats[outcome] += 1
+        metrics.REGION_MODEL_LOOKUPS.inc(self.handler.name, outcome)
+        return entry[0] if entry is not None else None
+
+    def _load(self, region: str, artifact_path: str, model_path: str, scaler_path: str) -> Optional[tuple]:
+        start = time.perf_counter()
+        handler = type(self.handler)()
+        handler.artifact_path = artifact_path
+        handler.model_path = model_path
+        handler.scaler_path = scaler_path
+        entry = error = None
+        try:
+            if not handler.load_model_and_scaler():
+                error = 'could not load the model files'
+            else:
+                # Compiled, a joblib model takes less memory and its size is known.
+                handler.compile_model()
+                handler.model_version = f"{region}:{handler.model_version}"
+                # The global handler's observers see the traffic of every region.
+                handler.prediction_log = self.handler.prediction_log
+                handler.drift = self.handler.drift
+                handler.online = self.handler.online
+                size = model_bytes(handler)
+                if size > self.max_bytes:
+                    error = f"needs {size} bytes, over the {self.max_bytes} byte budget"
+                else:
+                    entry = (handler, size)
+        except Exception as e:
+            error = str(e)
+        metrics.REGION_MODEL_LOAD_SECONDS.observe(time.perf_counter() - start, self.handler.name)
+
+        with self._lock:
+            del self._loading[region]
+            if entry is None:
+                print(f"Error loading the {region} {self.handler.name} model, using the global model: {error}")
+                self.failed[region] = error
+                metrics.REGION_MODEL_LOADS.inc(self.handler.name, 'error')
+                return None
+            self._models[region] = entry
+            self.loaded_bytes += entry[1]
+            while self.loaded_bytes > self.max_bytes:
+                _, (_, size) = self._models.popitem(last=False)
+                self.loaded_bytes -= size
+                self.stats['evicted'] += 1
+                metrics.REGION_MODEL_EVICTIONS.inc(self.handler.name)
+            metrics.REGION_MODELS_LOADED.set(len(self._models), self.handler.name)
+            metrics.REGION_MODEL_BYTES.set(self.loaded_bytes, self.handler.name)
+        metrics.REGION_MODEL_LOADS.inc(self.handler.name, 'loaded')
+        return entry
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'available': sorted(self.available),
+                'loaded': {region: {'bytes': size, 'model_version': handler.model_version}
+                           for region, (handler, size) in self._models.items()},
+                'loading': sorted(self._loading),
+                'failed': dict(self.failed),
+                'loaded_bytes': self.loaded_bytes,
+                'max_bytes': self.max_bytes,
+                'lookups': {outcome: self.stats[outcome] for outcome in ('hit', 'loading', 'no_model', 'failed')},
+                'evicted': self.stats['evicted'],
+            }
+
+
+def from_env(handler) -> Optional[ModelPool]:
+    root = os.environ.get('SAFARX_REGION_MODELS')
+    if not root:
+        return None
+    directory = os.path.join(root, handler.name)
+    if not os.path.isdir(directory):
+        print(f"Warning: no regional {handler.name} models in {directory}, using the global model only")
+        return None
+    return ModelPool(handler, directory, max_bytes=int(float(os.environ.get('SAFARX_REGION_MODELS_MB', '256')) * 2**20))
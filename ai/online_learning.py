@@ -0,0 +1,256 @@
+"""
+Online refresh of the IsolationForests from live traffic.
+
+The models are trained once on synthetic data, so each handler can keep a
+sliding window of the raw feature vectors it has recently scored as normal.
+Every `interval` seconds a fraction of the forest's oldest trees is retrained
+on that window in a separate low-priority process, and the handler's model is
+swapped for the merged forest in a single assignment. Inference never waits on
+training: requests in flight finish on the model they started with.
+
+New trees are fitted on the window scaled with the model's existing scaler and
+with the same `max_samples`, so scores stay on the scale the handler
+thresholds were tuned for. Anomalous rows are kept out of the window by
+default, so anomalies do not become the new normal.
+
+Budgets, all from the environment when the service enables it with
+SAFARX_ONLINE_LEARNING=1:
+
+    SAFARX_ONLINE_WINDOW_MB         memory for each model's window (default 8)
+    SAFARX_ONLINE_SAMPLE_RATE       fraction of scored rows offered to the window (default 1.0)
+    SAFARX_ONLINE_INTERVAL          seconds between refreshes (default 600)
+    SAFARX_ONLINE_REPLACE_FRACTION  fraction of trees replaced per refresh (default 0.1)
+    SAFARX_ONLINE_CPU_FRACTION      cap on the training process's share of one core (default 0.25)
+"""
+
+import os
+import time
+import threading
+import multiprocessing
+import concurrent.futures
+from typing import Callable, Optional
+
+import numpy as np
+
+import metrics
+from model_artifact import CompiledForest
+
+
+def _lower_priority():
+    os.nice(10)
+
+
+def _train_trees(rows: np.ndarray, n_trees: int, max_samples: int, seed: int):
+    """Runs in the training process: fit `n_trees` trees and return them compiled."""
+    from sklearn.ensemble import IsolationForest
+
+    model = IsolationForest(n_estimators=n_trees, max_samples=max_samples, random_state=seed)
+    model.fit(rows)
+    forest = CompiledForest.from_sklearn(model)
+    return forest.metadata(), forest.arrays()
+
+
+_executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def training_executor() -> concurrent.futures.ProcessPoolExecutor:
+    """One shared single-worker process for all models, so refreshes never run in parallel."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: forking a process that runs the event loop and threadpool is unsafe.
+            _executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context('spawn'), initializer=_lower_priority
+            )
+        return _executor
+
+
+def _reset_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+class FeatureWindow:
+    """Ring buffer of the most recent raw feature rows."""
+
+    def __init__(self, capacity: int, n_features: int, dtype=np.float64):
+        self.capacity = capacity
+        self._rows = np.empty((capacity, n_features), dtype=dtype)
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def add(self, rows: np.ndarray) -> None:
+        rows = rows[-self.capacity:]
+        with self._lock:
+            end = self._next + len(rows)
+            if end <= self.capacity:
+                self._rows[self._next:end] = rows
+            else:
+                split = self.capacity - self._next
+                self._rows[self._next:] = rows[:split]
+                self._rows[:end - self.capacity] = rows[split:]
+            self._next = end % self.capacity
+            self._count = min(self._count + len(rows), self.capacity)
+
+    def snapshot(self) -> np.ndarray:
+        with self._lock:
+            return self._rows[:self._count].copy()
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class OnlineLearner:
+    def __init__(self, handler, window_mb: float = 8.0, sample_rate: float = 1.0, interval: float = 600.0,
+                 replace_fraction: float = 0.1, cpu_fraction: float = 0.25, min_rows: Optional[int] = None,
+                 exclude_anomalies: bool = True, seed: Optional[int] = None):
+        """
+        Args:
+            handler: Model handler whose model is refreshed; must be loaded
+            window_mb: Memory budget of the feature window in MiB
+            sample_rate: Probability that a scored row is offered to the window
+            interval: Seconds between refreshes
+            replace_fraction: Fraction of the trees replaced per refresh
+            cpu_fraction: Refreshes are spaced so training uses at most this
+                share of one core
+            min_rows: Window rows needed before the first refresh; defaults to
+                the forest's max_samples
+            exclude_anomalies: Keep rows scored as anomalous out of the window
+            seed: Seed for sampling and training, for reproducible runs
+        """
+        n_features = len(handler.scaler_info['columns'])
+        # A float32 handler's rows take half the memory, so the window holds twice as many.
+        dtype = handler.dtype
+        self.handler = handler
+        self.window = FeatureWindow(max(int(window_mb * 2**20 / (dtype.itemsize * n_features)), 1), n_features, dtype)
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.replace_fraction = replace_fraction
+        self.cpu_fraction = cpu_fraction
+        self.min_rows = min_rows
+        self.exclude_anomalies = exclude_anomalies
+        self.refreshes = 0
+        # Called with the handler after each swap, e.g. to send the new forest
+        # to the inference workers (see router.py).
+        self.on_swap: Optional[Callable[[object], None]] = None
+        self.last_refresh: Optional[float] = None
+        self.last_training_seconds = 0.0
+        self._rng = np.random.default_rng(seed)
+        self._seed = seed
+        self._model = None
+        self._forest: Optional[CompiledForest] = None
+        self._tree_age: Optional[np.ndarray] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def observe(self, rows: np.ndarray, is_anomaly) -> None:
+        """Offer scored raw feature rows (one per prediction) to the window. Called on the request path."""
+        keep = self._rng.random(len(rows)) < self.sample_rate
+        if self.exclude_anomalies:
+            keep &= ~np.asarray(is_anomaly, dtype=bool)
+        if keep.any():
+            self.window.add(rows[keep])
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name=f'online-{self.handler.name}', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.wait(self._next_delay()):
+            try:
+                self.refresh_once()
+            except Exception as e:
+                metrics.ONLINE_REFRESHES.inc(self.handler.name, 'error')
+                print(f"Error refreshing {self.handler.name} model online: {e}")
+
+    def _next_delay(self) -> float:
+        # Training for t seconds buys at least t / cpu_fraction seconds of rest.
+        return max(self.interval, self.last_training_seconds / self.cpu_fraction)
+
+    def _base_forest(self) -> CompiledForest:
+        model = self.handler.model
+        if model is not self._model:
+            # First refresh, or the handler reloaded its model from disk.
+            self._model = model
+            self._forest = model if isinstance(model, CompiledForest) else CompiledForest.from_sklearn(model)
+            self._tree_age = np.zeros(len(self._forest.roots), dtype=np.int64)
+        return self._forest
+
+    def refresh_once(self) -> bool:
+        """Retrain the oldest trees on the current window and swap the model; False if the window is too small."""
+        base = self._base_forest()
+        model = self._model
+        rows = self.window.snapshot()
+        if len(rows) < max(self.min_rows or 0, base.max_samples_):
+            metrics.ONLINE_REFRESHES.inc(self.handler.name, 'skipped')
+            return False
+
+        n_trees = max(int(round(len(base.roots) * self.replace_fraction)), 1)
+        # Oldest first; stable sort keeps index order among trees of the same age.
+        trees = np.argsort(-self._tree_age, kind='stable')[:n_trees]
+        scaled = self.handler.scaler_info['scaler'].transform(rows)
+        seed = int(self._rng.integers(2**31)) if self._seed is None else self._seed + self.refreshes
+
+        start = time.perf_counter()
+        try:
+            metadata, arrays = training_executor().submit(
+                _train_trees, scaled, n_trees, base.max_samples_, seed
+            ).result()
+        except concurrent.futures.process.BrokenProcessPool:
+            # The training process died (e.g. killed for memory); start a fresh one next time.
+            _reset_executor()
+            raise
+        self.last_training_seconds = time.perf_counter() - start
+
+        if self.handler.model is not model:
+            # Reloaded while training: the new trees belong to the old forest.
+            metrics.ONLINE_REFRESHES.inc(self.handler.name, 'discarded')
+            return False
+        merged = base.replace_trees(trees, CompiledForest.from_arrays(metadata, arrays))
+        self._tree_age += 1
+        self._tree_age[trees] = 0
+        self._model = self._forest = merged
+        self.handler.model = merged
+        # Scores cached for the old forest no longer apply.
+        self.handler.configure_cache()
+
+        self.refreshes += 1
+        # Versions of refreshed forests read <file digest>+online<n>.
+        self.handler.model_version = f"{self.handler.model_version.split('+')[0]}+online{self.refreshes}"
+        self.last_refresh = time.time()
+        metrics.ONLINE_REFRESHES.inc(self.handler.name, 'swapped')
+        metrics.ONLINE_TRAINING_SECONDS.observe(self.last_training_seconds, self.handler.name)
+        if self.on_swap is not None:
+            self.on_swap(self.handler)
+        return True
+
+    def status(self) -> dict:
+        return {
+            'window_rows': len(self.window),
+            'window_capacity': self.window.capacity,
+            'refreshes': self.refreshes,
+            'last_refresh': self.last_refresh,
+            'last_training_seconds': round(self.last_training_seconds, 3),
+            'running': self._thread is not None and self._thread.is_alive(),
+        }
+
+
+def from_env(handler) -> OnlineLearner:
+    return OnlineLearner(
+        handler,
+        window_mb=float(os.environ.get('SAFARX_ONLINE_WINDOW_MB', '8')),
+        sample_rate=float(os.environ.get('SAFARX_ONLINE_SAMPLE_RATE', '1.0')),
+        interval=float(os.environ.get('SAFARX_ONLINE_INTERVAL', '600')),
+        replace_fraction=float(os.environ.get('SAFARX_ONLINE_REPLACE_FRACTION', '0.1')),
+        cpu_fraction=float(os.environ.get('SAFARX_ONLINE_CPU_FRACTION', '0.25')),
+    )
@@ -0,0 +1,152 @@
+"""
+Compare float32 scoring with float64 on the test CSVs.
+
+Each model is loaded twice: as exported in float64, and switched to float32
+(BaseModelHandler.use_float32, the same arrays a `model_artifact.py --float32`
+export holds). Every CSV row is scored by both through the batch path
+(feature_matrix, scaler, forest), and the report lists the rows whose risk
+level or anomaly flag differ, the largest score difference, and the bytes the
+model arrays and the batch's feature buffers take in each precision.
+
+The forest takes the same branches in both (thresholds are rounded to match,
+see CompiledForest.astype); differences come from rounding the raw features
+and the scaling to float32, and can only flip rows whose float64 value lies
+within a float32 step of a threshold.
+
+Usage (from the `ai/` directory):
+    python precision_check.py
+    python precision_check.py --dropoff new_dropoff.csv --inactivity new_activity.csv --show 20
+    python precision_check.py --json precision.json
+
+Exits with status 1 if any row's risk level differs.
+"""
+
+import os
+import sys
+import json
+import argparse
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from model_handler import DropoffModelHandler, InactivityModelHandler
+
+DATASETS = {
+    'dropoff': (DropoffModelHandler, ['tourist_safety_dataset_test.csv', 'dropoff_data.csv']),
+    'inactivity': (InactivityModelHandler, ['user_activity_data.csv']),
+}
+GPS_COLUMNS = [f'gps_accuracy_{i}' for i in range(1, 6)]
+
+
+def frame_columns(frame: pd.DataFrame) -> dict:
+    """A CSV of payload fields in the column form predict_batch takes; gps_accuracy_1..5 become gps_accuracy."""
+    columns = {name: frame[name].to_numpy() for name in frame.columns if name not in GPS_COLUMNS}
+    if GPS_COLUMNS[0] in frame:
+        columns['gps_accuracy'] = frame[GPS_COLUMNS].to_numpy()
+    return columns
+
+
+def load_pair(handler_class) -> tuple:
+    """(float64 handler, float32 handler) for one model."""
+    reference = handler_class()
+    if not reference.load_model_and_scaler():
+        raise SystemExit(f"Could not load the {reference.name} model")
+    if reference.dtype != np.float64:
+        # A float32 artifact: compare with the joblib pair it was exported from.
+        print(f"Warning: {reference.artifact_path} is {reference.dtype.name}; using the joblib model as float64 reference")
+        reference = handler_class()
+        reference.artifact_path = ''
+        if not reference.load_model_and_scaler():
+            raise SystemExit(f"Could not load the {reference.name} joblib model")
+    reduced = handler_class()
+    reduced.model, reduced.scaler_info = reference.model, reference.scaler_info
+    reduced.use_float32()
+    return reference, reduced
+
+
+def model_bytes(handler) -> int:
+    forest = handler.compiled_forest()
+    scaler = handler.scaler_info['scaler']
+    return sum(array.nbytes for array in forest.arrays().values()) + scaler.mean_.nbytes + scaler.scale_.nbytes
+
+
+def compare(reference, reduced, columns: dict) -> dict:
+    features = {}
+    scores = {}
+    for handler in (reference, reduced):
+        data = handler.feature_matrix(columns)
+        scaled = handler.scaler_info['scaler'].transform(data)
+        features[handler] = data.nbytes + scaled.nbytes
+        scores[handler] = handler.model.decision_function(scaled)
+
+    levels = reference.risk_levels(scores[reference]), reduced.risk_levels(scores[reduced])
+    flags = scores[reference] < reference.anomaly_threshold, scores[reduced] < reduced.anomaly_threshold
+    differences = np.abs(scores[reference] - scores[reduced])
+    rows = np.flatnonzero(levels[0] != levels[1])
+    return {
+        'rows': len(differences),
+        'risk_level_disagreements': len(rows),
+        'anomaly_disagreements': int(np.sum(flags[0] != flags[1])),
+        'max_score_difference': float(differences.max()) if len(differences) else 0.0,
+        'feature_bytes': {'float64': features[reference], 'float32': features[reduced]},
+        'disagreeing_rows': [
+            {
+                'row': int(row),
+                'score_float64': float(scores[reference][row]),
+                'score_float32': float(scores[reduced][row]),
+                'risk_level_float64': str(levels[0][row]),
+                'risk_level_float32': str(levels[1][row]),
+            }
+            for row in rows
+        ],
+    }
+
+
+def run(paths: Dict[str, List[str]]) -> dict:
+    report = {}
+    for model, (handler_class, _) in DATASETS.items():
+        reference, reduced = load_pair(handler_class)
+        report[model] = {
+            'model_bytes': {'float64': model_bytes(reference), 'float32': model_bytes(reduced)},
+            'datasets': {path: compare(reference, reduced, frame_columns(pd.read_csv(path))) for path in paths[model]},
+        }
+    return report
+
+
+def print_report(report: dict, show: int) -> None:
+    for model, entry in report.items():
+        sizes = entry['model_bytes']
+        print(f"{model}: model arrays {sizes['float64'] / 1024:.0f} KiB float64, {sizes['float32'] / 1024:.0f} KiB float32")
+        for path, result in entry['datasets'].items():
+            print(f"  {path}: {result['rows']} rows, {result['risk_level_disagreements']} risk level and "
+                  f"{result['anomaly_disagreements']} anomaly flag disagreements, "
+                  f"max score difference {result['max_score_difference']:.3g}")
+            for row in result['disagreeing_rows'][:show]:
+                print(f"    row {row['row']}: {row['risk_level_float64']} ({row['score_float64']:.6f}) in float64, "
+                      f"{row['risk_level_float32']} ({row['score_float32']:.6f}) in float32")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for model, (_, paths) in DATASETS.items():
+        parser.add_argument(f'--{model}', nargs='+', default=paths, metavar='CSV', help=f'default: {" ".join(paths)}')
+    parser.add_argument('--show', type=int, default=10, help='disagreeing rows to print per CSV')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    # The reference must load as float64 whatever the service is configured with.
+    os.environ.pop('SAFARX_FLOAT32', None)
+    report = run({model: getattr(args, model) for model in DATASETS})
+    print_report(report, args.show)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    disagreements = sum(
+        result['risk_level_disagreements'] for entry in report.values() for result in entry['datasets'].values()
+    )
+    sys.exit(1 if disagreements else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Persistence of every scored request as partitioned Parquet.
+
+A handler with a PredictionLog attached as `prediction_log` hands each scored
+feature row (raw model columns, before scaling) with its score, risk level,
+latency and model version to `record`, which only appends to an in-memory
+queue. A writer thread drains the queue every `flush_interval` seconds, or
+sooner once `row_group_rows` rows are waiting, and appends one row group per
+model and hour to
+
+    <root>/model=<name>/date=YYYY-MM-DD/hour=HH/part-<start>-<pid>.parquet
+
+A part file is written under a `.tmp` name and renamed once its hour is over
+(or when the log is closed), so readers only ever see complete files; the
+pid keeps files from several worker processes apart. When more than
+`max_pending_rows` rows are waiting the newest are dropped and counted, so a
+slow disk cannot grow memory or slow the request path.
+
+The layout is hive-partitioned, so pyarrow, pandas, DuckDB or Spark can read
+a month of predictions and skip partitions by model, date and hour; see
+`read_predictions`. Writing needs the optional `pyarrow` package.
+
+    SAFARX_PREDICTION_LOG_DIR          root directory; unset disables the log
+    SAFARX_PREDICTION_LOG_FLUSH        seconds between flushes (default 60)
+    SAFARX_PREDICTION_LOG_MAX_PENDING  rows waiting to be written, at most (default 100000)
+"""
+
+import os
+import time
+import threading
+import collections
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def _pyarrow():
+    import pyarrow
+    import pyarrow.parquet
+    return pyarrow
+
+
+class PredictionLog:
+    def __init__(self, root: str, flush_interval: float = 60.0, row_group_rows: int = 50_000,
+                 max_pending_rows: int = 100_000):
+        """
+        Args:
+            root: Directory the model=<name> partitions are created in
+            flush_interval: Seconds between flushes when traffic is low
+            row_group_rows: Waiting rows that trigger an early flush
+            max_pending_rows: Rows waiting to be written, at most; more are dropped
+        """
+        self.root = root
+        self.flush_interval = flush_interval
+        self.row_group_rows = row_group_rows
+        self.max_pending_rows = max_pending_rows
+        self.written = 0
+        self.dropped = 0
+        self.files = 0
+        self._pending = collections.deque()
+        # Rows queued by request threads and taken by the writer. Request threads
+        # check and reserve room together, so both counters (and `dropped`) are
+        # only changed under _count_lock, which is never held across I/O.
+        self._queued_rows = 0
+        self._taken_rows = 0
+        self._count_lock = threading.Lock()
+        # (model, hours since the epoch) -> (ParquetWriter, tmp path, final path)
+        self._writers: Dict[Tuple[str, int], tuple] = {}
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='prediction-log', daemon=True)
+        self._thread.start()
+
+    def record(self, handler, rows: np.ndarray, scores, risk_levels, latency: float, batch_size: int = 1) -> None:
+        """Queue scored rows. Called on the request path; never blocks on I/O."""
+        with self._count_lock:
+            pending_rows = self._queued_rows - self._taken_rows + len(rows)
+            if pending_rows > self.max_pending_rows:
+                self.dropped += len(rows)
+                return
+            self._queued_rows += len(rows)
+        self._pending.append((
+            time.time(), handler.name, handler.model_version, handler.scaler_info['columns'],
+            rows, scores, risk_levels, handler.anomaly_threshold, latency, batch_size,
+        ))
+        if pending_rows >= self.row_group_rows:
+            self._wakeup.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error writing prediction log: {e}")
+
+    def flush(self) -> None:
+        """Write what is queued as one row group per model and hour, and close finished hours."""
+        pa = _pyarrow()
+        with self._lock:
+            # deque.popleft is atomic, so records queued meanwhile wait for the next flush.
+            batch = [self._pending.popleft() for _ in range(len(self._pending))]
+            with self._count_lock:
+                self._taken_rows += sum(len(record[4]) for record in batch)
+            groups = collections.defaultdict(list)
+            for record in batch:
+                groups[(record[1], int(record[0] // 3600), tuple(record[3]))].append(record)
+            for (model, hours, _), records in groups.items():
+                table = self._table(pa, records)
+                partition = (model, hours)
+                self._writer(pa, partition, table.schema).write_table(table)
+                self.written += table.num_rows
+            current_hour = int(time.time() // 3600)
+            for partition in [partition for partition in self._writers if partition[1] < current_hour]:
+                self._close(partition)
+
+    @staticmethod
+    def _table(pa, records: list):
+        columns = records[0][3]
+        rows = np.concatenate([record[4] for record in records])
+        scores = np.concatenate([np.asarray(record[5], dtype=np.float64) for record in records])
+        counts = [len(record[4]) for record in records]
+        data = {
+            'timestamp': pa.array((np.repeat([record[0] for record in records], counts) * 1e6).astype(np.int64),
+                                  pa.timestamp('us', tz='UTC')),
+            'model_version': pa.array(np.repeat([record[2] for record in records], counts)).dictionary_encode(),
+            **{column: pa.array(rows[:, i]) for i, column in enumerate(columns)},
+            'anomaly_score': pa.array(scores),
+            'is_anomaly': pa.array(scores < np.repeat([record[7] for record in records], counts)),
+            'risk_level': pa.array(np.concatenate([np.asarray(record[6], dtype=str) for record in records]))
+            .dictionary_encode(),
+            'latency_ms': pa.array(np.repeat([record[8] * 1e3 for record in records], counts), pa.float32()),
+            'batch_size': pa.array(np.repeat([record[9] for record in records], counts), pa.int32()),
+        }
+        return pa.table(data)
+
+    def _writer(self, pa, partition: Tuple[str, int], schema):
+        entry = self._writers.get(partition)
+        if entry is not None and not entry[0].schema.equals(schema):
+            # The model was reloaded with other columns: start a new file.
+            self._close(partition)
+            entry = None
+        if entry is None:
+            model, hours = partition
+            start = time.gmtime(hours * 3600)
+            directory = os.path.join(
+                self.root, f"model={model}", f"date={time.strftime('%Y-%m-%d', start)}", f"hour={start.tm_hour:02d}"
+            )
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{int(time.time() * 1e3)}-{os.getpid()}.parquet")
+            writer = pa.parquet.ParquetWriter(path + '.tmp', schema, compression='zstd')
+            entry = self._writers[partition] = (writer, path + '.tmp', path)
+        return entry[0]
+
+    def _close(self, partition: Tuple[str, int]) -> None:
+        writer, tmp_path, path = self._writers.pop(partition)
+        writer.close()
+        os.replace(tmp_path, path)
+        self.files += 1
+
+    def close(self) -> None:
+        """Write what is queued and close every open part file."""
+        self._stop_event.set()
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        with self._lock:
+            for partition in list(self._writers):
+                self._close(partition)
+
+    def status(self) -> dict:
+        return {
+            'root': self.root,
+            'pending_rows': self._queued_rows - self._taken_rows,
+            'written_rows': self.written,
+            'dropped_rows': self.dropped,
+            'open_files': len(self._writers),
+            'closed_files': self.files,
+        }
+
+
+def read_predictions(root: str, model: str, columns: Optional[Sequence[str]] = None, filters=None):
+    """
+    Read one model's logged predictions as a pyarrow Table. `filters` (pyarrow
+    syntax, e.g. [('date', '>=', '2025-01-01'), ('risk_level', '=', 'HIGH')])
+    prune partitions and row groups before anything is read.
+    """
+    pa = _pyarrow()
+    return pa.parquet.read_table(
+        os.path.join(root, f"model={model}"), columns=columns, filters=filters, partitioning='hive'
+    )
+
+
+def from_env() -> Optional[PredictionLog]:
+    root = os.environ.get('SAFARX_PREDICTION_LOG_DIR')
+    if not root:
+        return None
+    try:
+        _pyarrow()
+    except ImportError:
+        print("Warning: SAFARX_PREDICTION_LOG_DIR is set but pyarrow is not installed; predictions are not logged")
+        return None
+    return PredictionLog(
+        root,
+        flush_interval=float(os.environ.get('SAFARX_PREDICTION_LOG_FLUSH', '60')),
+        max_pending_rows=int(os.environ.get('SAFARX_PREDICTION_LOG_MAX_PENDING', '100000')),
+    )
@@ -0,0 +1,296 @@
+"""
+Opt-in sampled profiling for the prediction and safety-score endpoints.
+
+One in every `sample_every` requests that pass through `RequestProfiler.profile`
+is profiled. Two modes are supported:
+
+- 'wall': a background thread periodically captures the stack of the thread
+  serving the request (wall-clock sampling, low overhead, exact stacks).
+- 'cprofile': the request runs under cProfile. Stacks are reconstructed from the
+  caller graph by charging each function's own time to its heaviest caller chain,
+  which is approximate but attributes time to pandas/sklearn/pydantic reliably.
+
+A profiled block must not await: the sampled stack is the thread's, and on
+the event loop thread other requests would run inside it. Only one request is
+profiled at a time in 'cprofile' mode (Python allows one active profiler), and
+one per thread in 'wall' mode; requests selected while that slot is taken are
+not sampled.
+
+Samples are aggregated in memory as collapsed stacks ("frame;frame;frame count"),
+the input format of flamegraph.pl, speedscope and inferno.
+
+With SAFARX_PROFILE_DIR set, configuration changes are written to a control file
+in that directory which every worker re-reads about once a second, so a single
+admin call switches all uvicorn workers. Each worker dumps its stacks to
+`profile-<pid>.collapsed` in the same directory when profiling is switched
+off; without SAFARX_PROFILE_DIR nothing is written, and the stacks are read
+from /admin/profiling/stacks.
+"""
+
+import os
+import sys
+import json
+import time
+import cProfile
+import pstats
+import itertools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+PROFILE_MODES = ('wall', 'cprofile')
+_CONTROL_FILE = 'control.json'
+_CONTROL_CHECK_INTERVAL = 1.0
+_frame_labels: Dict[object, str] = {}
+# cProfile profilers cannot be enabled concurrently (an error from Python 3.12).
+_cprofile_lock = threading.Lock()
+
+
+def _package_relative(filename: str) -> str:
+    filename = filename.replace('\\', '/')
+    marker = filename.rfind('-packages/')
+    if marker >= 0:
+        return filename[marker + len('-packages/'):]
+    return os.path.basename(filename)
+
+
+def _frame_label(code) -> str:
+    label = _frame_labels.get(code)
+    if label is None:
+        label = f"{_package_relative(code.co_filename)}:{code.co_name}"
+        _frame_labels[code] = label
+    return label
+
+
+class _StackSampler(threading.Thread):
+    """Samples the stacks of registered threads until they unregister."""
+
+    def __init__(self, profiler: 'RequestProfiler'):
+        super().__init__(name='request-profiler', daemon=True)
+        self.profiler = profiler
+        self.targets: Dict[int, tuple] = {}
+        self.wakeup = threading.Event()
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            targets = dict(self.targets)
+            if not targets:
+                self.wakeup.clear()
+                continue
+            frames = sys._current_frames()
+            for thread_id, (name, entry_code) in targets.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.profiler._add_stack(name, frame, entry_code)
+            time.sleep(self.profiler.interval)
+
+
+class RequestProfiler:
+    def __init__(self, sample_every: int = 100, interval: float = 0.001, mode: str = 'wall',
+                 enabled: bool = False, profile_dir: Optional[str] = None):
+        self.sample_every = sample_every
+        self.interval = interval
+        self.mode = mode
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.sampled_requests = 0
+        self.skipped_requests = 0
+        self._counter = itertools.count()
+        self._stacks: Counter = Counter()
+        self._lock = threading.Lock()
+        self._sampler: Optional[_StackSampler] = None
+        self._control_mtime = 0.0
+        self._next_control_check = 0.0
+
+    def configure(self, enabled: Optional[bool] = None, sample_every: Optional[int] = None,
+                  interval: Optional[float] = None, mode: Optional[str] = None, broadcast: bool = True) -> dict:
+        """Change the profiling settings; with a profile dir, also tell the other workers."""
+        if mode is not None and mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profiling mode '{mode}', expected one of {PROFILE_MODES}")
+        if sample_every is not None and sample_every < 1:
+            raise ValueError("sample_every must be at least 1")
+        if enabled is not None:
+            self.enabled = enabled
+        if sample_every is not None:
+            self.sample_every = sample_every
+        if interval is not None:
+            self.interval = interval
+        if mode is not None:
+            self.mode = mode
+        if broadcast and self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, _CONTROL_FILE)
+            with open(f"{path}.tmp", 'w') as f:
+                json.dump(self._settings(), f)
+            os.replace(f"{path}.tmp", path)
+            self._control_mtime = os.path.getmtime(path)
+        return self.status()
+
+    def _settings(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'sample_every': self.sample_every,
+            'interval': self.interval,
+            'mode': self.mode,
+        }
+
+    def status(self) -> dict:
+        return {
+            **self._settings(),
+            'sampled_requests': self.sampled_requests,
+            'skipped_requests': self.skipped_requests,
+            'unique_stacks': len(self._stacks),
+        }
+
+    def _check_control_file(self) -> None:
+        now = time.monotonic()
+        if now < self._next_control_check:
+            return
+        self._next_control_check = now + _CONTROL_CHECK_INTERVAL
+        path = os.path.join(self.profile_dir, _CONTROL_FILE)
+        try:
+            mtime = os.path.getmtime(path)
+            if mtime == self._control_mtime:
+                return
+            with open(path) as f:
+                settings = json.load(f)
+            self._control_mtime = mtime
+            was_enabled = self.enabled
+            self.configure(broadcast=False, **settings)
+            if was_enabled and not self.enabled:
+                self.dump()
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Error reading profiling control file: {e}")
+
+    def should_sample(self) -> bool:
+        if self.profile_dir:
+            self._check_control_file()
+        return self.enabled and next(self._counter) % self.sample_every == 0
+
+    @contextmanager
+    def profile(self, name: str):
+        """
+        Profile the enclosed block if this request is selected for sampling.
+        The block must be synchronous (see the module docstring).
+        """
+        if not self.should_sample():
+            yield
+            return
+
+        if self.mode == 'cprofile':
+            if not _cprofile_lock.acquire(blocking=False):
+                self.skipped_requests += 1
+                yield
+                return
+            self.sampled_requests += 1
+            try:
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    yield
+                finally:
+                    profiler.disable()
+                    self._add_cprofile_stats(name, profiler)
+            finally:
+                _cprofile_lock.release()
+            return
+
+        thread_id = threading.get_ident()
+        # Stacks are cut at the frame that entered profile(), dropping the event
+        # loop and framework frames above the endpoint.
+        entry_code = sys._getframe(2).f_code
+        with self._lock:
+            if self._sampler is None:
+                self._sampler = _StackSampler(self)
+                self._sampler.start()
+            registered = thread_id not in self._sampler.targets
+            if registered:
+                self._sampler.targets[thread_id] = (name, entry_code)
+        if not registered:
+            self.skipped_requests += 1
+            yield
+            return
+        self.sampled_requests += 1
+        self._sampler.wakeup.set()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._sampler.targets.pop(thread_id, None)
+
+    def _add_stack(self, name: str, frame, entry_code) -> None:
+        labels = []
+        while frame is not None:
+            labels.append(_frame_label(frame.f_code))
+            if frame.f_code is entry_code:
+                break
+            frame = frame.f_back
+        labels.append(name)
+        labels.reverse()
+        with self._lock:
+            self._stacks[';'.join(labels)] += 1
+
+    def _add_cprofile_stats(self, name: str, profiler: cProfile.Profile) -> None:
+        stats = pstats.Stats(profiler).stats
+        heaviest_caller = {
+            func: max(callers.items(), key=lambda item: item[1][3])[0]
+            for func, (_, _, _, _, callers) in stats.items() if callers
+        }
+
+        def label(func) -> str:
+            filename, _, funcname = func
+            if filename == '~':
+                return funcname
+            return f"{_package_relative(filename)}:{funcname}"
+
+        with self._lock:
+            for func, (_, _, tottime, _, _) in stats.items():
+                # Weight in microseconds so the counts stay integers.
+                weight = int(tottime * 1e6)
+                if weight <= 0 or func[2] == "<method 'disable' of '_lsprof.Profiler' objects>":
+                    continue
+                chain, seen = [], set()
+                current = func
+                while current is not None and current not in seen:
+                    seen.add(current)
+                    chain.append(label(current))
+                    current = heaviest_caller.get(current)
+                chain.append(name)
+                chain.reverse()
+                self._stacks[';'.join(chain)] += weight
+
+    def collapsed(self) -> str:
+        """The aggregated stacks in collapsed (flame graph) format."""
+        with self._lock:
+            items = sorted(self._stacks.items())
+        return ''.join(f"{stack} {count}\n" for stack, count in items)
+
+    def dump(self, path: Optional[str] = None) -> Optional[str]:
+        """
+        Write the collapsed stacks to `path` (default: the worker's file in the
+        profile dir). Returns the path, or None without a path or profile dir.
+        """
+        if path is None:
+            if not self.profile_dir:
+                return None
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"profile-{os.getpid()}.collapsed")
+        with open(path, 'w') as f:
+            f.write(self.collapsed())
+        return path
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stacks.clear()
+        self.sampled_requests = 0
+        self.skipped_requests = 0
+
+
+profiler = RequestProfiler(
+    sample_every=int(os.environ.get('SAFARX_PROFILE_SAMPLE_EVERY', '100')),
+    mode=os.environ.get('SAFARX_PROFILE_MODE', 'wall'),
+    enabled=os.environ.get('SAFARX_PROFILE', '0') == '1',
+    profile_dir=os.environ.get('SAFARX_PROFILE_DIR') or None,
+)
@@ -0,0 +1,102 @@
+"""
+Bounded LRU cache of anomaly scores, keyed on the quantized raw feature vector.
+
+Stationary devices send near-identical payloads window after window, and after
+one-hot encoding most features are small integers, so many requests map to a
+feature vector that was already scored. Each feature is rounded to its
+configured step before it becomes part of the key (a step of 0 keeps the exact
+value), so a hit skips scaling and tree traversal and returns the score of the
+first payload seen in that cell.
+
+Configured per handler (see BaseModelHandler.cache_precision) and through
+
+    SAFARX_RESULT_CACHE_SIZE       entries per model, 0 disables (default 0: off)
+    SAFARX_RESULT_CACHE_PRECISION  overrides, e.g. "displacement_m=1,gps_accuracy_1=0.5"
+
+The cache is opt-in: a hit answers with the score of another payload in the
+same cell, which can differ from the payload's own score near a threshold.
+A handler builds a new, empty cache whenever it (re)loads its model.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+import metrics
+
+DEFAULT_MAX_ENTRIES = 0
+
+
+def precision_from_env(value: Optional[str] = None) -> Dict[str, float]:
+    """Parse "column=step,column=step" (SAFARX_RESULT_CACHE_PRECISION by default)."""
+    if value is None:
+        value = os.environ.get('SAFARX_RESULT_CACHE_PRECISION', '')
+    precision = {}
+    for item in value.split(','):
+        if item.strip():
+            column, step = item.split('=')
+            precision[column.strip()] = float(step)
+    return precision
+
+
+def max_entries_from_env() -> int:
+    return int(os.environ.get('SAFARX_RESULT_CACHE_SIZE', str(DEFAULT_MAX_ENTRIES)))
+
+
+class ResultCache:
+    def __init__(self, name: str, columns: Sequence[str], max_entries: int = DEFAULT_MAX_ENTRIES,
+                 precision: Optional[Dict[str, float]] = None):
+        precision = precision or {}
+        unknown = set(precision) - set(columns)
+        if unknown:
+            raise ValueError(f"Unknown {name} feature(s) in cache precision: {sorted(unknown)}")
+        self.name = name
+        self.max_entries = max_entries
+        self.precision = {column: precision.get(column, 0.0) for column in columns}
+        steps = np.array([self.precision[column] for column in columns], dtype=np.float64)
+        self._quantized = np.flatnonzero(steps > 0)
+        self._steps = steps[self._quantized]
+        self._entries: 'OrderedDict[bytes, float]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def keys(self, rows: np.ndarray) -> List[bytes]:
+        """One key per row of raw (unscaled) features."""
+        rows = np.array(rows, dtype=np.float64, ndmin=2)
+        if len(self._quantized):
+            rows[:, self._quantized] = np.round(rows[:, self._quantized] / self._steps)
+        # Adding 0.0 turns -0.0 into 0.0 so both produce the same bytes.
+        rows += 0.0
+        return [row.tobytes() for row in rows]
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[float]]:
+        entries = self._entries
+        with self._lock:
+            scores = [entries.get(key) for key in keys]
+            for key, score in zip(keys, scores):
+                if score is not None:
+                    entries.move_to_end(key)
+        hits = sum(score is not None for score in scores)
+        if hits:
+            metrics.RESULT_CACHE_LOOKUPS.inc(self.name, 'hit', amount=hits)
+        if hits < len(keys):
+            metrics.RESULT_CACHE_LOOKUPS.inc(self.name, 'miss', amount=len(keys) - hits)
+        return scores
+
+    def put_many(self, keys: List[bytes], scores: Sequence[float]) -> None:
+        entries = self._entries
+        with self._lock:
+            for key, score in zip(keys, scores):
+                entries[key] = float(score)
+                entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
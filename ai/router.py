@@ -0,0 +1,393 @@
+"""
+Consistent-hash routing of devices onto a pool of inference worker processes.
+
+uvicorn hands each connection to whichever worker accepts it first, so a
+device's requests are spread over all workers and any per-device state (the
+result caches, and anything else a handler keeps) is rebuilt in every one of
+them. With SAFARX_WORKERS=N the serving process instead starts N worker
+processes that load the model handlers, and requests that carry a `device_id`
+are sent to the worker the device hashes to on a consistent-hash ring.
+
+Each worker owns DEFAULT_VNODES points on the ring, so adding or removing a
+worker only moves about 1/N of the devices; the others keep their worker.
+A removed worker is taken off the ring first and then finishes the requests
+already sent to it. A worker that dies fails its in-flight requests and is
+restarted under the same name, so its devices come back to it.
+
+Requests are queued per worker and a sender thread pickles whatever has queued
+up as one message, so the dispatch cost per request falls as load rises.
+Workers record metrics in their own process; set SAFARX_METRICS_DIR to have
+them included in the serving process's /metrics. Drift monitoring and online
+learning stay in the serving process: a worker sends each request's feature
+row and score back with its result, and the pool passes them to `observe`.
+Models swapped in the serving process (online refreshes) are sent to every
+worker with `swap_model`, and again to workers started or restarted later, so
+routed requests are scored by the same forest as local ones.
+Shadow comparison and canary requests are handled by the serving process too
+(see main.py), since candidates are only loaded there.
+
+    SAFARX_WORKERS       inference worker processes (default 0: score in the serving process)
+    SAFARX_WORKERS_MAX   most worker processes, including ones still draining
+                         after removal (default: the CPU count, at least SAFARX_WORKERS)
+"""
+
+import os
+import queue
+import asyncio
+import bisect
+import hashlib
+import itertools
+import threading
+import multiprocessing
+import concurrent.futures
+from multiprocessing.connection import wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+DEFAULT_VNODES = 160
+# Requests pickled into one message to a worker, at most.
+MAX_BATCH = 256
+
+
+class WorkerError(RuntimeError):
+    """A worker failed a request, or exited before answering it."""
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    Consistent-hash ring. Updates build new arrays and swap them in with one
+    assignment, so lookups from other threads need no lock.
+    """
+
+    def __init__(self, nodes=(), vnodes: int = DEFAULT_VNODES):
+        self.vnodes = vnodes
+        self._ring: Tuple[List[int], List[str]] = ([], [])
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self) -> List[str]:
+        return sorted(set(self._ring[1]))
+
+    def add(self, node: str) -> None:
+        points, owners = self._ring
+        if node in owners:
+            return
+        entries = list(zip(points, owners)) + [(_hash(f"{node}#{i}"), node) for i in range(self.vnodes)]
+        entries.sort()
+        self._ring = ([point for point, _ in entries], [owner for _, owner in entries])
+
+    def remove(self, node: str) -> None:
+        points, owners = self._ring
+        keep = [i for i, owner in enumerate(owners) if owner != node]
+        self._ring = ([points[i] for i in keep], [owners[i] for i in keep])
+
+    def node_for(self, key: str) -> str:
+        points, owners = self._ring
+        if not points:
+            raise LookupError("The hash ring has no nodes")
+        return owners[bisect.bisect(points, _hash(key)) % len(points)]
+
+
+class _Observations:
+    """
+    Attached to a worker's handlers in place of the drift monitor: keeps the
+    feature rows and scores of the request being answered, which are sent
+    back for the serving process's own monitors.
+    """
+
+    def __init__(self):
+        self.last = None
+
+    def observe(self, rows, scores) -> None:
+        self.last = (rows, scores)
+
+
+def _serve(conn, name: str) -> None:
+    """Worker process: load the handlers, then answer batches of requests until told to stop."""
+    import model_pool
+    import prediction_log
+    from model_artifact import CompiledForest
+    from model_handler import model_handler, inactivity_model_handler
+
+    handlers = {'dropoff': model_handler, 'inactivity': inactivity_model_handler}
+    log = prediction_log.from_env()
+    observations = _Observations()
+    model_pool.load_regions()
+    for handler in handlers.values():
+        handler.load_model_and_scaler()
+        handler.prediction_log = log
+        handler.drift = observations
+        handler.regions = model_pool.from_env(handler)
+    metrics.REGISTRY.start_flusher()
+
+    while True:
+        try:
+            batch = conn.recv()
+        except EOFError:
+            batch = None
+        if batch is None:
+            if log is not None:
+                log.close()
+            return
+        results = []
+        for request_id, model, payload_data in batch:
+            if request_id is None:
+                # A model swapped in the serving process: (metadata, arrays, model_version).
+                metadata, arrays, model_version = payload_data
+                handler = handlers[model]
+                handler.model = CompiledForest.from_arrays(metadata, arrays)
+                handler.model_version = model_version
+                handler.configure_cache()
+                continue
+            observations.last = None
+            try:
+                handler = handlers[model]
+                result = handler.predict(payload_data)
+                results.append((request_id, True, (result, observations.last, handler.model_version)))
+            except Exception as e:
+                results.append((request_id, False, f"{name}: {type(e).__name__}: {e}"))
+        conn.send(results)
+
+
+class _Worker:
+    def __init__(self, name: str, context):
+        self.name = name
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child_conn, name), name=f'safarx-{name}', daemon=True)
+        self.process.start()
+        child_conn.close()
+        # request id -> (model, future)
+        self.pending: Dict[int, Tuple[str, concurrent.futures.Future]] = {}
+        self.served = 0
+        # model -> model_version of the worker's latest answer
+        self.model_versions: Dict[str, str] = {}
+        self.closing = False
+        self._outbox: 'queue.SimpleQueue[Optional[tuple]]' = queue.SimpleQueue()
+        self._sender = threading.Thread(target=self._send_loop, name=f'router-{name}', daemon=True)
+        self._sender.start()
+
+    def submit(self, request_id: int, model: str, payload_data: dict, future: concurrent.futures.Future) -> None:
+        self.pending[request_id] = model, future
+        self._outbox.put((request_id, model, payload_data))
+
+    def send_model(self, message: tuple) -> None:
+        self._outbox.put(message)
+
+    def close(self) -> None:
+        self.closing = True
+        self._outbox.put(None)
+
+    def _send_loop(self):
+        while True:
+            batch = [self._outbox.get()]
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self._outbox.get_nowait())
+                except queue.Empty:
+                    break
+            requests = [request for request in batch if request is not None]
+            try:
+                if requests:
+                    self.conn.send(requests)
+                if len(requests) < len(batch):
+                    self.conn.send(None)
+                    return
+            except (OSError, ValueError):
+                # The process is gone; the receiver fails the pending requests.
+                return
+
+    def status(self) -> dict:
+        return {
+            'pid': self.process.pid,
+            'alive': self.process.is_alive(),
+            'pending': len(self.pending),
+            'served': self.served,
+            'model_versions': dict(self.model_versions),
+            'closing': self.closing,
+        }
+
+
+class WorkerPool:
+    def __init__(self, n_workers: int, vnodes: int = DEFAULT_VNODES,
+                 observe: Optional[Callable[[str, object, object], None]] = None,
+                 max_workers: Optional[int] = None):
+        """
+        Args:
+            n_workers: Worker processes to start
+            max_workers: Most worker processes alive at once (None: no limit);
+                add_worker raises ValueError beyond it
+            vnodes: Ring points per worker; more points spread devices more evenly
+            observe: Called as observe(model, rows, scores) with the feature rows
+                and scores of every request a worker answered, on the receiver thread
+        """
+        self.observe = observe
+        self.max_workers = max_workers
+        # spawn: forking a process that runs the event loop and threadpool is unsafe.
+        self._context = multiprocessing.get_context('spawn')
+        self.ring = HashRing(vnodes=vnodes)
+        self.restarts = 0
+        self._workers: Dict[str, _Worker] = {}
+        self._names = itertools.count()
+        self._request_ids = itertools.count()
+        # model -> the latest swap_model message, replayed to new workers
+        self._models: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        # Serializes add_worker, so concurrent calls cannot overshoot max_workers.
+        self._add_lock = threading.Lock()
+        self._closed = False
+        self._wake_recv, self._wake_send = self._context.Pipe(duplex=False)
+        for _ in range(n_workers):
+            self.add_worker()
+        self._receiver = threading.Thread(target=self._receive_loop, name='router-receiver', daemon=True)
+        self._receiver.start()
+
+    def add_worker(self) -> str:
+        """Start a worker and put it on the ring; about 1/N of the devices move to it."""
+        with self._add_lock:
+            if self.max_workers is not None and len(self._workers) >= self.max_workers:
+                raise ValueError(f"Worker limit of {self.max_workers} reached")
+            name = f"worker-{next(self._names)}"
+            worker = _Worker(name, self._context)
+            with self._lock:
+                self._start_models(worker)
+                self._workers[name] = worker
+                self.ring.add(name)
+        self._wake()
+        return name
+
+    def _start_models(self, worker: _Worker) -> None:
+        # Queued ahead of any request, so the worker never answers with its files' model.
+        for message in self._models.values():
+            worker.send_model(message)
+
+    def swap_model(self, model: str, forest, model_version: str) -> None:
+        """Have every worker score `model` with `forest` (a CompiledForest) from now on."""
+        message = (None, model, (forest.metadata(), forest.arrays(), model_version))
+        with self._lock:
+            self._models[model] = message
+            for worker in self._workers.values():
+                if not worker.closing:
+                    worker.send_model(message)
+
+    def remove_worker(self, name: str) -> None:
+        """Take a worker off the ring; it exits once it has answered the requests already sent to it."""
+        with self._lock:
+            worker = self._workers.get(name)
+            if worker is None or worker.closing:
+                raise KeyError(name)
+            if len(self.ring.nodes) == 1:
+                raise ValueError("Cannot remove the last worker")
+            self.ring.remove(name)
+            worker.close()
+
+    def submit(self, device_id: str, model: str, payload_data: dict) -> concurrent.futures.Future:
+        """Send a prediction to the device's worker; the future resolves to the handler's result."""
+        future = concurrent.futures.Future()
+        with self._lock:
+            worker = self._workers[self.ring.node_for(device_id)]
+            worker.submit(next(self._request_ids), model, payload_data, future)
+        return future
+
+    async def predict(self, device_id: str, model: str, payload_data: dict) -> dict:
+        return await asyncio.wrap_future(self.submit(device_id, model, payload_data))
+
+    def _wake(self) -> None:
+        self._wake_send.send_bytes(b'')
+
+    def _receive_loop(self):
+        while not self._closed:
+            with self._lock:
+                by_handle = {}
+                for worker in self._workers.values():
+                    by_handle[worker.conn] = worker
+                    by_handle[worker.process.sentinel] = worker
+            for ready in wait([self._wake_recv, *by_handle]):
+                if ready is self._wake_recv:
+                    self._wake_recv.recv_bytes()
+                    continue
+                worker = by_handle[ready]
+                if ready is worker.conn:
+                    try:
+                        self._resolve(worker, worker.conn.recv())
+                        continue
+                    except (EOFError, OSError):
+                        pass
+                self._exited(worker)
+
+    def _resolve(self, worker: _Worker, results: list) -> None:
+        for request_id, ok, value in results:
+            model, future = worker.pending.pop(request_id, (None, None))
+            if future is None:
+                continue
+            worker.served += 1
+            if ok:
+                result, observed, model_version = value
+                worker.model_versions[model] = model_version
+                if observed is not None and self.observe is not None:
+                    try:
+                        self.observe(model, *observed)
+                    except Exception as e:
+                        print(f"Error observing a {worker.name} prediction: {e}")
+                future.set_result(result)
+            else:
+                future.set_exception(WorkerError(value))
+
+    def _exited(self, worker: _Worker) -> None:
+        # Answers already in the pipe are read before the worker is dropped.
+        try:
+            while worker.conn.poll():
+                self._resolve(worker, worker.conn.recv())
+        except (EOFError, OSError):
+            pass
+        with self._lock:
+            if self._workers.get(worker.name) is not worker:
+                return
+            pending, worker.pending = worker.pending, {}
+            if worker.closing:
+                del self._workers[worker.name]
+            else:
+                print(f"Warning: inference {worker.name} exited with code {worker.process.exitcode}, restarting it")
+                self.restarts += 1
+                restarted = self._workers[worker.name] = _Worker(worker.name, self._context)
+                self._start_models(restarted)
+        worker.conn.close()
+        metrics.REGISTRY.remove_snapshot(worker.process.pid)
+        for _, future in pending.values():
+            future.set_exception(WorkerError(f"{worker.name} exited before answering"))
+
+    def status(self) -> dict:
+        with self._lock:
+            workers = {name: worker.status() for name, worker in self._workers.items()}
+        return {
+            'ring_workers': self.ring.nodes,
+            'vnodes': self.ring.vnodes,
+            'max_workers': self.max_workers,
+            'restarts': self.restarts,
+            'workers': workers,
+        }
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Stop all workers after they have answered what was sent to them."""
+        with self._lock:
+            workers = list(self._workers.values())
+            for worker in workers:
+                if not worker.closing:
+                    self.ring.remove(worker.name)
+                    worker.close()
+        for worker in workers:
+            worker.process.join(timeout)
+        self._closed = True
+        self._wake()
+        self._receiver.join(timeout)
+
+
+def from_env(observe: Optional[Callable[[str, object, object], None]] = None) -> Optional[WorkerPool]:
+    n_workers = int(os.environ.get('SAFARX_WORKERS', '0'))
+    max_workers = int(os.environ.get('SAFARX_WORKERS_MAX', '0')) or max(n_workers, os.cpu_count() or 1)
+    return WorkerPool(n_workers, observe=observe, max_workers=max_workers) if n_workers > 0 else None
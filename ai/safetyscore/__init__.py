@@ -0,0 +1,3 @@
+from .safetyscore import GeofenceIndex, LocationSafetyCalculator
+from .prewarm import LookupCache
+from .disk_cache import DiskCache
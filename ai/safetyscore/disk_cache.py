@@ -0,0 +1,111 @@
+"""
+Persistent SQLite store behind LookupCache, so Overpass and weather results
+survive restarts and are shared by all worker processes on a host.
+
+The database runs in WAL mode, so readers in any process never block on the
+single writer, and every thread opens its own connection. Writes are best
+effort: a write that cannot get the lock within `busy_timeout` is dropped,
+since the value is only a cache. Rows carry their expiry time; expired rows are
+ignored on read and, with the least recently written rows once the table grows
+past `max_entries`, deleted by a periodic sweep.
+"""
+
+import json
+import time
+import sqlite3
+import threading
+from typing import Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lookups (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    written_at REAL NOT NULL
+)
+"""
+
+
+def _encode_key(key: tuple) -> str:
+    source, variant, (row, col) = key
+    return f"{source}|{variant}|{row}|{col}"
+
+
+class DiskCache:
+    def __init__(self, path: str, max_entries: int = 1_000_000, busy_timeout: float = 5.0,
+                 sweep_every: int = 1000):
+        """
+        Args:
+            path: SQLite database file, created if missing
+            max_entries: Rows kept after a sweep
+            busy_timeout: Seconds to wait for another process's write lock
+            sweep_every: Writes between sweeps of expired and excess rows
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.busy_timeout = busy_timeout
+        self.sweep_every = sweep_every
+        self._local = threading.local()
+        self._writes = 0
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(_SCHEMA)
+        connection.execute("CREATE INDEX IF NOT EXISTS lookups_written_at ON lookups (written_at)")
+        connection.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            # WAL only needs a sync at checkpoints to stay consistent after a crash.
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: tuple) -> Optional[Tuple[object, float]]:
+        """(value, expires_at) of an unexpired row, or None."""
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM lookups WHERE key = ? AND expires_at > ?",
+                (_encode_key(key), time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Warning: lookup cache read failed: {e}")
+            return None
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, key: tuple, value, expires_at: float) -> None:
+        connection = self._connection()
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO lookups (key, value, expires_at, written_at) VALUES (?, ?, ?, ?)",
+                    (_encode_key(key), json.dumps(value), expires_at, time.time())
+                )
+        except sqlite3.Error as e:
+            print(f"Warning: lookup cache write failed: {e}")
+            return
+        self._writes += 1
+        if self._writes % self.sweep_every == 0:
+            self.sweep()
+
+    def sweep(self) -> int:
+        """Delete expired rows, then the oldest writes beyond `max_entries`; returns rows deleted."""
+        connection = self._connection()
+        try:
+            with connection:
+                deleted = connection.execute("DELETE FROM lookups WHERE expires_at <= ?", (time.time(),)).rowcount
+                deleted += connection.execute(
+                    "DELETE FROM lookups WHERE key IN ("
+                    "SELECT key FROM lookups ORDER BY written_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                ).rowcount
+            return deleted
+        except sqlite3.Error as e:
+            print(f"Warning: lookup cache sweep failed: {e}")
+            return 0
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM lookups").fetchone()[0]
@@ -0,0 +1,231 @@
+"""
+Shared HTTP client for the Overpass and met.no lookups.
+
+All requests run on one background event loop that owns a pooled
+`httpx.AsyncClient`, so connections (and TLS sessions) are kept alive across
+calls and threads. On top of the pool the client adds
+
+- a concurrency limit per host,
+- retries with full-jitter exponential backoff on transport errors, 429 and 5xx,
+- a circuit breaker per host that fails fast after repeated failures and lets a
+  single trial request through once the cool-down has passed,
+- coalescing of identical in-flight requests, which then share one response.
+
+Async callers on other event loops await `request`; synchronous callers use
+`request_sync` or `run`, which block on the background loop, or `submit` to
+overlap the requests with their own work.
+"""
+
+import time
+import random
+import asyncio
+import threading
+import concurrent.futures
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without contacting the host while its circuit breaker is open."""
+
+
+class _Circuit:
+    def __init__(self):
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+
+class AsyncHTTPClient:
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, max_connections: int = 20, host_limits: Optional[Dict[str, int]] = None,
+                 default_host_limit: int = 4, retries: int = 2, backoff_base: float = 0.2,
+                 backoff_cap: float = 2.0, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 user_agent: str = "LocationSafetyCalculator/1.0"):
+        """
+        Args:
+            max_connections: Size of the connection pool across all hosts
+            host_limits: Maximum concurrent requests per host name
+            default_host_limit: Limit for hosts not in `host_limits`
+            retries: Extra attempts after a retryable failure
+            backoff_base: First backoff ceiling in seconds, doubled per attempt
+            backoff_cap: Largest backoff ceiling in seconds
+            failure_threshold: Consecutive failed requests that open a host's circuit
+            reset_timeout: Seconds an open circuit waits before a trial request
+            user_agent: User-Agent header sent with every request
+        """
+        self.max_connections = max_connections
+        self.host_limits = dict(host_limits or {})
+        self.default_host_limit = default_host_limit
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.user_agent = user_agent
+        self.coalesced = 0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client = None
+        self._start_lock = threading.Lock()
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._circuits: Dict[str, _Circuit] = {}
+        self._in_flight: Dict[tuple, asyncio.Future] = {}
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                # httpx is only imported once a request is actually made.
+                import httpx
+
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='safetyscore-http', daemon=True).start()
+                limits = httpx.Limits(max_connections=self.max_connections,
+                                      max_keepalive_connections=self.max_connections)
+
+                async def create_client():
+                    return httpx.AsyncClient(limits=limits, headers={'User-Agent': self.user_agent})
+
+                self._client = asyncio.run_coroutine_threadsafe(create_client(), loop).result()
+                self._loop = loop
+        return self._loop
+
+    async def request(self, method: str, url: str, *, params: Optional[dict] = None,
+                      data: Optional[dict] = None, headers: Optional[dict] = None, timeout: float = 30.0):
+        """Send a request through the shared pool and return the httpx.Response."""
+        loop = self._ensure_started()
+        coroutine = self._coalesced_request(method, url, params, data, headers, timeout)
+        if asyncio.get_running_loop() is loop:
+            return await coroutine
+        return await asyncio.wrap_future(self.submit(coroutine))
+
+    def request_sync(self, method: str, url: str, **kwargs):
+        """Blocking form of `request` for synchronous callers."""
+        return self.run(self.request(method, url, **kwargs))
+
+    def submit(self, coroutine) -> concurrent.futures.Future:
+        """Schedule a coroutine that uses this client on the background loop without waiting."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_started())
+
+    def run(self, coroutine):
+        """Run a coroutine that uses this client on the background loop and wait for its result."""
+        return self.submit(coroutine).result()
+
+    async def _coalesced_request(self, method, url, params, data, headers, timeout):
+        key = (
+            method.upper(), url,
+            tuple(sorted((params or {}).items())),
+            tuple(sorted((data or {}).items())),
+            tuple(sorted((headers or {}).items())),
+        )
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # The shared request runs as its own task, so a caller that is
+            # cancelled stops waiting without cancelling the others' request.
+            task = asyncio.ensure_future(self._request_with_retries(method, url, params, data, headers, timeout))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._request_done(key, done))
+        return await asyncio.shield(task)
+
+    def _request_done(self, key: tuple, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Mark the exception retrieved for the case where every caller stopped waiting.
+            task.exception()
+
+    async def _request_with_retries(self, method, url, params, data, headers, timeout):
+        import httpx
+
+        parts = urlsplit(url)
+        host = parts.netloc
+        circuit = self._circuits.setdefault(host, _Circuit())
+        trial = self._check_circuit(host, circuit)
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            limit = self.host_limits.get(parts.hostname, self.default_host_limit)
+            semaphore = asyncio.Semaphore(limit)
+            self._semaphores[host] = semaphore
+
+        attempt = 0
+        try:
+            while True:
+                retry_after = None
+                try:
+                    async with semaphore:
+                        response = await self._client.request(
+                            method, url, params=params, data=data, headers=headers, timeout=timeout
+                        )
+                    if response.status_code not in self.RETRY_STATUSES:
+                        self._record_success(circuit)
+                        return response
+                    error: Exception = httpx.HTTPStatusError(
+                        f"{response.status_code} from {host}", request=response.request, response=response
+                    )
+                    retry_after = response.headers.get('Retry-After')
+                except httpx.TransportError as e:
+                    error = e
+                except Exception:
+                    self._record_failure(circuit)
+                    raise
+
+                if attempt >= self.retries:
+                    self._record_failure(circuit)
+                    if isinstance(error, httpx.HTTPStatusError):
+                        # Let the caller see the final response, as with a non-retried request.
+                        return error.response
+                    raise error
+                attempt += 1
+                ceiling = min(self.backoff_cap, self.backoff_base * 2 ** attempt)
+                delay = random.uniform(0, ceiling)
+                if retry_after is not None and retry_after.isdigit():
+                    delay = min(float(retry_after), self.backoff_cap)
+                await asyncio.sleep(delay)
+        except BaseException:
+            if trial:
+                # Cancelled before the trial recorded an outcome; the next request may try again.
+                circuit.trial_in_flight = False
+            raise
+
+    def _check_circuit(self, host: str, circuit: _Circuit) -> bool:
+        """Raise CircuitOpenError while the host's circuit is open; True if this request is the half-open trial."""
+        if circuit.opened_at is None:
+            return False
+        if time.monotonic() - circuit.opened_at < self.reset_timeout or circuit.trial_in_flight:
+            raise CircuitOpenError(f"Circuit open for {host} after {circuit.failures} failures")
+        circuit.trial_in_flight = True
+        return True
+
+    def _record_success(self, circuit: _Circuit) -> None:
+        circuit.failures = 0
+        circuit.opened_at = None
+        circuit.trial_in_flight = False
+
+    def _record_failure(self, circuit: _Circuit) -> None:
+        circuit.failures += 1
+        if circuit.trial_in_flight or circuit.failures >= self.failure_threshold:
+            circuit.opened_at = time.monotonic()
+        circuit.trial_in_flight = False
+
+    def circuit_status(self) -> Dict[str, dict]:
+        return {
+            host: {'failures': circuit.failures, 'open': circuit.opened_at is not None}
+            for host, circuit in self._circuits.items()
+        }
+
+
+_shared_client: Optional[AsyncHTTPClient] = None
+_shared_lock = threading.Lock()
+
+
+def shared_client() -> AsyncHTTPClient:
+    """The process-wide client used by LocationSafetyCalculator unless one is passed in."""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            # Overpass allows few parallel queries per client before answering 429.
+            _shared_client = AsyncHTTPClient(host_limits={'overpass-api.de': 2})
+        return _shared_client
@@ -0,0 +1,312 @@
+"""
+Caching and pre-warming of the external lookups behind the safety score.
+
+- `LookupCache` keeps Overpass results (per amenity tag set) and weather hazard
+  scores per spatial cell, each with a source-specific TTL. Lookups for any
+  point in a cell are answered from the data fetched for the cell centre.
+  An optional persistent store (see disk_cache.py) backs the in-memory
+  entries across restarts and worker processes.
+- `HotspotTracker` counts queries per cell with exponential decay, so the
+  cells tourists currently query most rank first.
+- `Prewarmer` is a background thread that re-fetches the hotspots' entries
+  before they expire, within per-source rate limits, so request-path lookups
+  in busy areas are cache hits. The limits are per Prewarmer, so per process:
+  N pre-warming worker processes together send up to N times the rate.
+"""
+
+import math
+import time
+import asyncio
+import threading
+import concurrent.futures
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Source name -> (cell size in degrees, TTL in seconds). Amenities rarely move;
+# met.no updates its forecasts about hourly.
+DEFAULT_SOURCES = {
+    'amenity': (0.01, 24 * 3600.0),
+    'weather': (0.05, 1800.0),
+}
+
+
+def cell_of(lat: float, lon: float, cell_deg: float) -> Tuple[int, int]:
+    return math.floor(lat / cell_deg), math.floor(lon / cell_deg)
+
+
+def cell_center(cell: Tuple[int, int], cell_deg: float) -> Tuple[float, float]:
+    return round((cell[0] + 0.5) * cell_deg, 6), round((cell[1] + 0.5) * cell_deg, 6)
+
+
+def tag_key(tags: Dict[str, str], radius: int) -> str:
+    return ';'.join(f"{k}={v}" for k, v in sorted(tags.items())) + f"@{radius}"
+
+
+class LookupCache:
+    """
+    In-memory TTL cache keyed by (source, variant, cell).
+
+    `variant` distinguishes entries of one source in the same cell, e.g. the
+    amenity tag set and search radius. With a `store`, memory misses fall
+    through to it and every put is written through. The `_async` methods are
+    for the event loop: the store (SQLite, which can wait on its busy timeout)
+    is read on a worker thread and written to by a background writer thread.
+    """
+
+    def __init__(self, sources: Optional[Dict[str, Tuple[float, float]]] = None, max_entries: int = 100_000,
+                 store=None):
+        self.sources = dict(DEFAULT_SOURCES if sources is None else sources)
+        self.max_entries = max_entries
+        self.store = store
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self._entries: Dict[tuple, Tuple[object, float]] = {}
+        self._lock = threading.Lock()
+        self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='lookup-store')
+
+    def key(self, source: str, variant: str, lat: float, lon: float) -> tuple:
+        return source, variant, cell_of(lat, lon, self.sources[source][0])
+
+    def center(self, key: tuple) -> Tuple[float, float]:
+        source, _, cell = key
+        return cell_center(cell, self.sources[source][0])
+
+    def _memory_entry(self, key: tuple) -> Optional[Tuple[object, float]]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.time():
+            return entry
+        return None
+
+    def _store_entry(self, key: tuple) -> Optional[Tuple[object, float]]:
+        if self.store is None:
+            return None
+        entry = self.store.get(key)
+        if entry is not None:
+            self.store_hits += 1
+            self._remember(key, entry)
+        return entry
+
+    def _entry(self, key: tuple) -> Optional[Tuple[object, float]]:
+        return self._memory_entry(key) or self._store_entry(key)
+
+    def _count(self, entry: Optional[Tuple[object, float]]):
+        if entry is not None:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        return None
+
+    def get(self, key: tuple):
+        """The cached value, or None when missing or expired."""
+        return self._count(self._entry(key))
+
+    async def get_async(self, key: tuple):
+        """`get` without blocking the event loop on the store."""
+        entry = self._memory_entry(key)
+        if entry is None and self.store is not None:
+            entry = await asyncio.to_thread(self._store_entry, key)
+        return self._count(entry)
+
+    def expires_at(self, key: tuple) -> float:
+        entry = self._entry(key)
+        return entry[1] if entry is not None else 0.0
+
+    def put(self, key: tuple, value) -> None:
+        expires_at = time.time() + self.sources[key[0]][1]
+        self._remember(key, (value, expires_at))
+        if self.store is not None:
+            self.store.put(key, value, expires_at)
+
+    def put_async(self, key: tuple, value) -> None:
+        """`put` for the event loop: the memory tier now, the store in the background."""
+        expires_at = time.time() + self.sources[key[0]][1]
+        self._remember(key, (value, expires_at))
+        if self.store is not None:
+            self._writer.submit(self.store.put, key, value, expires_at)
+
+    def _remember(self, key: tuple, entry: Tuple[object, float]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            if len(self._entries) > self.max_entries:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Drop expired entries first, then the ones closest to expiry.
+        now = time.time()
+        by_expiry = sorted(self._entries.items(), key=lambda item: item[1][1])
+        excess = len(self._entries) - self.max_entries
+        for key, (_, expires_at) in by_expiry:
+            if expires_at > now and excess <= 0:
+                break
+            del self._entries[key]
+            excess -= 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'store_hits': self.store_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class HotspotTracker:
+    """Query counts per cell, decayed with a half-life so old hotspots fade."""
+
+    def __init__(self, cell_deg: float = DEFAULT_SOURCES['amenity'][0], half_life: float = 3600.0,
+                 max_cells: int = 10_000):
+        self.cell_deg = cell_deg
+        self.half_life = half_life
+        self.max_cells = max_cells
+        self._scores: Dict[Tuple[int, int], Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def _decayed(self, score: float, updated: float, now: float) -> float:
+        return score * 0.5 ** ((now - updated) / self.half_life)
+
+    def record(self, lat: float, lon: float) -> None:
+        cell = cell_of(lat, lon, self.cell_deg)
+        now = time.time()
+        with self._lock:
+            score, updated = self._scores.get(cell, (0.0, now))
+            self._scores[cell] = (self._decayed(score, updated, now) + 1.0, now)
+            if len(self._scores) > self.max_cells:
+                self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        ranked = sorted(self._scores.items(), key=lambda item: self._decayed(*item[1], now))
+        for cell, _ in ranked[:len(self._scores) - self.max_cells // 2]:
+            del self._scores[cell]
+
+    def top(self, n: int) -> List[Tuple[float, float, float]]:
+        """The `n` hottest cells as (lat, lon, score), centre coordinates first."""
+        now = time.time()
+        with self._lock:
+            scored = [(self._decayed(score, updated, now), cell) for cell, (score, updated) in self._scores.items()]
+        scored.sort(reverse=True)
+        return [(*cell_center(cell, self.cell_deg), score) for score, cell in scored[:n]]
+
+
+class RateLimiter:
+    """Token bucket: `rate` requests per second with bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def acquire(self, stop: Optional[threading.Event] = None) -> bool:
+        """Wait for a token; returns False if `stop` is set while waiting."""
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            delay = (1 - self._tokens) / self.rate
+            if stop is not None:
+                if stop.wait(delay):
+                    return False
+            else:
+                time.sleep(delay)
+
+
+class Prewarmer(threading.Thread):
+    """
+    Refreshes the cache entries of the hottest cells ahead of expiry.
+
+    `refreshers` maps a source name to (rate limiter, list of refresh jobs),
+    where each job is `(variant, fetch(lat, lon))`: the fetch runs for the
+    entry's cell centre and its result is stored under the entry's key.
+    """
+
+    def __init__(self, cache: LookupCache, tracker: HotspotTracker,
+                 refreshers: Dict[str, Tuple[RateLimiter, List[Tuple[str, Callable[[float, float], object]]]]],
+                 top_n: int = 300, interval: float = 30.0, refresh_ahead: float = 0.2):
+        """
+        Args:
+            cache: Cache to keep warm
+            tracker: Source of the hotspot cells
+            refreshers: Per source, its rate limiter and refresh jobs
+            top_n: Number of hotspot cells kept warm
+            interval: Seconds between scans of the hotspots
+            refresh_ahead: Refresh entries within this fraction of their TTL of expiring
+        """
+        super().__init__(name='safetyscore-prewarm', daemon=True)
+        self.cache = cache
+        self.tracker = tracker
+        self.refreshers = refreshers
+        self.top_n = top_n
+        self.interval = interval
+        self.refresh_ahead = refresh_ahead
+        self.refreshed = 0
+        self.failed = 0
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh_once()
+            except Exception as e:
+                print(f"Error pre-warming safety score data: {e}")
+            self._stop_event.wait(self.interval)
+
+    def due(self) -> List[Tuple[str, str, tuple, Callable]]:
+        """Entries of the current hotspots that are missing or about to expire, hottest first."""
+        now = time.time()
+        due = []
+        seen = set()
+        for lat, lon, _ in self.tracker.top(self.top_n):
+            for source, (_, jobs) in self.refreshers.items():
+                ttl = self.cache.sources[source][1]
+                for variant, fetch in jobs:
+                    # Coarser sources share one entry between neighbouring hotspots.
+                    key = self.cache.key(source, variant, lat, lon)
+                    if key not in seen and self.cache.expires_at(key) - now < ttl * self.refresh_ahead:
+                        seen.add(key)
+                        due.append((source, variant, key, fetch))
+        return due
+
+    def refresh_once(self) -> int:
+        """Refresh everything currently due; each source is worked through in its own thread."""
+        by_source: Dict[str, list] = {}
+        for source, _, key, fetch in self.due():
+            by_source.setdefault(source, []).append((key, fetch))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(by_source), 1)) as pool:
+            counts = list(pool.map(lambda item: self._refresh_source(*item), by_source.items()))
+        self.refreshed += sum(counts)
+        return sum(counts)
+
+    def _refresh_source(self, source: str, entries: list) -> int:
+        limiter = self.refreshers[source][0]
+        refreshed = 0
+        for key, fetch in entries:
+            if not limiter.acquire(self._stop_event):
+                break
+            try:
+                self.cache.put(key, fetch(*self.cache.center(key)))
+                refreshed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Error refreshing {source} data for {key}: {e}")
+        return refreshed
+
+    def status(self) -> dict:
+        return {
+            'running': self.is_alive(),
+            'refreshed': self.refreshed,
+            'failed': self.failed,
+            'hotspots': self.tracker.top(10),
+            'cache': self.cache.stats(),
+        }
@@ -0,0 +1,147 @@
+"""
+Helpers for scoring a route: resampling a polyline at a fixed spacing and
+folding per-sample scores into per-segment and whole-route summaries.
+
+See LocationSafetyCalculator.score_route for the scoring itself.
+"""
+
+import math
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+RISK_LEVELS = ('low', 'med', 'high')
+
+
+def _distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def route_length_m(points: Sequence[Sequence[float]]) -> float:
+    return sum(_distance_m(*points[i], *points[i + 1]) for i in range(len(points) - 1))
+
+
+def resample_polyline(points: Sequence[Sequence[float]], spacing_m: float) -> Dict[str, np.ndarray]:
+    """
+    Place samples every `spacing_m` metres along a polyline.
+
+    The first and last vertex are always sampled; positions within a segment
+    are interpolated linearly in lat/lon, which is accurate for the short
+    segments of a road route.
+
+    Args:
+        points: Vertices as (lat, lon) pairs, at least two
+        spacing_m: Distance between consecutive samples in metres
+
+    Returns:
+        Arrays 'lat', 'lon', 'distance_m' (along the route) and 'segment'
+        (index of the input segment each sample lies on)
+    """
+    if len(points) < 2:
+        raise ValueError("A route needs at least two points")
+    if spacing_m <= 0:
+        raise ValueError("spacing_m must be positive")
+
+    lengths = [_distance_m(*points[i], *points[i + 1]) for i in range(len(points) - 1)]
+    total = sum(lengths)
+    positions = np.append(np.arange(0.0, total, spacing_m), total)
+    starts = np.concatenate([[0.0], np.cumsum(lengths)])
+
+    segment = np.clip(np.searchsorted(starts, positions, side='right') - 1, 0, len(lengths) - 1)
+    seg_lengths = np.asarray(lengths)[segment]
+    fraction = np.divide(positions - starts[segment], seg_lengths,
+                         out=np.zeros_like(positions), where=seg_lengths > 0)
+    fraction = np.clip(fraction, 0.0, 1.0)
+    vertices = np.asarray(points, dtype=np.float64)
+    start, end = vertices[segment], vertices[segment + 1]
+    return {
+        'lat': start[:, 0] + (end[:, 0] - start[:, 0]) * fraction,
+        'lon': start[:, 1] + (end[:, 1] - start[:, 1]) * fraction,
+        'distance_m': positions,
+        'segment': segment,
+    }
+
+
+class RouteAggregate:
+    """
+    Consumes sample records in route order and produces a summary record for
+    each input segment as soon as its last sample is in, plus one for the route.
+
+    Each sample stands for the stretch of route up to the next sample, so
+    distance-weighted means and the metres spent at each risk level add up to
+    the route length. Segments shorter than the spacing may hold no sample and
+    get no summary of their own.
+    """
+
+    def __init__(self, total_m: float):
+        self.total_m = total_m
+        self._route = self._empty()
+        self._segment: Optional[dict] = None
+        self._segment_index: Optional[int] = None
+        self._previous: Optional[dict] = None
+
+    @staticmethod
+    def _empty() -> dict:
+        return {
+            'samples': 0, 'weighted_score': 0.0, 'length_m': 0.0, 'min_safety_score': None,
+            'min_at': None, 'risk_level': None, 'risk_distance_m': {level: 0.0 for level in RISK_LEVELS},
+        }
+
+    def _account(self, summary: dict, sample: dict, length: float) -> None:
+        summary['samples'] += 1
+        summary['weighted_score'] += sample['safety_score'] * length
+        summary['length_m'] += length
+        summary['risk_distance_m'][sample['risk_level']] += length
+        if summary['risk_level'] is None or RISK_LEVELS.index(sample['risk_level']) > RISK_LEVELS.index(summary['risk_level']):
+            summary['risk_level'] = sample['risk_level']
+        if summary['min_safety_score'] is None or sample['safety_score'] < summary['min_safety_score']:
+            summary['min_safety_score'] = sample['safety_score']
+            summary['min_at'] = [sample['lat'], sample['lon']]
+
+    def _close(self, kind: str, summary: dict, **extra) -> dict:
+        length = summary['length_m']
+        return {
+            'type': kind,
+            **extra,
+            'samples': summary['samples'],
+            'length_m': round(length, 1),
+            'mean_safety_score': round(summary['weighted_score'] / length, 2) if length else summary['min_safety_score'],
+            'min_safety_score': summary['min_safety_score'],
+            'min_at': summary['min_at'],
+            'risk_level': summary['risk_level'],
+            'risk_distance_m': {level: round(d, 1) for level, d in summary['risk_distance_m'].items()},
+        }
+
+    def _flush_previous(self, next_distance: float) -> None:
+        """Account the previous sample, whose stretch ends at `next_distance`."""
+        previous = self._previous
+        if previous is not None:
+            length = next_distance - previous['distance_m']
+            self._account(self._route, previous, length)
+            self._account(self._segment, previous, length)
+
+    def add(self, sample: dict) -> List[dict]:
+        """Add the next sample; returns the summaries of any segments it completes."""
+        self._flush_previous(sample['distance_m'])
+        records = []
+        if self._segment_index is not None and sample['segment'] != self._segment_index:
+            records.append(self._close('segment', self._segment, segment=self._segment_index))
+            self._segment = None
+        if self._segment is None:
+            self._segment = self._empty()
+            self._segment_index = sample['segment']
+        self._previous = sample
+        return records
+
+    def finish(self) -> List[dict]:
+        """Summaries of the last segment and of the whole route."""
+        self._flush_previous(self.total_m)
+        records = []
+        if self._segment is not None:
+            records.append(self._close('segment', self._segment, segment=self._segment_index))
+        records.append(self._close('route', self._route))
+        return records
@@ -1,8 +1,203 @@
+import json
 import math
-import pandas as pd
+import asyncio
+import contextlib
 import numpy as np
-import requests
-from typing import Tuple, Optional, Dict, Any
+from typing import Tuple, Optional, Dict, Any, List, Iterator, AsyncIterator, Sequence, Callable, ContextManager
+
+try:
+    from .http_client import AsyncHTTPClient, shared_client
+    from .prewarm import HotspotTracker, LookupCache, Prewarmer, RateLimiter, tag_key
+    from .route import RouteAggregate, resample_polyline
+except ImportError:  # run as a script from this directory, e.g. scoretest.py
+    from http_client import AsyncHTTPClient, shared_client
+    from prewarm import HotspotTracker, LookupCache, Prewarmer, RateLimiter, tag_key
+    from route import RouteAggregate, resample_polyline
+
+# pandas (and httpx, through the HTTP client) are imported where they are used,
+# so importing this module (e.g. from the inference service) stays cheap.
+
+
+class GeofenceIndex:
+    """
+    Geofence polygons bucketed on a regular lat/lon grid.
+
+    Each polygon is registered in every grid cell its bounding box overlaps, so a
+    query only runs the point-in-polygon test (even-odd ray casting, holes
+    excluded) against the few polygons near the point, whatever the total count.
+    Polygons whose bounding box spans more than `max_buckets` cells are kept in
+    one list tested (bounding box first) by every query instead.
+    """
+
+    def __init__(self, cell_deg: float = 0.05, max_buckets: int = 4096):
+        """
+        Args:
+            cell_deg: Grid cell size in degrees
+            max_buckets: Most grid cells one polygon is registered in
+        """
+        self.cell_deg = cell_deg
+        self.max_buckets = max_buckets
+        self.polygons: List[List[np.ndarray]] = []
+        self.bboxes: List[Tuple[float, float, float, float]] = []
+        self.names: List[Optional[str]] = []
+        self.buckets: Dict[Tuple[int, int], List[int]] = {}
+        self.large: List[int] = []
+
+    @classmethod
+    def from_geojson(cls, source, cell_deg: float = 0.05, max_buckets: int = 4096) -> 'GeofenceIndex':
+        """
+        Build an index from a GeoJSON file path or an already parsed object.
+
+        Polygon and MultiPolygon geometries are indexed (in a FeatureCollection,
+        a Feature or bare); features with a missing, unsupported or malformed
+        geometry are skipped with a warning.
+        """
+        if isinstance(source, str):
+            with open(source) as f:
+                source = json.load(f)
+        index = cls(cell_deg, max_buckets)
+        features = source.get('features', [source]) if source.get('type') == 'FeatureCollection' else [source]
+        for number, feature in enumerate(features):
+            if not isinstance(feature, dict):
+                print(f"Warning: skipping geofence feature {number}: not an object")
+                continue
+            geometry = feature.get('geometry') if feature.get('type') == 'Feature' else feature
+            name = (feature.get('properties') or {}).get('name')
+            label = f"geofence feature {number}" + (f" ({name})" if name is not None else "")
+            kind = geometry.get('type') if isinstance(geometry, dict) else None
+            if kind not in ('Polygon', 'MultiPolygon'):
+                print(f"Warning: skipping {label}: unsupported geometry {kind}")
+                continue
+            polygons = [geometry.get('coordinates')] if kind == 'Polygon' else geometry.get('coordinates') or []
+            try:
+                rings = [[np.asarray(ring, dtype=np.float64)[:, :2] for ring in polygon] for polygon in polygons]
+                if not rings or any(not polygon or len(polygon[0]) < 3 for polygon in rings):
+                    raise ValueError("a polygon needs an exterior ring of at least 3 positions")
+            except (TypeError, ValueError, IndexError) as e:
+                print(f"Warning: skipping {label}: malformed coordinates: {e}")
+                continue
+            for polygon in rings:
+                index.add_polygon(polygon, name)
+        return index
+
+    def add_polygon(self, rings: List[List[List[float]]], name: Optional[str] = None) -> None:
+        """
+        Add one polygon.
+
+        Args:
+            rings: GeoJSON polygon coordinates: the exterior ring first, then holes,
+                each a list of [lon, lat] positions
+            name: Optional label returned by `find`
+        """
+        rings = [np.asarray(ring, dtype=np.float64)[:, :2] for ring in rings]
+        exterior = rings[0]
+        min_lon, min_lat = exterior.min(axis=0)
+        max_lon, max_lat = exterior.max(axis=0)
+        polygon_id = len(self.polygons)
+        self.polygons.append(rings)
+        self.bboxes.append((min_lat, min_lon, max_lat, max_lon))
+        self.names.append(name)
+
+        min_row, min_col = self._cell(min_lat, min_lon)
+        max_row, max_col = self._cell(max_lat, max_lon)
+        if (max_row - min_row + 1) * (max_col - min_col + 1) > self.max_buckets:
+            self.large.append(polygon_id)
+            return
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                self.buckets.setdefault((row, col), []).append(polygon_id)
+
+    def __len__(self) -> int:
+        return len(self.polygons)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def _candidates(self, lat: float, lon: float) -> List[int]:
+        return self.buckets.get(self._cell(lat, lon), []) + self.large
+
+    @staticmethod
+    def _ring_contains(ring: np.ndarray, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        # Even-odd rule: count the ring edges crossed by a ray running east from each point.
+        x0, y0 = ring[:, 0], ring[:, 1]
+        x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+        lats = lats[:, None]
+        lons = lons[:, None]
+        straddles = (y0 > lats) != (y1 > lats)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_lon = x0 + (lats - y0) * (x1 - x0) / (y1 - y0)
+        crossings = straddles & (lons < crossing_lon)
+        return (crossings.sum(axis=1) % 2) == 1
+
+    def _polygon_contains(self, polygon_id: int, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        min_lat, min_lon, max_lat, max_lon = self.bboxes[polygon_id]
+        inside = (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+        if not inside.any():
+            return inside
+        exterior, *holes = self.polygons[polygon_id]
+        candidates = np.flatnonzero(inside)
+        hit = self._ring_contains(exterior, lats[candidates], lons[candidates])
+        for hole in holes:
+            hit &= ~self._ring_contains(hole, lats[candidates], lons[candidates])
+        inside[candidates] = hit
+        return inside
+
+    def find(self, lat: float, lon: float) -> List[Optional[str]]:
+        """Names of all geofences containing the point."""
+        lats, lons = np.array([lat], dtype=np.float64), np.array([lon], dtype=np.float64)
+        return [
+            self.names[polygon_id]
+            for polygon_id in self._candidates(lat, lon)
+            if self._polygon_contains(polygon_id, lats, lons)[0]
+        ]
+
+    def contains(self, lat: float, lon: float) -> bool:
+        """Whether the point lies inside any geofence."""
+        lats, lons = np.array([lat], dtype=np.float64), np.array([lon], dtype=np.float64)
+        return any(
+            self._polygon_contains(polygon_id, lats, lons)[0]
+            for polygon_id in self._candidates(lat, lon)
+        )
+
+    def contains_many(self, lats, lons) -> np.ndarray:
+        """
+        Bulk form of `contains`.
+
+        Args:
+            lats: Sequence of latitudes
+            lons: Sequence of longitudes
+
+        Returns:
+            Boolean array, True where the point lies inside any geofence
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        shape = lats.shape
+        lats, lons = lats.reshape(-1), lons.reshape(-1)
+        result = np.zeros(len(lats), dtype=bool)
+        if not len(lats):
+            return result.reshape(shape)
+        rows = np.floor(lats / self.cell_deg).astype(np.int64)
+        cols = np.floor(lons / self.cell_deg).astype(np.int64)
+
+        # Group the points by grid cell so each bucket's polygons are tested once
+        # against all of the cell's points.
+        order = np.lexsort((cols, rows))
+        rows, cols = rows[order], cols[order]
+        starts = np.flatnonzero(np.r_[True, (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])])
+        ends = np.r_[starts[1:], len(order)]
+        for start, end in zip(starts, ends):
+            polygon_ids = self.buckets.get((int(rows[start]), int(cols[start])))
+            if not polygon_ids:
+                continue
+            points = order[start:end]
+            hit = np.zeros(len(points), dtype=bool)
+            for polygon_id in polygon_ids:
+                hit |= self._polygon_contains(polygon_id, lats[points], lons[points])
+            result[points] = hit
+        for polygon_id in self.large:
+            result |= self._polygon_contains(polygon_id, lats, lons)
+        return result.reshape(shape)
 
 
 class LocationSafetyCalculator:
@@ -11,21 +206,65 @@ class LocationSafetyCalculator:
     - Cell tower density (remoteness)
     - Accessibility to essential services
     - Environmental hazards
-    - Geofenced area status
+    - Geofenced area status, given by the caller or resolved from a GeofenceIndex
     """
     
-    def __init__(self, cell_tower_csv_path: str = './cell tower coverage/404.csv'):
+    OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+    WEATHER_URL = "https://api.met.no/weatherapi/locationforecast/2.0/compact"
+    
+    # Amenities behind the accessibility score, with their weights
+    ACCESSIBILITY_AMENITIES = (
+        ({'highway': ''}, 0.2),
+        ({'amenity': 'hospital'}, 0.2),
+        ({'amenity': 'police'}, 0.15),
+        ({'amenity': 'fuel'}, 0.15),
+        ({'amenity': 'atm'}, 0.1),
+        ({'amenity': 'pharmacy'}, 0.1),
+        ({'tourism': 'hotel'}, 0.1),
+    )
+    
+    # Tower count radii (km) behind the remoteness score, and the count at each
+    # radius that normalizes to fully connected
+    REMOTENESS_RADII = (0.5, 1, 5, 15)
+    REMOTENESS_SATURATION = (25, 62, 726, 2486)
+    
+    def __init__(self, cell_tower_csv_path: str = './cell tower coverage/404.csv',
+                 overpass_url: str = OVERPASS_URL, weather_url: str = WEATHER_URL,
+                 geofence_path: Optional[str] = None, http_client: Optional[AsyncHTTPClient] = None,
+                 lookup_cache: Optional[LookupCache] = None,
+                 profile: Optional[Callable[[], ContextManager]] = None):
         """
         Initialize the calculator with cell tower data.
         
         Args:
             cell_tower_csv_path: Path to the CSV file containing cell tower data
+            overpass_url: Overpass API interpreter endpoint
+            weather_url: met.no locationforecast endpoint
+            geofence_path: Optional GeoJSON file of geofence polygons, used when
+                the caller does not say whether a location is geofenced
+            http_client: Client for the Overpass and met.no calls; defaults to
+                the process-wide pooled client
+            lookup_cache: Cache of Overpass and weather results per spatial
+                cell; defaults to a new in-memory cache
+            profile: Returns a context manager entered around the CPU-bound
+                part of each safety score (e.g. a sampling profiler); it runs
+                synchronously in the thread doing the work
         """
         self.cell_tower_csv_path = cell_tower_csv_path
+        self.overpass_url = overpass_url
+        self.weather_url = weather_url
+        self.http = http_client or shared_client()
+        self.lookup_cache = lookup_cache or LookupCache()
+        self.hotspots = HotspotTracker(cell_deg=self.lookup_cache.sources['amenity'][0])
+        self.prewarmer: Optional[Prewarmer] = None
+        self.profile = profile or contextlib.nullcontext
         self._load_cell_tower_data()
+        self.geofences = self._load_geofences(geofence_path) if geofence_path else None
         
     def _load_cell_tower_data(self):
         """Load cell tower data from CSV file."""
+        import pandas as pd
+        
         try:
             self.cell_towers_df = pd.read_csv(self.cell_tower_csv_path)
         except FileNotFoundError:
@@ -35,25 +274,89 @@ class LocationSafetyCalculator:
             print(f"Error loading cell tower data: {e}")
             self.cell_towers_df = pd.DataFrame(columns=['lat', 'long'])
     
-    def calculate_safety_score(self, lat: float, lon: float, is_area_geofenced: bool = False) -> Tuple[float, str]:
+    def _load_geofences(self, geofence_path: str) -> Optional[GeofenceIndex]:
+        """Load geofence polygons from a GeoJSON file."""
+        try:
+            return GeofenceIndex.from_geojson(geofence_path)
+        except FileNotFoundError:
+            print(f"Warning: Geofence GeoJSON not found at {geofence_path}")
+        except Exception as e:
+            print(f"Error loading geofences: {e}")
+        return None
+    
+    def is_geofenced(self, lat: float, lon: float) -> bool:
+        """Whether the location lies inside a loaded geofence (False without an index)."""
+        return self.geofences is not None and self.geofences.contains(lat, lon)
+    
+    def are_geofenced(self, lats, lons) -> np.ndarray:
+        """Bulk form of `is_geofenced`, returning a boolean array."""
+        if self.geofences is None:
+            return np.zeros(np.shape(lats), dtype=bool)
+        return self.geofences.contains_many(lats, lons)
+    
+    def calculate_safety_score(self, lat: float, lon: float, is_area_geofenced: Optional[bool] = None) -> Tuple[float, str]:
         """
         Calculate the overall safety score for a given location.
         
         Args:
             lat: Latitude of the location
             lon: Longitude of the location
-            is_area_geofenced: Whether the area is geofenced (True/False)
+            is_area_geofenced: Whether the area is geofenced (True/False); None
+                resolves it from the geofence index
             
         Returns:
             Tuple of (safety_score, risk_level)
             - safety_score: 0-100 (100 = safest)
             - risk_level: 'low', 'med', or 'high'
         """
-        # Calculate individual scores
-        remoteness_score = self._calculate_remoteness_score(lat, lon)
-        accessibility_score = self._calculate_accessibility_score(lat, lon)
-        env_hazard_score = self._get_environmental_hazard_score(lat, lon)
-        geofence_score = 1.0 if is_area_geofenced else 0.0
+        scores = self._calculate_component_scores(lat, lon, is_area_geofenced)
+        return self._combine_scores(scores)
+    
+    async def calculate_safety_score_async(self, lat: float, lon: float,
+                                           is_area_geofenced: Optional[bool] = None) -> Tuple[float, str]:
+        """Async form of `calculate_safety_score` for callers running an event loop."""
+        # The tower density computation is CPU-bound, so it runs in a worker thread
+        # while the HTTP lookups are in flight.
+        remoteness_score, (accessibility_score, env_hazard_score) = await asyncio.gather(
+            asyncio.to_thread(self._profiled_remoteness_score, lat, lon),
+            asyncio.wrap_future(self.http.submit(self._fetch_remote_scores(lat, lon))),
+        )
+        if is_area_geofenced is None:
+            is_area_geofenced = self.is_geofenced(lat, lon)
+        return self._combine_scores({
+            'remoteness_score': remoteness_score,
+            'accessibility_score': accessibility_score,
+            'environmental_hazard_score': env_hazard_score,
+            'geofence_score': 1.0 if is_area_geofenced else 0.0,
+        })
+    
+    def _calculate_component_scores(self, lat: float, lon: float, is_area_geofenced: Optional[bool]) -> Dict[str, float]:
+        """Compute the four component scores, overlapping the HTTP lookups with the tower computation."""
+        remote_scores = self.http.submit(self._fetch_remote_scores(lat, lon))
+        remoteness_score = self._profiled_remoteness_score(lat, lon)
+        accessibility_score, env_hazard_score = remote_scores.result()
+        if is_area_geofenced is None:
+            is_area_geofenced = self.is_geofenced(lat, lon)
+        return {
+            'remoteness_score': remoteness_score,
+            'accessibility_score': accessibility_score,
+            'environmental_hazard_score': env_hazard_score,
+            'geofence_score': 1.0 if is_area_geofenced else 0.0,
+        }
+    
+    async def _fetch_remote_scores(self, lat: float, lon: float) -> Tuple[float, float]:
+        self.hotspots.record(lat, lon)
+        return await asyncio.gather(
+            self._calculate_accessibility_score_async(lat, lon),
+            self._get_environmental_hazard_score_async(lat, lon),
+        )
+    
+    def _combine_scores(self, scores: Dict[str, float]) -> Tuple[float, str]:
+        """Weight the component scores into (safety_score, risk_level)."""
+        remoteness_score = scores['remoteness_score']
+        accessibility_score = scores['accessibility_score']
+        env_hazard_score = scores['environmental_hazard_score']
+        geofence_score = scores['geofence_score']
         
         # Weights for each component (sum to 1.0)
         w_remoteness = 0.2
@@ -83,30 +386,143 @@ class LocationSafetyCalculator:
         
         return safety_score, risk_level
     
-    def get_detailed_scores(self, lat: float, lon: float, is_area_geofenced: bool = False) -> Dict[str, Any]:
+    def start_prewarm(self, top_n: int = 300, interval: float = 30.0, overpass_rate: float = 0.5,
+                      weather_rate: float = 2.0) -> Prewarmer:
+        """
+        Start refreshing the amenity and weather data of the most-queried cells in the background.
+        
+        Args:
+            top_n: Number of hotspot cells kept warm
+            interval: Seconds between scans of the hotspots
+            overpass_rate: Maximum Overpass queries per second from the refresher
+                of this process; with several processes pre-warming, the APIs
+                see the sum of their rates
+            weather_rate: Maximum met.no requests per second from the refresher,
+                likewise per process
+            
+        Returns:
+            The running Prewarmer
+        """
+        if self.prewarmer is not None and self.prewarmer.is_alive():
+            return self.prewarmer
+        
+        def amenity_job(tags):
+            fetch = lambda lat, lon: self.http.run(self._fetch_osm_elements_async(lat, lon, tags))
+            return tag_key(tags, 10000), fetch
+        
+        weather_fetch = lambda lat, lon: self.http.run(self._fetch_weather_hazard_async(lat, lon))
+        self.prewarmer = Prewarmer(
+            self.lookup_cache, self.hotspots,
+            {
+                'amenity': (RateLimiter(overpass_rate), [amenity_job(tags) for tags, _ in self.ACCESSIBILITY_AMENITIES]),
+                'weather': (RateLimiter(weather_rate), [('', weather_fetch)]),
+            },
+            top_n=top_n, interval=interval,
+        )
+        self.prewarmer.start()
+        return self.prewarmer
+    
+    def score_route(self, points: Sequence[Sequence[float]], spacing_m: float = 200.0,
+                    is_area_geofenced: Optional[bool] = None, chunk_size: int = 32) -> Iterator[Dict[str, Any]]:
+        """
+        Score a route by sampling it every `spacing_m` metres.
+        
+        Samples are scored in chunks of `chunk_size` consecutive points. Each
+        chunk selects the cell towers near it once and counts the towers for
+        all of its samples from that subset, and samples in the same cache cell
+        share their amenity and weather lookups.
+        
+        Args:
+            points: Route vertices as (lat, lon) pairs
+            spacing_m: Distance between samples in metres
+            is_area_geofenced: Geofence status for the whole route; None resolves
+                it per sample from the geofence index
+            chunk_size: Samples scored together
+            
+        Yields:
+            A 'sample' record per sample, a 'segment' summary as each input
+            segment is completed, and finally a 'route' summary
+        """
+        samples = resample_polyline(points, spacing_m)
+        aggregate = RouteAggregate(float(samples['distance_m'][-1]))
+        for start in range(0, len(samples['lat']), chunk_size):
+            chunk = {name: values[start:start + chunk_size] for name, values in samples.items()}
+            remote = self.http.submit(self._fetch_route_remote_scores(chunk['lat'], chunk['lon']))
+            remoteness = self._calculate_remoteness_scores(chunk['lat'], chunk['lon'])
+            for record in self._route_records(chunk, start, remoteness, remote.result(), is_area_geofenced):
+                yield record
+                yield from aggregate.add(record)
+        yield from aggregate.finish()
+    
+    async def score_route_async(self, points: Sequence[Sequence[float]], spacing_m: float = 200.0,
+                                is_area_geofenced: Optional[bool] = None,
+                                chunk_size: int = 32) -> AsyncIterator[Dict[str, Any]]:
+        """Async form of `score_route` for callers running an event loop."""
+        samples = resample_polyline(points, spacing_m)
+        aggregate = RouteAggregate(float(samples['distance_m'][-1]))
+        for start in range(0, len(samples['lat']), chunk_size):
+            chunk = {name: values[start:start + chunk_size] for name, values in samples.items()}
+            remoteness, remote = await asyncio.gather(
+                asyncio.to_thread(self._calculate_remoteness_scores, chunk['lat'], chunk['lon']),
+                asyncio.wrap_future(self.http.submit(self._fetch_route_remote_scores(chunk['lat'], chunk['lon']))),
+            )
+            for record in self._route_records(chunk, start, remoteness, remote, is_area_geofenced):
+                yield record
+                for summary in aggregate.add(record):
+                    yield summary
+        for summary in aggregate.finish():
+            yield summary
+    
+    async def _fetch_route_remote_scores(self, lats, lons) -> List[Tuple[float, float]]:
+        return await asyncio.gather(*(
+            self._fetch_remote_scores(float(lat), float(lon)) for lat, lon in zip(lats, lons)
+        ))
+    
+    def _route_records(self, chunk: Dict[str, np.ndarray], start: int, remoteness: np.ndarray,
+                       remote: List[Tuple[float, float]], is_area_geofenced: Optional[bool]) -> List[Dict[str, Any]]:
+        if is_area_geofenced is None:
+            geofenced = self.are_geofenced(chunk['lat'], chunk['lon'])
+        else:
+            geofenced = np.full(len(chunk['lat']), is_area_geofenced)
+        records = []
+        for i, (accessibility_score, env_hazard_score) in enumerate(remote):
+            scores = {
+                'remoteness_score': remoteness[i],
+                'accessibility_score': accessibility_score,
+                'environmental_hazard_score': env_hazard_score,
+                'geofence_score': 1.0 if geofenced[i] else 0.0,
+            }
+            safety_score, risk_level = self._combine_scores(scores)
+            records.append({
+                'type': 'sample',
+                'index': start + i,
+                'segment': int(chunk['segment'][i]),
+                'distance_m': round(float(chunk['distance_m'][i]), 1),
+                'lat': round(float(chunk['lat'][i]), 6),
+                'lon': round(float(chunk['lon'][i]), 6),
+                'safety_score': float(safety_score),
+                'risk_level': risk_level,
+            })
+        return records
+    
+    def get_detailed_scores(self, lat: float, lon: float, is_area_geofenced: Optional[bool] = None) -> Dict[str, Any]:
         """
         Get detailed breakdown of all component scores.
         
         Args:
             lat: Latitude of the location
             lon: Longitude of the location
-            is_area_geofenced: Whether the area is geofenced
+            is_area_geofenced: Whether the area is geofenced; None resolves it
+                from the geofence index
             
         Returns:
             Dictionary with all component scores and final results
         """
-        remoteness_score = self._calculate_remoteness_score(lat, lon)
-        accessibility_score = self._calculate_accessibility_score(lat, lon)
-        env_hazard_score = self._get_environmental_hazard_score(lat, lon)
-        geofence_score = 1.0 if is_area_geofenced else 0.0
-        
-        safety_score, risk_level = self.calculate_safety_score(lat, lon, is_area_geofenced)
+        scores = self._calculate_component_scores(lat, lon, is_area_geofenced)
+        safety_score, risk_level = self._combine_scores(scores)
         
         return {
-            'remoteness_score': remoteness_score,
-            'accessibility_score': accessibility_score,
-            'environmental_hazard_score': env_hazard_score,
-            'geofence_score': geofence_score,
+            **scores,
             'final_safety_score': safety_score,
             'risk_level': risk_level
         }
@@ -133,6 +549,10 @@ class LocationSafetyCalculator:
         distances = R * c
         return distances
     
+    def _profiled_remoteness_score(self, lat: float, lon: float) -> float:
+        with self.profile():
+            return self._calculate_remoteness_score(lat, lon)
+    
     def _calculate_remoteness_score(self, lat: float, lon: float) -> float:
         """Calculate remoteness score based on cell tower density."""
         if self.cell_towers_df.empty:
@@ -145,158 +565,186 @@ class LocationSafetyCalculator:
             ref_lon=lon
         )
         
-        # Filter distances to only those less than 100 km
-        distances = distances[distances < 100]
-        
-        radii = [0.5, 1, 5, 15]  # km
-        metrics = {}
-        
-        for r in radii:
-            mask = distances <= r
-            count = np.sum(mask)
-            density = count / (np.pi * r**2)  # towers per km²
-            metrics[f'count_{r}km'] = count
-            metrics[f'density_{r}km'] = density
-        
-        # Compute remoteness score
-        c05 = metrics.get('count_0.5km', 0) + 1
-        c1 = metrics.get('count_1km', 0) + 1
-        c5 = metrics.get('count_5km', 0) + 1
-        c15 = metrics.get('count_15km', 0) + 1
-        
-        # Log transform
-        l05, l1, l5, l15 = map(np.log10, [c05, c1, c5, c15])
+        counts = np.array([[np.sum(distances <= r) for r in self.REMOTENESS_RADII]])
+        return self._remoteness_from_counts(counts)[0]
+    
+    def _calculate_remoteness_scores(self, lats: np.ndarray, lons: np.ndarray, max_group_km: float = 2.0) -> np.ndarray:
+        """
+        Remoteness scores for a sequence of nearby points, e.g. consecutive route samples.
         
-        # Normalize to 0-1
-        norm05 = 1 - min(l05 / np.log10(25+1), 1)
-        norm1 = 1 - min(l1 / np.log10(62+1), 1)
-        norm5 = 1 - min(l5 / np.log10(726+1), 1)
-        norm15 = 1 - min(l15 / np.log10(2486+1), 1)
+        Points are grouped into runs spanning at most `max_group_km` from the
+        run's first point. Towers that can be within the largest radius of any
+        point in a run are selected once for the run, and every point's tower
+        counts are taken from that subset, giving the same scores as
+        `_calculate_remoteness_score` per point.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        if self.cell_towers_df.empty:
+            return np.full(len(lats), 0.5)
+        
+        tower_lats = self.cell_towers_df['lat'].to_numpy(dtype=np.float64)
+        tower_lons = self.cell_towers_df['long'].to_numpy(dtype=np.float64)
+        radii = np.asarray(self.REMOTENESS_RADII, dtype=np.float64)
+        counts = np.zeros((len(lats), len(radii)), dtype=np.int64)
+        
+        start = 0
+        while start < len(lats):
+            spans = self._compute_haversine_distances(lats[start:], lons[start:], lats[start], lons[start])
+            end = start + int(np.argmax(spans > max_group_km)) if np.any(spans > max_group_km) else len(lats)
+            end = max(end, start + 1)
+            group_span = spans[:end - start].max()
+            # Triangle inequality, with a margin for rounding in the haversine formula
+            near = self._compute_haversine_distances(tower_lats, tower_lons, lats[start], lons[start]) \
+                <= radii[-1] + group_span + 0.01
+            near_lats, near_lons = tower_lats[near], tower_lons[near]
+            for i in range(start, end):
+                distances = self._compute_haversine_distances(near_lats, near_lons, lats[i], lons[i])
+                counts[i] = [np.sum(distances <= r) for r in radii]
+            start = end
+        
+        return self._remoteness_from_counts(counts)
+    
+    def _remoteness_from_counts(self, counts: np.ndarray) -> np.ndarray:
+        """Remoteness scores from tower counts within REMOTENESS_RADII, one row per location."""
+        # Log transform, normalized to 0-1
+        logs = np.log10(counts + 1)
+        norms = 1 - np.minimum(logs / np.log10(np.asarray(self.REMOTENESS_SATURATION) + 1), 1)
         
         # Weighted average
-        score = (0.2*norm05 + 0.3*norm1 + 0.3*norm5 + 0.2*norm15)
+        score = (0.2*norms[:, 0] + 0.3*norms[:, 1] + 0.3*norms[:, 2] + 0.2*norms[:, 3])
         
-        return round(score, 3)
+        return np.round(score, 3)
     
     def _get_nearest_osm_feature(self, lat: float, lon: float, tags: Dict = None, radius: int = 10000) -> Tuple[Optional[float], Optional[str]]:
         """Query Overpass API for nearest feature."""
+        return self.http.run(self._get_nearest_osm_feature_async(lat, lon, tags, radius))
+    
+    async def _get_nearest_osm_feature_async(self, lat: float, lon: float, tags: Dict = None, radius: int = 10000) -> Tuple[Optional[float], Optional[str]]:
         if tags is None:
             tags = {}
         
-        tag_filters = ''.join([f'["{k}"="{v}"]' for k, v in tags.items()])
-        query = f"""
-        [out:json][timeout:25];
-        (
-          node{tag_filters}(around:{radius},{lat},{lon});
-          way{tag_filters}(around:{radius},{lat},{lon});
-          rel{tag_filters}(around:{radius},{lat},{lon});
-        );
-        out center 1;
-        """
-        
-        url = "https://overpass-api.de/api/interpreter"
         try:
-            response = requests.post(url, data={'data': query}, timeout=30)
-            data = response.json()
+            # Features are fetched once per cell, around its centre, and the
+            # distance is measured from the queried location.
+            key = self.lookup_cache.key('amenity', tag_key(tags, radius), lat, lon)
+            elements = await self.lookup_cache.get_async(key)
+            if elements is None:
+                elements = await self._fetch_osm_elements_async(*self.lookup_cache.center(key), tags, radius)
+                self.lookup_cache.put_async(key, elements)
+            
             min_dist = None
             nearest_name = None
-            
-            for el in data.get('elements', []):
-                if 'lat' in el and 'lon' in el:
-                    lat2, lon2 = el['lat'], el['lon']
-                elif 'center' in el:
-                    lat2, lon2 = el['center']['lat'], el['center']['lon']
-                else:
-                    continue
-                
+            for lat2, lon2, name in elements:
                 d = self._compute_haversine_distances([lat2], [lon2], lat, lon)[0]
                 
                 if (min_dist is None) or (d < min_dist):
                     min_dist = d
-                    nearest_name = el.get('tags', {}).get('name')
+                    nearest_name = name
             
             return min_dist, nearest_name
         except Exception as e:
             print(f"Overpass API error: {e}")
             return None, None
     
+    async def _fetch_osm_elements_async(self, lat: float, lon: float, tags: Dict,
+                                        radius: int = 10000) -> List[Tuple[float, float, Optional[str]]]:
+        """Query Overpass for features around a location, as (lat, lon, name) tuples."""
+        tag_filters = ''.join([f'["{k}"="{v}"]' for k, v in tags.items()])
+        query = f"""
+        [out:json][timeout:25];
+        (
+          node{tag_filters}(around:{radius},{lat},{lon});
+          way{tag_filters}(around:{radius},{lat},{lon});
+          rel{tag_filters}(around:{radius},{lat},{lon});
+        );
+        out center 1;
+        """
+        
+        response = await self.http.request('POST', self.overpass_url, data={'data': query}, timeout=30)
+        response.raise_for_status()
+        elements = []
+        for el in response.json().get('elements', []):
+            if 'lat' in el and 'lon' in el:
+                elements.append((el['lat'], el['lon'], el.get('tags', {}).get('name')))
+            elif 'center' in el:
+                elements.append((el['center']['lat'], el['center']['lon'], el.get('tags', {}).get('name')))
+        return elements
+    
     def _calculate_accessibility_score(self, lat: float, lon: float) -> float:
         """Calculate accessibility score based on distance to amenities."""
-        # Query for various amenities
-        road_dist, _ = self._get_nearest_osm_feature(lat, lon, tags={'highway': ''})
-        hospital_dist, _ = self._get_nearest_osm_feature(lat, lon, tags={'amenity': 'hospital'})
-        police_dist, _ = self._get_nearest_osm_feature(lat, lon, tags={'amenity': 'police'})
-        petrol_dist, _ = self._get_nearest_osm_feature(lat, lon, tags={'amenity': 'fuel'})
-        atm_dist, _ = self._get_nearest_osm_feature(lat, lon, tags={'amenity': 'atm'})
-        pharmacy_dist, _ = self._get_nearest_osm_feature(lat, lon, tags={'amenity': 'pharmacy'})
-        hotel_dist, _ = self._get_nearest_osm_feature(lat, lon, tags={'tourism': 'hotel'})
-        
-        # Normalize distances (cap at 50 km)
-        norm_road = min((road_dist or 50) / 50, 1)
-        norm_hospital = min((hospital_dist or 50) / 50, 1)
-        norm_police = min((police_dist or 50) / 50, 1)
-        norm_petrol = min((petrol_dist or 50) / 50, 1)
-        norm_atm = min((atm_dist or 50) / 50, 1)
-        norm_pharmacy = min((pharmacy_dist or 50) / 50, 1)
-        norm_hotel = min((hotel_dist or 50) / 50, 1)
-        
-        # Weighted average
-        score = (
-            0.2 * norm_road +
-            0.2 * norm_hospital +
-            0.15 * norm_police +
-            0.15 * norm_petrol +
-            0.1 * norm_atm +
-            0.1 * norm_pharmacy +
-            0.1 * norm_hotel
-        )
+        return self.http.run(self._calculate_accessibility_score_async(lat, lon))
+    
+    async def _calculate_accessibility_score_async(self, lat: float, lon: float) -> float:
+        # Query for the amenities concurrently
+        nearest = await asyncio.gather(*(
+            self._get_nearest_osm_feature_async(lat, lon, tags=tags)
+            for tags, _ in self.ACCESSIBILITY_AMENITIES
+        ))
+        
+        # Weighted average of the distances, normalized with a cap at 50 km
+        score = 0.0
+        for (dist, _), (_, weight) in zip(nearest, self.ACCESSIBILITY_AMENITIES):
+            score += weight * min((dist or 50) / 50, 1)
         
         return round(score, 3)
     
     def _get_environmental_hazard_score(self, lat: float, lon: float) -> float:
         """Get environmental hazard score from weather data."""
-        api_url = f"https://api.met.no/weatherapi/locationforecast/2.0/compact?lat={lat}&lon={lon}"
+        return self.http.run(self._get_environmental_hazard_score_async(lat, lon))
+    
+    async def _get_environmental_hazard_score_async(self, lat: float, lon: float) -> float:
+        try:
+            key = self.lookup_cache.key('weather', '', lat, lon)
+            score = await self.lookup_cache.get_async(key)
+            if score is None:
+                score = await self._fetch_weather_hazard_async(*self.lookup_cache.center(key))
+                self.lookup_cache.put_async(key, score)
+            return score
+        
+        except Exception as e:
+            print(f"Error fetching environmental hazard score: {e}")
+            return 0.1  # Default low hazard
+    
+    async def _fetch_weather_hazard_async(self, lat: float, lon: float) -> float:
+        """Hazard score of the current met.no forecast at a location."""
+        api_url = f"{self.weather_url}?lat={lat}&lon={lon}"
         headers = {
             "User-Agent": "LocationSafetyCalculator/1.0"
         }
         
-        try:
-            response = requests.get(api_url, headers=headers, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            
-            timeseries = data.get("properties", {}).get("timeseries", [])
-            if not timeseries:
-                return 0.1  # Default low hazard
-            
-            current = timeseries[0].get("data", {}).get("next_1_hours", {}).get("summary", {})
-            symbol_code = current.get("symbol_code", "").lower()
-            
-            # Assign hazard scores based on weather conditions
-            if "thunderstorm" in symbol_code or "tornado" in symbol_code or "extreme" in symbol_code or "cyclone" in symbol_code:
-                score = 0.95
-            elif "heavyrain" in symbol_code or "rainshowers_heavy" in symbol_code:
-                score = 0.8
-            elif "rain" in symbol_code or "showers" in symbol_code:
-                score = 0.6
-            elif "heavysnow" in symbol_code or "snow" in symbol_code:
-                score = 0.5
-            elif "fog" in symbol_code or "mist" in symbol_code:
-                score = 0.4
-            elif "dust" in symbol_code or "sand" in symbol_code:
-                score = 0.4
-            elif "hot" in symbol_code or "heatwave" in symbol_code:
-                score = 0.7
-            elif "clearsky" in symbol_code or "fair" in symbol_code:
-                score = 0.0
-            else:
-                score = 0.1
-            
-            return round(score, 3)
+        response = await self.http.request('GET', api_url, headers=headers, timeout=10)
+        response.raise_for_status()
+        data = response.json()
         
-        except Exception as e:
-            print(f"Error fetching environmental hazard score: {e}")
+        timeseries = data.get("properties", {}).get("timeseries", [])
+        if not timeseries:
             return 0.1  # Default low hazard
+        
+        current = timeseries[0].get("data", {}).get("next_1_hours", {}).get("summary", {})
+        symbol_code = current.get("symbol_code", "").lower()
+        
+        # Assign hazard scores based on weather conditions
+        if "thunderstorm" in symbol_code or "tornado" in symbol_code or "extreme" in symbol_code or "cyclone" in symbol_code:
+            score = 0.95
+        elif "heavyrain" in symbol_code or "rainshowers_heavy" in symbol_code:
+            score = 0.8
+        elif "rain" in symbol_code or "showers" in symbol_code:
+            score = 0.6
+        elif "heavysnow" in symbol_code or "snow" in symbol_code:
+            score = 0.5
+        elif "fog" in symbol_code or "mist" in symbol_code:
+            score = 0.4
+        elif "dust" in symbol_code or "sand" in symbol_code:
+            score = 0.4
+        elif "hot" in symbol_code or "heatwave" in symbol_code:
+            score = 0.7
+        elif "clearsky" in symbol_code or "fair" in symbol_code:
+            score = 0.0
+        else:
+            score = 0.1
+        
+        return round(score, 3)
 
 
 # Example usage
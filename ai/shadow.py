@@ -0,0 +1,242 @@
+"""
+Shadow and canary evaluation of a candidate model against the production one.
+
+A candidate is loaded next to a production handler as a second handler of the
+same class. Candidates are .safx artifacts (model_artifact.py; export a
+retrained joblib pair first) named by file name inside the SAFARX_SHADOW_MODELS
+directory: the admin endpoint never loads a path of the caller's choosing, and
+.safx files hold only arrays, so nothing is unpickled.
+A sampled copy of the payloads the production endpoint serves is put on a
+bounded queue without waiting; a worker thread drains it in batches, scores
+each batch with both models and accumulates how often they agree. When the
+queue is full the copy is dropped and counted, so shadowing never adds latency
+or unbounded memory to the request path.
+
+In canary mode a fraction of requests is answered by the candidate itself
+(those requests are still compared). The candidate records its own metrics
+under `<model>_candidate`.
+
+    SAFARX_SHADOW_MODELS    directory of candidate .safx artifacts; unset disables shadowing
+"""
+
+import os
+import queue
+import random
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+RISK_LEVELS = ('LOW', 'MEDIUM', 'HIGH')
+ARTIFACT_SUFFIX = '.safx'
+CANDIDATE_DIR = os.environ.get('SAFARX_SHADOW_MODELS') or None
+
+
+def candidate_path(artifact: str, directory: Optional[str] = CANDIDATE_DIR) -> str:
+    """Path of the candidate artifact named `artifact` in `directory`; anything else is rejected."""
+    if not directory:
+        raise ValueError("Shadow evaluation is disabled: SAFARX_SHADOW_MODELS is not set")
+    if os.path.basename(artifact) != artifact or not artifact.endswith(ARTIFACT_SUFFIX) \
+            or artifact.startswith('.'):
+        raise ValueError(f"The candidate must be the file name of a {ARTIFACT_SUFFIX} artifact in the shadow model directory")
+    path = os.path.join(directory, artifact)
+    # A symlink in the directory must not lead out of it.
+    if os.path.dirname(os.path.realpath(path)) != os.path.realpath(directory):
+        raise ValueError(f"The candidate '{artifact}' is not in the shadow model directory")
+    if not os.path.isfile(path):
+        raise ValueError(f"No candidate artifact '{artifact}' in the shadow model directory")
+    return path
+
+
+def load_candidate(production, artifact: str, directory: Optional[str] = CANDIDATE_DIR):
+    """
+    A handler of the production handler's class with the candidate model loaded.
+
+    Args:
+        production: The production handler
+        artifact: File name of the candidate .safx artifact in `directory`
+        directory: The shadow model directory (SAFARX_SHADOW_MODELS)
+    """
+    path = candidate_path(artifact, directory)
+    candidate = type(production)()
+    candidate.name = f"{production.name}_candidate"
+    # Empty joblib paths never exist, so there is no pickle fallback.
+    candidate.artifact_path = path
+    candidate.model_path = ''
+    candidate.scaler_path = ''
+    if not candidate.load_model_and_scaler():
+        raise ValueError(f"Could not load the {production.name} candidate model")
+    return candidate
+
+
+def payload_columns(payloads: List[dict]) -> dict:
+    """Turn a list of payload dicts into the column form predict_batch/score_batch take."""
+    return {field: np.asarray([payload[field] for payload in payloads]) for field in payloads[0]}
+
+
+class ShadowStats:
+    def __init__(self):
+        self.compared = 0
+        self.anomaly_agreements = 0
+        self.risk_agreements = 0
+        self.production_anomalies = 0
+        self.candidate_anomalies = 0
+        self.score_diff_sum = 0.0
+        self.score_abs_diff_sum = 0.0
+        self.max_abs_diff = 0.0
+        # confusion[production risk][candidate risk]
+        self.confusion = np.zeros((len(RISK_LEVELS), len(RISK_LEVELS)), dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def add(self, production, candidate, production_scores: np.ndarray, candidate_scores: np.ndarray) -> None:
+        production_anomaly = production_scores < production.anomaly_threshold
+        candidate_anomaly = candidate_scores < candidate.anomaly_threshold
+        production_risk = production.risk_levels(production_scores)
+        candidate_risk = candidate.risk_levels(candidate_scores)
+        diff = candidate_scores - production_scores
+
+        with self._lock:
+            self._add(production_anomaly, candidate_anomaly, production_risk, candidate_risk, diff)
+
+    def _add(self, production_anomaly, candidate_anomaly, production_risk, candidate_risk, diff) -> None:
+        self.compared += len(diff)
+        self.anomaly_agreements += int(np.sum(production_anomaly == candidate_anomaly))
+        self.risk_agreements += int(np.sum(production_risk == candidate_risk))
+        self.production_anomalies += int(production_anomaly.sum())
+        self.candidate_anomalies += int(candidate_anomaly.sum())
+        self.score_diff_sum += float(diff.sum())
+        self.score_abs_diff_sum += float(np.abs(diff).sum())
+        self.max_abs_diff = max(self.max_abs_diff, float(np.abs(diff).max()))
+        np.add.at(self.confusion, (
+            [RISK_LEVELS.index(level) for level in production_risk],
+            [RISK_LEVELS.index(level) for level in candidate_risk],
+        ), 1)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return self._summary()
+
+    def _summary(self) -> dict:
+        n = self.compared
+        return {
+            'compared': n,
+            'anomaly_agreement': self.anomaly_agreements / n if n else None,
+            'risk_level_agreement': self.risk_agreements / n if n else None,
+            'production_anomaly_rate': self.production_anomalies / n if n else None,
+            'candidate_anomaly_rate': self.candidate_anomalies / n if n else None,
+            'mean_score_diff': self.score_diff_sum / n if n else None,
+            'mean_abs_score_diff': self.score_abs_diff_sum / n if n else None,
+            'max_abs_score_diff': self.max_abs_diff,
+            'risk_level_confusion': {
+                production_level: dict(zip(RISK_LEVELS, self.confusion[i].tolist()))
+                for i, production_level in enumerate(RISK_LEVELS)
+            },
+        }
+
+
+class ShadowEvaluator:
+    def __init__(self, production, candidate, sample_rate: float = 0.1, canary_fraction: float = 0.0,
+                 queue_size: int = 10_000, batch_size: int = 256):
+        """
+        Args:
+            production: Handler serving the endpoint
+            candidate: Handler with the candidate model (see load_candidate)
+            sample_rate: Fraction of production requests copied to the shadow queue
+            canary_fraction: Fraction of requests answered by the candidate
+            queue_size: Payload copies waiting to be compared, at most
+            batch_size: Payload copies scored together by the worker
+        """
+        self.production = production
+        self.candidate = candidate
+        self.sample_rate = sample_rate
+        self.canary_fraction = canary_fraction
+        self.batch_size = batch_size
+        self.stats = ShadowStats()
+        self.canary_served = 0
+        self.dropped = 0
+        self.errors = 0
+        self._queue: 'queue.Queue[Optional[dict]]' = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+        self._worker = threading.Thread(target=self._run, name=f'shadow-{production.name}', daemon=True)
+        self._worker.start()
+
+    def predict(self, payload_data: dict) -> dict:
+        """Answer a request from production or, for the canary fraction, the candidate, and shadow a sample."""
+        canary = self.pick_canary()
+        result = (self.candidate if canary else self.production).predict(payload_data)
+        self.shadow(payload_data, canary)
+        return result
+
+    def pick_canary(self) -> bool:
+        """Whether the candidate answers this request."""
+        if self.canary_fraction and random.random() < self.canary_fraction:
+            self.canary_served += 1
+            return True
+        return False
+
+    def shadow(self, payload_data: dict, canary: bool = False) -> None:
+        """Queue a copy of an answered request for comparison: every canary request, a sample of the others."""
+        if canary or random.random() < self.sample_rate:
+            self._offer(payload_data)
+
+    def _offer(self, payload_data: dict) -> None:
+        try:
+            self._queue.put_nowait(payload_data)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self) -> None:
+        """Stop the worker once it has compared what is already queued. Does not block."""
+        self._stopping.set()
+        try:
+            # Wakes a worker waiting on an empty queue; a full one is drained first anyway.
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            payloads = [payload for payload in batch if payload is not None]
+            if payloads:
+                self._compare(payloads)
+            if len(payloads) < len(batch) or (self._stopping.is_set() and self._queue.empty()):
+                return
+
+    def _compare(self, payloads: List[dict]) -> None:
+        try:
+            columns = payload_columns(payloads)
+            production_scores = self.production.score_batch(columns)
+            candidate_scores = self.candidate.score_batch(columns)
+            self.stats.add(self.production, self.candidate, production_scores, candidate_scores)
+        except Exception as e:
+            self.errors += 1
+            print(f"Error in shadow scoring for {self.production.name}: {e}")
+
+    def status(self) -> dict:
+        return {
+            'sample_rate': self.sample_rate,
+            'canary_fraction': self.canary_fraction,
+            'canary_served': self.canary_served,
+            'queued': self._queue.qsize(),
+            'dropped': self.dropped,
+            'errors': self.errors,
+            **self.stats.summary(),
+        }
+
+
+# Production handler name -> active evaluator
+evaluators: Dict[str, ShadowEvaluator] = {}
+
+
+def predict(handler, payload_data: dict) -> dict:
+    """handler.predict, routed through the handler's shadow evaluator when one is active."""
+    evaluator = evaluators.get(handler.name)
+    if evaluator is None:
+        return handler.predict(payload_data)
+    return evaluator.predict(payload_data)
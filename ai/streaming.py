@@ -0,0 +1,192 @@
+"""
+Streaming ingestion for gateways that forward many devices' telemetry over one
+connection (`/ws/telemetry` WebSocket and `/api/stream` NDJSON, see main.py).
+
+Each message is an envelope, or a JSON array of envelopes:
+
+    {"id": "device-17:0342", "model": "inactivity", "payload": {...}}
+
+where `payload` is what `/api/inactivity` or `/api/dropoff` takes. Results come
+back as they are scored, one per envelope, carrying the same `id`:
+
+    {"id": "device-17:0342", "model": "inactivity", "is_anomaly": false, "risk_level": "LOW"}
+    {"id": "device-17:0343", "model": "dropoff", "error": [...validation errors...]}
+
+Messages are queued per connection and scored in batches of up to `batch_size`,
+waiting at most `max_delay` seconds for a batch to fill. The queue holds at most
+`max_pending` payloads: when it is full the connection stops reading, which
+pushes back on the sender through TCP flow control instead of buffering
+without bound. Sending {"type": "stats"} returns the connection's throughput.
+HIGH risk anomalies are offered to the alert pipeline, with the payload's
+`device_id` (if it has one) for deduplication.
+"""
+
+import time
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+import wire
+
+_CLOSED = object()
+
+
+class StreamSession:
+    def __init__(self, handlers: Dict[str, Tuple[object, wire.WireSchema]], batch_size: int = 256,
+                 max_delay: float = 0.005, max_pending: int = 1024, alerts=None):
+        self.handlers = handlers
+        self.alerts = alerts
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.queue: asyncio.Queue = asyncio.Queue(max_pending)
+        self.started = time.monotonic()
+        self.received = 0
+        self.scored = 0
+        self.errors = 0
+        self.batches = 0
+
+    async def submit(self, message) -> None:
+        """Queue one decoded message (an envelope or a list of envelopes); waits while the queue is full."""
+        envelopes = message if isinstance(message, list) else [message]
+        for envelope in envelopes:
+            await self.queue.put(self._parse_envelope(envelope))
+
+    async def reject(self, detail: str) -> None:
+        """Queue an error result for a message that could not be decoded."""
+        self.received += 1
+        await self.queue.put(self._error(None, None, detail))
+
+    def _parse_envelope(self, envelope) -> dict:
+        if isinstance(envelope, dict) and envelope.get('type') == 'stats':
+            return {'result': self.stats()}
+        self.received += 1
+        if not isinstance(envelope, dict):
+            return self._error(None, None, 'Message should be an object')
+        message_id = envelope.get('id')
+        model = envelope.get('model')
+        if model not in self.handlers:
+            return self._error(message_id, model, f"Unknown model {model!r}, expected one of {sorted(self.handlers)}")
+        if not isinstance(envelope.get('payload'), dict):
+            return self._error(message_id, model, "Field 'payload' should be an object")
+        return {'id': message_id, 'model': model, 'payload': envelope['payload']}
+
+    def _error(self, message_id, model, detail) -> dict:
+        self.errors += 1
+        metrics.STREAM_MESSAGES.inc(model if model in self.handlers else 'unknown', 'error')
+        return {'result': {'id': message_id, 'model': model, 'error': detail}}
+
+    async def close(self) -> None:
+        """Mark the end of the input; results() finishes once the queue is drained."""
+        await self.queue.put(_CLOSED)
+
+    async def results(self) -> AsyncIterator[List[dict]]:
+        """Yield the results of each scored batch, in submission order within a batch."""
+        loop = asyncio.get_running_loop()
+        closed = False
+        while not closed:
+            item = await self.queue.get()
+            if item is _CLOSED:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _CLOSED:
+                    closed = True
+                    break
+                batch.append(item)
+            # Scoring is CPU-bound; a worker thread keeps the connection reading meanwhile.
+            yield await asyncio.to_thread(self._score, batch)
+
+    def _score(self, batch: List[dict]) -> List[dict]:
+        results: List[Optional[dict]] = [item.get('result') for item in batch]
+        for model, (handler, schema) in self.handlers.items():
+            rows = [i for i, item in enumerate(batch) if item.get('model') == model and 'result' not in item]
+            if not rows:
+                continue
+            payloads = [batch[i]['payload'] for i in rows]
+            try:
+                columns = wire.decode_payloads(payloads, schema)
+            except wire.WireFormatError:
+                # Isolate the invalid payloads so they don't fail the whole batch.
+                columns, valid_rows = [], []
+                for i, payload in zip(rows, payloads):
+                    try:
+                        columns.append(wire.decode_payloads([payload], schema, single=True))
+                        valid_rows.append(i)
+                    except wire.WireFormatError as e:
+                        results[i] = self._error(batch[i]['id'], model, e.errors)['result']
+                if not columns:
+                    continue
+                rows = valid_rows
+                columns = {name: np.concatenate([c[name] for c in columns]) for name in columns[0]}
+
+            try:
+                _, is_anomaly, risk_levels = handler.predict_batch(columns)
+            except Exception as e:
+                print(f"Error scoring streamed {model} batch: {e}")
+                for i in rows:
+                    results[i] = self._error(batch[i]['id'], model, f"Prediction error: {str(e)}")['result']
+                continue
+
+            if self.alerts is not None:
+                self.alerts.offer_batch(model, is_anomaly, risk_levels, lambda j: (
+                    batch[rows[j]]['payload'].get('device_id'), batch[rows[j]]['payload']
+                ))
+            for i, anomaly, risk_level in zip(rows, is_anomaly, risk_levels):
+                results[i] = {
+                    'id': batch[i]['id'],
+                    'model': model,
+                    'is_anomaly': bool(anomaly),
+                    'risk_level': str(risk_level),
+                }
+            self.scored += len(rows)
+            metrics.STREAM_MESSAGES.inc(model, 'scored', amount=len(rows))
+            metrics.STREAM_BATCH_SIZE.observe(len(rows), model)
+
+        self.batches += 1
+        return results
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            'type': 'stats',
+            'received': self.received,
+            'scored': self.scored,
+            'errors': self.errors,
+            'pending': self.queue.qsize(),
+            'batches': self.batches,
+            'mean_batch_size': self.scored / self.batches if self.batches else 0.0,
+            'elapsed_s': elapsed,
+            'messages_per_second': self.scored / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class ConnectionTracker:
+    """Keeps the open-connection gauge up to date."""
+
+    def __init__(self):
+        self.active = 0
+
+    def __enter__(self):
+        self.active += 1
+        metrics.STREAM_CONNECTIONS.set(self.active)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.active -= 1
+        metrics.STREAM_CONNECTIONS.set(self.active)
+
+
+connections = ConnectionTracker()
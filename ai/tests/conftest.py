@@ -0,0 +1,9 @@
+import os
+import sys
+
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The handlers load their artifacts from paths relative to ai/.
+if AI_DIR not in sys.path:
+    sys.path.insert(0, AI_DIR)
+os.chdir(AI_DIR)
@@ -0,0 +1,102 @@
+import asyncio
+
+import alerts
+
+HIGH = {'is_anomaly': True, 'risk_level': 'HIGH'}
+
+
+class FailingSink:
+    name = 'failing'
+
+    def __init__(self):
+        self.calls = 0
+
+    async def send(self, events):
+        self.calls += 1
+        raise RuntimeError('unreachable')
+
+    async def close(self):
+        pass
+
+
+class StuckSink:
+    name = 'stuck'
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.events = []
+
+    async def send(self, events):
+        await self.gate.wait()
+        self.events.extend(events)
+
+    async def close(self):
+        pass
+
+
+async def until(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+def test_only_high_risk_anomalies_alert_once_per_device():
+    async def run():
+        sink = alerts.QueueSink()
+        pipeline = alerts.AlertPipeline([sink], flush_interval=0.01, dedup_seconds=60)
+        pipeline.start()
+        pipeline.offer('dropoff', 'device-1', {'is_anomaly': True, 'risk_level': 'MEDIUM'}, {})
+        pipeline.offer('dropoff', 'device-1', {'is_anomaly': False, 'risk_level': 'HIGH'}, {})
+        for model, device_id in [('dropoff', 'device-1'), ('dropoff', 'device-1'), ('inactivity', 'device-1'),
+                                 ('dropoff', 'device-2'), ('dropoff', None), ('dropoff', None)]:
+            pipeline.offer(model, device_id, HIGH, {'device': device_id})
+        await until(lambda: pipeline.sink_stats['queue']['delivered'] == 5)
+        await pipeline.stop()
+        return sink, pipeline
+
+    sink, pipeline = asyncio.run(run())
+    assert pipeline.stats == {'queued': 5, 'deduplicated': 1}
+    assert [(event['model'], event['device_id']) for event in sink.take(10)] == [
+        ('dropoff', 'device-1'), ('inactivity', 'device-1'), ('dropoff', 'device-2'),
+        ('dropoff', None), ('dropoff', None),
+    ]
+
+
+def test_repeats_alert_again_after_the_window():
+    pipeline = alerts.AlertPipeline([], dedup_seconds=60, max_dedup_entries=2)
+    event = {'model': 'dropoff', 'device_id': 'device-1', 'timestamp': 1000.0}
+    assert not pipeline._is_repeat(event)
+    assert pipeline._is_repeat({**event, 'timestamp': 1059.0})
+    assert not pipeline._is_repeat({**event, 'timestamp': 1061.0})
+    # The oldest device is forgotten once more than max_dedup_entries are kept.
+    pipeline._is_repeat({**event, 'device_id': 'device-2'})
+    pipeline._is_repeat({**event, 'device_id': 'device-3'})
+    assert not pipeline._is_repeat({**event, 'timestamp': 1062.0})
+
+
+def test_a_failing_or_stuck_sink_does_not_hold_up_the_others():
+    async def run():
+        failing, stuck, queue = FailingSink(), StuckSink(), alerts.QueueSink()
+        pipeline = alerts.AlertPipeline([failing, stuck, queue], queue_size=2, batch_size=1, flush_interval=0.01,
+                                        max_retries=2, retry_backoff=0.01)
+        pipeline.start()
+        for i in range(4):
+            pipeline.offer('dropoff', f"device-{i}", HIGH, {})
+            # Long enough for the healthy sinks to ship each event.
+            await asyncio.sleep(0.1)
+        await until(lambda: pipeline.sink_stats['queue']['delivered'] == 4)
+        await until(lambda: pipeline.sink_stats['failing']['failed'] == 4)
+        status = pipeline.status()
+        stuck.gate.set()
+        await pipeline.stop()
+        return failing, stuck, queue, status
+
+    failing, stuck, queue, status = asyncio.run(run())
+    assert failing.calls == 4 * 3
+    assert status['sinks']['failing']['retries'] == 4 * 2
+    # The stuck sink holds one batch in send and two in its queue; the rest are dropped.
+    assert status['sinks']['stuck']['dropped'] == 1
+    assert status['sinks']['stuck']['queued_now'] == 2
+    assert [event['device_id'] for event in stuck.events] == ['device-0', 'device-1', 'device-2']
+    assert len(queue.take(10)) == 4
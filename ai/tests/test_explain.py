@@ -0,0 +1,37 @@
+import pytest
+
+from model_handler import DropoffModelHandler
+
+LOST = {
+    'network_connectivity_state': 0,
+    'acc_vs_loc': 0,
+    'time_since_last_successful_ping': 90000,
+    'gps_accuracy': [500.0] * 5,
+    'area_risk': 'high',
+}
+
+
+@pytest.fixture(scope='module')
+def handler():
+    handler = DropoffModelHandler()
+    assert handler.load_model_and_scaler()
+    return handler
+
+
+def test_explain_reports_payload_fields(handler):
+    plain = handler.predict(LOST)
+    explained = handler.predict(LOST, explain=True)
+    assert {key: explained[key] for key in plain} == plain
+
+    drivers = explained['drivers']
+    assert 0 < len(drivers) <= 3
+    assert {driver['feature'] for driver in drivers} <= set(LOST)
+    contributions = [driver['contribution'] for driver in drivers]
+    assert contributions == sorted(contributions, reverse=True)
+    assert all(contribution > 0 for contribution in contributions)
+
+
+def test_drivers_merge_columns_of_one_field(handler):
+    columns = handler.scaler_info['columns']
+    contributions = [0.1 if column.startswith('gps_accuracy') else -0.1 for column in columns]
+    assert handler.drivers(contributions) == [{'feature': 'gps_accuracy', 'contribution': 0.5}]
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from safetyscore.safetyscore import GeofenceIndex
+
+# A 0.1 degree square around (28.5, 77.1) with a 0.02 degree hole in its middle;
+# with 0.05 degree cells its edges and centre lie on bucket boundaries.
+SQUARE = [[77.05, 28.45], [77.15, 28.45], [77.15, 28.55], [77.05, 28.55], [77.05, 28.45]]
+HOLE = [[77.09, 28.49], [77.11, 28.49], [77.11, 28.51], [77.09, 28.51], [77.09, 28.49]]
+
+
+def feature(geometry, name=None):
+    return {'type': 'Feature', 'properties': {'name': name}, 'geometry': geometry}
+
+
+def collection(*features):
+    return {'type': 'FeatureCollection', 'features': list(features)}
+
+
+@pytest.fixture
+def index():
+    return GeofenceIndex.from_geojson(collection(
+        feature({'type': 'Polygon', 'coordinates': [SQUARE, HOLE]}, 'square'),
+    ))
+
+
+@pytest.mark.parametrize('lat, lon, inside', [
+    (28.47, 77.07, True),
+    (28.53, 77.13, True),
+    (28.50, 77.10, False),   # in the hole, on a bucket corner
+    (28.50, 77.12, True),    # on a bucket row edge
+    (28.52, 77.10, True),    # on a bucket column edge
+    (28.44, 77.10, False),
+    (28.50, 77.16, False),
+])
+def test_point_in_polygon(index, lat, lon, inside):
+    assert index.contains(lat, lon) is inside
+    assert index.find(lat, lon) == (['square'] if inside else [])
+    assert index.contains_many([lat], [lon]).tolist() == [inside]
+
+
+def test_polygon_spans_every_bucket_its_bbox_overlaps(index):
+    # Corners on a cell boundary land in whichever cell the query computes for them.
+    for lon, lat in SQUARE:
+        assert index.buckets[index._cell(lat, lon)] == [0]
+    lats, lons = np.meshgrid(np.linspace(28.451, 28.549, 25), np.linspace(77.051, 77.149, 25))
+    in_hole = (np.abs(lats - 28.5) < 0.01) & (np.abs(lons - 77.1) < 0.01)
+    np.testing.assert_array_equal(index.contains_many(lats, lons), ~in_hole)
+
+
+def test_large_polygons_skip_the_buckets():
+    index = GeofenceIndex.from_geojson(
+        feature({'type': 'Polygon', 'coordinates': [SQUARE, HOLE]}), max_buckets=4,
+    )
+    assert index.buckets == {} and index.large == [0]
+    assert index.contains(28.47, 77.07)
+    assert not index.contains(28.50, 77.10)
+    assert index.contains_many([28.47, 28.50, 10.0], [77.07, 77.10, 10.0]).tolist() == [True, False, False]
+
+
+def test_bad_geometries_are_skipped(capsys):
+    index = GeofenceIndex.from_geojson(collection(
+        feature(None, 'null'),
+        feature({'type': 'Point', 'coordinates': [77.1, 28.5]}, 'point'),
+        feature({'type': 'Polygon', 'coordinates': [[[77.1, 28.5]]]}, 'degenerate'),
+        feature({'type': 'MultiPolygon', 'coordinates': [[SQUARE]]}, 'multi'),
+    ))
+    assert index.names == ['multi']
+    warnings = capsys.readouterr().out.splitlines()
+    assert len(warnings) == 3
+    assert all(line.startswith('Warning: skipping geofence feature') for line in warnings)
@@ -0,0 +1,112 @@
+import asyncio
+
+import httpx
+import pytest
+
+from safetyscore.http_client import AsyncHTTPClient, CircuitOpenError
+
+URL = 'https://example.com/api'
+
+
+class FakeHost:
+    """Stands in for the pooled httpx client; answers with `status` once `gate` is set."""
+
+    def __init__(self, status=200):
+        self.status = status
+        self.calls = 0
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def request(self, method, url, **kwargs):
+        self.calls += 1
+        await self.gate.wait()
+        return httpx.Response(self.status, request=httpx.Request(method, url))
+
+
+def client_for(host, **kwargs):
+    client = AsyncHTTPClient(retries=0, **kwargs)
+    client._client = host
+    return client
+
+
+def get(client, url=URL):
+    return client._coalesced_request('GET', url, None, None, None, 1.0)
+
+
+async def until(condition):
+    while not condition():
+        await asyncio.sleep(0)
+
+
+def test_circuit_opens_and_closes_after_a_trial():
+    async def run():
+        host = FakeHost(503)
+        client = client_for(host, failure_threshold=2, reset_timeout=60.0)
+        for _ in range(2):
+            assert (await get(client)).status_code == 503
+        with pytest.raises(CircuitOpenError):
+            await get(client)
+        assert host.calls == 2
+
+        client._circuits['example.com'].opened_at -= 60.0
+        host.status = 200
+        assert (await get(client)).status_code == 200
+        assert client.circuit_status()['example.com'] == {'failures': 0, 'open': False}
+
+    asyncio.run(run())
+
+
+def test_cancelled_trial_lets_the_next_request_try():
+    async def run():
+        host = FakeHost(503)
+        client = client_for(host, failure_threshold=1, reset_timeout=0.0)
+        await get(client)
+        host.status = 200
+        host.gate.clear()
+        trial = asyncio.ensure_future(client._request_with_retries('GET', URL, None, None, None, 1.0))
+        await until(lambda: host.calls == 2)
+        with pytest.raises(CircuitOpenError):
+            await get(client)
+
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert not client._circuits['example.com'].trial_in_flight
+        host.gate.set()
+        assert (await get(client)).status_code == 200
+
+    asyncio.run(run())
+
+
+def test_identical_requests_share_one_response():
+    async def run():
+        host = FakeHost()
+        client = client_for(host)
+        host.gate.clear()
+        first, second = asyncio.ensure_future(get(client)), asyncio.ensure_future(get(client))
+        await until(lambda: host.calls == 1)
+        host.gate.set()
+        assert (await first) is (await second)
+        assert host.calls == 1 and client.coalesced == 1
+        assert not client._in_flight
+
+    asyncio.run(run())
+
+
+def test_cancelled_caller_does_not_cancel_coalesced_waiters():
+    async def run():
+        host = FakeHost()
+        client = client_for(host)
+        host.gate.clear()
+        owner = asyncio.ensure_future(get(client))
+        await until(lambda: host.calls == 1)
+        waiter = asyncio.ensure_future(get(client))
+        await asyncio.sleep(0)
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        host.gate.set()
+        assert (await waiter).status_code == 200
+        assert host.calls == 1
+
+    asyncio.run(run())
@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+import pytest
+
+from safetyscore import DiskCache, LookupCache
+
+SOURCES = {'weather': (0.05, 60.0)}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'time', clock)
+    return clock
+
+
+def test_points_in_a_cell_share_an_entry():
+    cache = LookupCache(SOURCES)
+    key = cache.key('weather', '', 28.51, 77.11)
+    assert cache.key('weather', '', 28.54, 77.14) == key
+    assert cache.key('weather', '', 28.56, 77.11) != key
+    assert cache.center(key) == (28.525, 77.125)
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = LookupCache(SOURCES)
+    key = cache.key('weather', '', 28.51, 77.11)
+    cache.put(key, 0.3)
+    clock.now += 59
+    assert cache.get(key) == 0.3
+    clock.now += 2
+    assert cache.get(key) is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_memory_misses_fall_through_to_the_store(clock, tmp_path):
+    store = DiskCache(str(tmp_path / 'lookups.sqlite3'))
+    writer, reader = LookupCache(SOURCES, store=store), LookupCache(SOURCES, store=store)
+    key = writer.key('weather', '', 28.51, 77.11)
+    writer.put(key, 0.3)
+
+    assert reader.get(key) == 0.3
+    assert reader.get(key) == 0.3
+    # The second read is answered from memory.
+    assert reader.stats()['store_hits'] == 1
+
+    clock.now += 61
+    assert LookupCache(SOURCES, store=store).get(key) is None
+
+
+def test_async_puts_reach_the_store(tmp_path):
+    store = DiskCache(str(tmp_path / 'lookups.sqlite3'))
+    writer = LookupCache(SOURCES, store=store)
+    key = writer.key('weather', '', 28.51, 77.11)
+    writer.put_async(key, {'hazard': 0.3})
+    writer._writer.shutdown(wait=True)
+
+    reader = LookupCache(SOURCES, store=store)
+    assert asyncio.run(reader.get_async(key)) == {'hazard': 0.3}
+    assert reader.stats()['store_hits'] == 1
@@ -0,0 +1,55 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import metrics
+
+
+def write_snapshot(directory, pid, value):
+    with open(os.path.join(directory, f"metrics-{pid}.json"), 'w') as f:
+        json.dump([['test_requests_total', ['dropoff'], [value]]], f)
+
+
+def test_snapshots_of_exited_workers_are_dropped(tmp_path):
+    registry = metrics.Registry(multiprocess_dir=str(tmp_path))
+    requests = metrics.Counter('test_requests_total', 'Requests.', ('endpoint',), registry=registry)
+    requests.inc('dropoff')
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    write_snapshot(tmp_path, exited.pid, 5.0)
+    write_snapshot(tmp_path, os.getppid(), 7.0)
+
+    assert registry.collect()[('test_requests_total', ('dropoff',))] == [8.0]
+    assert not (tmp_path / f"metrics-{exited.pid}.json").exists()
+
+    registry.remove_snapshot(os.getppid())
+    assert registry.collect()[('test_requests_total', ('dropoff',))] == [1.0]
+
+
+def test_histogram_buckets_are_cumulative_across_threads():
+    registry = metrics.Registry()
+    latency = metrics.Histogram('test_latency_seconds', 'Latency.', ('endpoint',), buckets=(0.1, 1.0),
+                                registry=registry)
+    latency.observe(0.05, 'dropoff')
+    thread = threading.Thread(target=latency.observe, args=(0.5, 'dropoff'))
+    thread.start()
+    thread.join()
+    latency.observe(2.0, 'dropoff')
+
+    lines = [line for line in registry.render().splitlines() if not line.startswith('#')]
+    assert lines == [
+        'test_latency_seconds_bucket{endpoint="dropoff",le="0.1"} 1',
+        'test_latency_seconds_bucket{endpoint="dropoff",le="1.0"} 2',
+        'test_latency_seconds_bucket{endpoint="dropoff",le="+Inf"} 3',
+        'test_latency_seconds_sum{endpoint="dropoff"} 2.55',
+        'test_latency_seconds_count{endpoint="dropoff"} 3',
+    ]
+
+
+def test_disabled_registry_records_nothing():
+    registry = metrics.Registry(enabled=False)
+    requests = metrics.Counter('test_requests_total', 'Requests.', ('endpoint',), registry=registry)
+    requests.inc('dropoff')
+    assert registry.collect() == {}
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+
+import model_artifact
+from model_artifact import CompiledForest
+
+
+@pytest.fixture(scope='module')
+def fitted():
+    rng = np.random.default_rng(0)
+    train = rng.normal(size=(512, 4))
+    model = IsolationForest(n_estimators=40, max_samples=128, random_state=0).fit(train)
+    scaler = StandardScaler().fit(train)
+    return model, scaler, rng.normal(scale=2.0, size=(300, 4))
+
+
+def test_matches_sklearn_decision_function(fitted):
+    model, _, X = fitted
+    forest = CompiledForest.from_sklearn(model)
+    np.testing.assert_allclose(forest.decision_function(X), model.decision_function(X), rtol=0, atol=1e-12)
+
+
+def test_artifact_round_trip(fitted, tmp_path):
+    model, scaler, X = fitted
+    path = str(tmp_path / 'model.safx')
+    model_artifact.export_model(model, {'scaler': scaler, 'columns': ['a', 'b', 'c', 'd']}, path)
+    forest, scaler_info = model_artifact.load_model(path)
+
+    assert scaler_info['columns'] == ['a', 'b', 'c', 'd']
+    np.testing.assert_allclose(scaler_info['scaler'].transform(X), scaler.transform(X))
+    np.testing.assert_allclose(forest.decision_function(X), model.decision_function(X), rtol=0, atol=1e-12)
+
+
+def test_float32_reaches_the_same_leaves(fitted):
+    model, _, X = fitted
+    forest = CompiledForest.from_sklearn(model)
+    single = forest.astype(np.float32)
+    assert single.threshold.dtype == np.float32
+    assert (single.threshold.astype(np.float64) <= forest.threshold).all()
+
+    # Features equal to the float32 rounding of a threshold are where rounding
+    # the thresholds to nearest would send samples down the other branch.
+    internal = forest.left != np.arange(len(forest.left))
+    edges = np.zeros((int(internal.sum()), X.shape[1]), dtype=np.float32)
+    edges[np.arange(len(edges)), forest.feature[internal]] = forest.threshold[internal].astype(np.float32)
+    for samples in (X, edges):
+        np.testing.assert_array_equal(single.apply(samples), forest.apply(samples))
+        np.testing.assert_allclose(single.decision_function(samples), model.decision_function(samples),
+                                   rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_contributions_decompose_the_path_length(fitted, dtype):
+    model, _, X = fitted
+    forest = CompiledForest.from_sklearn(model).astype(dtype)
+    scores, contributions = forest.decision_function_with_contributions(X)
+    np.testing.assert_array_equal(scores, forest.decision_function(X))
+
+    # score_samples = -2 ** (-mean_path_length / c(max_samples))
+    expected_length = model_artifact.average_path_length(np.array([model.max_samples_]))[0]
+    mean_path_length = -np.log2(-forest.score_samples(X)) * expected_length
+    np.testing.assert_allclose(contributions.sum(axis=1), expected_length - mean_path_length, rtol=0, atol=1e-4)
+
+
+def test_outlier_is_driven_by_its_unusual_feature(fitted):
+    model, _, _ = fitted
+    forest = CompiledForest.from_sklearn(model)
+    _, contributions = forest.decision_function_with_contributions(np.array([[0.0, 0.0, 8.0, 0.0]]))
+    assert contributions[0].argmax() == 2
+    assert contributions[0, 2] > 0
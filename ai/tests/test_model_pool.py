@@ -0,0 +1,67 @@
+import json
+import shutil
+
+import numpy as np
+import pytest
+
+import model_pool
+import wire
+from model_handler import DropoffModelHandler
+
+NORMAL = {
+    'network_connectivity_state': 1,
+    'acc_vs_loc': 1,
+    'time_since_last_successful_ping': 12,
+    'gps_accuracy': [8.5, 9.2, 11.1, 7.8, 10.4],
+    'area_risk': 'low',
+}
+LOST = {
+    'network_connectivity_state': 0,
+    'acc_vs_loc': 0,
+    'time_since_last_successful_ping': 90000,
+    'gps_accuracy': [500.0] * 5,
+    'area_risk': 'high',
+}
+
+
+class Observed:
+    def __init__(self):
+        self.rows = 0
+
+    def observe(self, rows, scores):
+        self.rows += len(rows)
+
+
+@pytest.fixture
+def handler(tmp_path):
+    shutil.copy('isolation_forest_model_dropoff.safx', tmp_path / 'north.safx')
+    handler = DropoffModelHandler()
+    assert handler.load_model_and_scaler()
+    handler.drift = Observed()
+    handler.regions = model_pool.ModelPool(handler, str(tmp_path), load_timeout=5.0)
+    yield handler
+    handler.regions.close()
+
+
+def decode(items):
+    return wire.decode(json.dumps(items).encode(), wire.JSON, wire.DROPOFF_SCHEMA, single=False)
+
+
+def test_batch_rows_are_scored_by_their_region(handler):
+    items = [{**NORMAL, 'region': 'north'}, LOST, {**LOST, 'region': 'south'}, {**LOST, 'region': 'north'}]
+    scores, is_anomaly, risk_levels = handler.predict_batch(decode(items))
+    expected = handler.predict_batch(decode([NORMAL, LOST, LOST, LOST]))
+
+    np.testing.assert_allclose(scores, expected[0])
+    assert is_anomaly.tolist() == expected[1].tolist()
+    assert risk_levels.tolist() == expected[2].tolist()
+    assert handler.regions.stats['hit'] == 1
+    assert handler.regions.stats['no_model'] == 1
+    # The regional rows reach the global handler's observers too.
+    assert handler.drift.rows == 2 * len(items)
+
+
+def test_region_must_be_a_string():
+    with pytest.raises(wire.WireFormatError) as raised:
+        decode([{**NORMAL, 'region': 5}])
+    assert raised.value.errors[0]['loc'] == ['body', 0, 'region']
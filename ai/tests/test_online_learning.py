@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import online_learning
+from model_handler import DropoffModelHandler
+
+NORMAL = {
+    'network_connectivity_state': 1,
+    'acc_vs_loc': 1,
+    'time_since_last_successful_ping': 12,
+    'gps_accuracy': [8.5, 9.2, 11.1, 7.8, 10.4],
+    'area_risk': 'low',
+}
+
+
+@pytest.fixture
+def handler():
+    handler = DropoffModelHandler()
+    assert handler.load_model_and_scaler()
+    return handler
+
+
+def test_window_keeps_the_latest_rows():
+    window = online_learning.FeatureWindow(4, 1)
+    window.add(np.arange(3.0)[:, None])
+    window.add(np.arange(3.0, 6.0)[:, None])
+    assert len(window) == 4
+    assert sorted(window.snapshot()[:, 0]) == [2.0, 3.0, 4.0, 5.0]
+    window.add(np.arange(10.0, 20.0)[:, None])
+    assert sorted(window.snapshot()[:, 0]) == [16.0, 17.0, 18.0, 19.0]
+
+
+def test_anomalies_stay_out_of_the_window(handler):
+    learner = online_learning.OnlineLearner(handler, seed=0)
+    rows = np.repeat(handler.feature_row(NORMAL), 4, axis=0)
+    learner.observe(rows, np.array([False, True, False, True]))
+    assert len(learner.window) == 2
+
+
+def test_refresh_waits_for_enough_rows(handler):
+    learner = online_learning.OnlineLearner(handler, seed=0)
+    learner.observe(handler.feature_row(NORMAL), [False])
+    version = handler.model_version
+    assert not learner.refresh_once()
+    assert handler.model_version == version
+
+
+def test_refreshes_replace_the_oldest_trees(handler):
+    learner = online_learning.OnlineLearner(handler, replace_fraction=0.1, exclude_anomalies=False, seed=0)
+    n_trees = len(handler.compiled_forest().roots)
+    rng = np.random.default_rng(0)
+    rows = np.repeat(handler.feature_row(NORMAL), 512, axis=0)
+    rows[:, :2] += rng.normal(size=(512, 2))
+    learner.observe(rows, np.zeros(len(rows), dtype=bool))
+
+    assert learner.refresh_once()
+    first = set(np.flatnonzero(learner._tree_age == 0))
+    assert learner.refresh_once()
+    second = set(np.flatnonzero(learner._tree_age == 0))
+
+    assert len(first) == len(second) == round(n_trees * 0.1)
+    assert not first & second
+    assert len(handler.model.roots) == n_trees
+    assert handler.model_version.endswith('+online2')
@@ -0,0 +1,50 @@
+import threading
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import prediction_log
+from model_handler import DropoffModelHandler
+
+
+@pytest.fixture
+def handler():
+    handler = DropoffModelHandler()
+    assert handler.load_model_and_scaler()
+    return handler
+
+
+def record_from_threads(log, handler, threads: int, records: int) -> None:
+    rows = np.zeros((1, len(handler.scaler_info['columns'])))
+
+    def run():
+        for _ in range(records):
+            log.record(handler, rows, [0.1], ['LOW'], 0.001)
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def test_rows_from_many_threads_are_all_written(tmp_path, handler):
+    log = prediction_log.PredictionLog(str(tmp_path), flush_interval=0.01)
+    record_from_threads(log, handler, threads=8, records=500)
+    log.close()
+
+    table = prediction_log.read_predictions(str(tmp_path), 'dropoff')
+    assert table.num_rows == log.written == 8 * 500
+    assert log.status()['pending_rows'] == 0
+    assert log.dropped == 0
+
+
+def test_rows_over_the_limit_are_dropped_and_counted(tmp_path, handler):
+    log = prediction_log.PredictionLog(str(tmp_path), flush_interval=3600, max_pending_rows=1000)
+    record_from_threads(log, handler, threads=8, records=500)
+    assert log.status()['pending_rows'] == 1000
+    assert log.dropped == 8 * 500 - 1000
+    log.close()
+    assert log.written == 1000
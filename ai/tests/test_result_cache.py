@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from model_handler import DropoffModelHandler
+from result_cache import ResultCache
+
+NORMAL = {
+    'network_connectivity_state': 1,
+    'acc_vs_loc': 1,
+    'time_since_last_successful_ping': 12,
+    'gps_accuracy': [8.5, 9.2, 11.1, 7.8, 10.4],
+    'area_risk': 'low',
+}
+
+
+def test_keys_are_quantized_per_column():
+    cache = ResultCache('test', ['count', 'distance'], max_entries=8, precision={'distance': 0.5})
+    keys = cache.keys([[1, 10.1], [1, 9.9], [1, 10.4], [2, 10.0], [1, 10.3]])
+    assert keys[0] == keys[1]
+    assert keys[0] != keys[2]    # 10.4 / 0.5 rounds to the next step
+    assert keys[0] != keys[3]    # unquantized columns must match exactly
+    assert keys[2] == keys[4]
+    assert cache.keys([[0.0, -0.0]]) == cache.keys([[-0.0, 0.0]])
+
+
+def test_unknown_precision_column():
+    with pytest.raises(ValueError, match='gps'):
+        ResultCache('test', ['count'], precision={'gps': 1.0})
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResultCache('test', ['x'], max_entries=2)
+    a, b, c = cache.keys([[1.0], [2.0], [3.0]])
+    cache.put_many([a, b], [-0.1, -0.2])
+    assert cache.get_many([a]) == [-0.1]
+    cache.put_many([c], [-0.3])
+    assert cache.get_many([a, b, c]) == [-0.1, None, -0.3]
+
+
+def test_cache_is_replaced_when_the_model_reloads():
+    handler = DropoffModelHandler()
+    assert handler.load_model_and_scaler()
+    handler.configure_cache(max_entries=16)
+    first = handler.predict(NORMAL)
+    cache = handler.result_cache
+    assert len(cache) == 1
+
+    nearby = {**NORMAL, 'gps_accuracy': [8.501, 9.2, 11.1, 7.8, 10.4]}
+    assert handler.predict(nearby) == first
+    assert len(cache) == 1
+
+    assert handler.load_model_and_scaler()
+    assert handler.result_cache is not cache
+    assert handler.result_cache is None or len(handler.result_cache) == 0
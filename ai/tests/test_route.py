@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from safetyscore import LocationSafetyCalculator
+from safetyscore.route import RouteAggregate, resample_polyline, route_length_m
+
+# Two legs of about 1.1 km and 0.55 km.
+ROUTE = [(28.50, 77.10), (28.51, 77.10), (28.51, 77.1057)]
+
+
+def test_resample_polyline():
+    samples = resample_polyline(ROUTE, 200.0)
+    total = route_length_m(ROUTE)
+    assert samples['distance_m'][-1] == pytest.approx(total)
+    np.testing.assert_allclose(np.diff(samples['distance_m'])[:-1], 200.0)
+    assert (samples['lat'][0], samples['lon'][0]) == ROUTE[0]
+    assert (samples['lat'][-1], samples['lon'][-1]) == pytest.approx(ROUTE[-1])
+    assert samples['segment'].tolist() == sorted(samples['segment'].tolist())
+    assert set(samples['segment'].tolist()) == {0, 1}
+
+
+def test_aggregate_weights_samples_by_distance():
+    samples = [
+        {'segment': 0, 'distance_m': 0.0, 'safety_score': 90.0, 'risk_level': 'low', 'lat': 0.0, 'lon': 0.0},
+        {'segment': 0, 'distance_m': 100.0, 'safety_score': 30.0, 'risk_level': 'high', 'lat': 0.1, 'lon': 0.0},
+        {'segment': 1, 'distance_m': 400.0, 'safety_score': 60.0, 'risk_level': 'med', 'lat': 0.2, 'lon': 0.0},
+    ]
+    aggregate = RouteAggregate(500.0)
+    assert aggregate.add(samples[0]) == [] and aggregate.add(samples[1]) == []
+    (first,) = aggregate.add(samples[2])
+    assert first['segment'] == 0 and first['length_m'] == 400.0
+    assert first['mean_safety_score'] == (90 * 100 + 30 * 300) / 400
+    assert first['risk_level'] == 'high' and first['min_at'] == [0.1, 0.0]
+
+    last, route = aggregate.finish()
+    assert last['segment'] == 1 and last['length_m'] == 100.0
+    assert route['type'] == 'route' and route['length_m'] == 500.0
+    assert route['risk_distance_m'] == {'low': 100.0, 'med': 100.0, 'high': 300.0}
+
+
+@pytest.fixture
+def calculator(tmp_path):
+    calculator = LocationSafetyCalculator(cell_tower_csv_path=str(tmp_path / 'missing.csv'))
+    calculator.fetched = []
+
+    async def fetch(lats, lons):
+        calculator.fetched.append(len(lats))
+        return [(0.1, 0.2)] * len(lats)
+
+    calculator._fetch_route_remote_scores = fetch
+    return calculator
+
+
+def test_route_is_scored_as_it_is_consumed(calculator):
+    records = calculator.score_route(ROUTE, spacing_m=200.0, is_area_geofenced=False, chunk_size=2)
+    first = next(records)
+    assert first['type'] == 'sample' and first['index'] == 0
+    # Only the first chunk has been looked up so far.
+    assert calculator.fetched == [2]
+
+    rest = list(records)
+    samples = [first] + [record for record in rest if record['type'] == 'sample']
+    assert [sample['index'] for sample in samples] == list(range(len(samples)))
+    assert sum(calculator.fetched) == len(samples)
+    assert [record['segment'] for record in rest if record['type'] == 'segment'] == [0, 1]
+    assert rest[-1]['type'] == 'route'
+    assert rest[-1]['length_m'] == pytest.approx(route_length_m(ROUTE), abs=0.1)
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+import online_learning
+import router
+from model_handler import DropoffModelHandler
+
+NORMAL = {
+    'network_connectivity_state': 1,
+    'acc_vs_loc': 1,
+    'time_since_last_successful_ping': 12,
+    'gps_accuracy': [8.5, 9.2, 11.1, 7.8, 10.4],
+    'area_risk': 'low',
+}
+
+
+class Observed:
+    def __init__(self):
+        self.scores = []
+
+    def __call__(self, model, rows, scores):
+        self.scores.extend(scores)
+
+
+@pytest.fixture
+def pool():
+    observed = Observed()
+    pool = router.WorkerPool(1, observe=observed)
+    pool.observed = observed
+    yield pool
+    pool.close()
+
+
+def test_online_refresh_reaches_workers(pool):
+    handler = DropoffModelHandler()
+    assert handler.load_model_and_scaler()
+    learner = online_learning.OnlineLearner(handler, min_rows=1, exclude_anomalies=False, seed=0)
+    learner.on_swap = lambda h: pool.swap_model(h.name, h.model, h.model_version)
+    row = handler.feature_row(NORMAL)
+    before, _ = handler.predict_anomaly(handler.scaler_info['scaler'].transform(row))
+    learner.observe(np.repeat(row, handler.model.max_samples_, axis=0), np.zeros(handler.model.max_samples_))
+
+    assert learner.refresh_once()
+    assert handler.model_version.endswith('+online1')
+    pool.submit('device-1', 'dropoff', NORMAL).result(timeout=60)
+
+    (worker,) = pool.status()['workers'].values()
+    assert worker['model_versions']['dropoff'] == handler.model_version
+    score, _ = handler.predict_anomaly(handler.scaler_info['scaler'].transform(row))
+    assert score != pytest.approx(before)
+    assert pool.observed.scores == pytest.approx([score])
+
+
+def test_add_worker_respects_the_limit(pool):
+    pool.max_workers = 1
+    with pytest.raises(ValueError, match='limit'):
+        pool.add_worker()
+    assert list(pool.status()['workers']) == ['worker-0']
+
+
+def test_hash_ring_moves_only_the_changed_nodes_keys():
+    ring = router.HashRing(['worker-0', 'worker-1', 'worker-2'])
+    keys = [f"device-{i}" for i in range(2000)]
+    before = {key: ring.node_for(key) for key in keys}
+    assert set(before.values()) == {'worker-0', 'worker-1', 'worker-2'}
+
+    ring.add('worker-3')
+    added = {key: ring.node_for(key) for key in keys}
+    moved = [key for key in keys if added[key] != before[key]]
+    assert all(added[key] == 'worker-3' for key in moved)
+    assert 0.15 < len(moved) / len(keys) < 0.35
+
+    ring.remove('worker-1')
+    removed = {key: ring.node_for(key) for key in keys}
+    assert all(removed[key] == added[key] for key in keys if added[key] != 'worker-1')
+    assert 'worker-1' not in removed.values()
+
+    ring.remove('worker-3')
+    ring.add('worker-1')
+    assert {key: ring.node_for(key) for key in keys} == before
+
+
+def test_empty_hash_ring():
+    ring = router.HashRing()
+    ring.add('worker-0')
+    ring.remove('worker-0')
+    assert ring.nodes == []
+    with pytest.raises(LookupError):
+        ring.node_for('device-1')
@@ -0,0 +1,64 @@
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+import shadow
+from model_handler import DropoffModelHandler
+
+
+@pytest.fixture
+def candidates(tmp_path):
+    directory = tmp_path / 'candidates'
+    directory.mkdir()
+    shutil.copy('isolation_forest_model_dropoff.safx', directory / 'candidate.safx')
+    (tmp_path / 'outside.safx').write_bytes(b'')
+    os.symlink(tmp_path / 'outside.safx', directory / 'link.safx')
+    (directory / 'candidate.joblib').write_bytes(b'')
+    return str(directory)
+
+
+def test_load_candidate_from_directory(candidates):
+    production = DropoffModelHandler()
+    candidate = shadow.load_candidate(production, 'candidate.safx', candidates)
+    assert candidate.name == 'dropoff_candidate'
+    assert candidate.model_path == candidate.scaler_path == ''
+
+
+@pytest.mark.parametrize('artifact', [
+    '../outside.safx', '/etc/passwd', 'candidate.joblib', 'link.safx', 'missing.safx', '.safx',
+])
+def test_rejects_artifacts_outside_directory(candidates, artifact):
+    with pytest.raises(ValueError):
+        shadow.candidate_path(artifact, candidates)
+
+
+def test_disabled_without_directory():
+    with pytest.raises(ValueError, match='SAFARX_SHADOW_MODELS'):
+        shadow.candidate_path('candidate.safx', None)
+
+
+def test_stop_does_not_block_on_a_full_queue(candidates):
+    production = DropoffModelHandler()
+    assert production.load_model_and_scaler()
+    evaluator = shadow.ShadowEvaluator(production, shadow.load_candidate(production, 'candidate.safx', candidates),
+                                       queue_size=1)
+    payload = {
+        'network_connectivity_state': 1, 'acc_vs_loc': 1, 'time_since_last_successful_ping': 12,
+        'gps_accuracy': [8.5, 9.2, 11.1, 7.8, 10.4], 'area_risk': 'low',
+    }
+    # Hold the worker in its first comparison so the queue stays full.
+    gate, score_batch = threading.Event(), production.score_batch
+    production.score_batch = lambda columns: gate.wait() and score_batch(columns)
+    evaluator._offer(payload)
+    while evaluator._queue.qsize():
+        time.sleep(0.01)
+    evaluator._offer(payload)
+    assert evaluator._queue.full()
+
+    evaluator.stop()
+    gate.set()
+    evaluator._worker.join(timeout=10)
+    assert not evaluator._worker.is_alive()
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+import streaming
+import wire
+from model_handler import DropoffModelHandler
+
+NORMAL = {
+    'network_connectivity_state': 1,
+    'acc_vs_loc': 1,
+    'time_since_last_successful_ping': 12,
+    'gps_accuracy': [8.5, 9.2, 11.1, 7.8, 10.4],
+    'area_risk': 'low',
+}
+
+
+@pytest.fixture(scope='module')
+def handlers():
+    handler = DropoffModelHandler()
+    assert handler.load_model_and_scaler()
+    return {'dropoff': (handler, wire.DROPOFF_SCHEMA)}
+
+
+def envelope(i, payload=NORMAL):
+    return {'id': i, 'model': 'dropoff', 'payload': payload}
+
+
+def test_full_queue_holds_back_the_sender(handlers):
+    async def run():
+        session = streaming.StreamSession(handlers, batch_size=8, max_pending=2)
+        await session.submit([envelope(0), envelope(1)])
+        blocked = asyncio.ensure_future(session.submit(envelope(2)))
+        await asyncio.sleep(0.05)
+        assert not blocked.done()
+        assert session.stats()['pending'] == 2
+
+        results = session.results()
+        first = await results.__anext__()
+        await blocked
+        await session.close()
+        rest = [result async for batch in results for result in batch]
+        return first + rest, session
+
+    results, session = asyncio.run(run())
+    assert [result['id'] for result in results] == [0, 1, 2]
+    assert all(result['risk_level'] == 'LOW' for result in results)
+    assert session.stats()['scored'] == 3
+
+
+def test_invalid_payloads_do_not_fail_the_batch(handlers):
+    async def run():
+        session = streaming.StreamSession(handlers)
+        await session.submit([envelope(0), envelope(1, {**NORMAL, 'area_risk': 'extreme'}),
+                              {'id': 2, 'model': 'unknown', 'payload': NORMAL}])
+        await session.close()
+        return [result async for batch in session.results() for result in batch]
+
+    ok, invalid, unknown = asyncio.run(run())
+    assert ok['risk_level'] == 'LOW'
+    assert invalid['error'][0]['loc'][-1] == 'area_risk'
+    assert 'Unknown model' in unknown['error']
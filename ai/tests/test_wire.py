@@ -0,0 +1,65 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import wire
+
+DROPOFF = {
+    'network_connectivity_state': 1,
+    'acc_vs_loc': 1,
+    'time_since_last_successful_ping': 12,
+    'gps_accuracy': [8.5, 9.2, 11.1, 7.8, 10.4],
+    'area_risk': 'low',
+}
+
+client = TestClient(main.app)
+
+
+def _post(path: str, body, content_type: str):
+    if content_type == wire.MSGPACK:
+        data = pytest.importorskip('msgpack').packb(body)
+    else:
+        data = json.dumps(body)
+    return client.post(path, content=data, headers={'content-type': content_type})
+
+
+@pytest.mark.parametrize('content_type', [wire.JSON, wire.MSGPACK])
+@pytest.mark.parametrize('field, value, kind', [
+    ('time_since_last_successful_ping', None, 'float_parsing'),
+    ('time_since_last_successful_ping', float('nan'), 'finite_number'),
+    ('gps_accuracy', [8.5, None, 11.1, 7.8, 10.4], 'float_parsing'),
+    ('gps_accuracy', [8.5, float('inf'), 11.1, 7.8, 10.4], 'finite_number'),
+])
+def test_null_and_non_finite_numbers_are_422(content_type, field, value, kind):
+    body = dict(DROPOFF, **{field: value})
+    for path, payload in (('/api/dropoff/batch', [DROPOFF, body]), ('/api/dropoff', body)):
+        if path == '/api/dropoff' and content_type == wire.JSON:
+            # Single JSON payloads are validated by pydantic, not the wire decoder.
+            continue
+        response = _post(path, payload, content_type)
+        assert response.status_code == 422, response.text
+        errors = response.json()['detail']
+        assert [error['type'] for error in errors] == [kind]
+        assert errors[0]['loc'][-1] == field
+
+
+def test_non_finite_record_values_are_422():
+    record = bytearray(wire.encode_records(wire.DROPOFF_SCHEMA, [DROPOFF]))
+    gps_offset = wire.DROPOFF_SCHEMA.record_dtype.fields['gps_accuracy'][1]
+    record[gps_offset:gps_offset + 8] = bytes.fromhex('000000000000f87f')  # NaN
+    response = client.post('/api/dropoff', content=bytes(record), headers={'content-type': wire.RECORD})
+    assert response.status_code == 422, response.text
+    assert response.json()['detail'][0]['input'][0] == 'nan'
+
+
+@pytest.mark.parametrize('content_type', [wire.JSON, wire.MSGPACK])
+def test_unknown_area_risk_is_422(content_type):
+    body = dict(DROPOFF, area_risk='extreme')
+    for path, payload in (('/api/dropoff/batch', [DROPOFF, body]), ('/api/dropoff', body)):
+        response = _post(path, payload, content_type)
+        assert response.status_code == 422, response.text
+        errors = response.json()['detail']
+        assert [error['type'] for error in errors] == ['literal_error']
+        assert errors[0]['loc'][-1] == 'area_risk'
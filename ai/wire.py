@@ -0,0 +1,358 @@
+"""
+Compact wire formats for the prediction endpoints.
+
+Besides JSON, `/api/dropoff`, `/api/inactivity` and their `/batch` variants accept
+
+- `application/msgpack`: the JSON payload (an object, or a list of objects for
+  batches) encoded with msgpack. Needs the optional `msgpack` package.
+- `application/x-safarx-record`: fixed-layout little-endian records, one per
+  prediction, laid out like the C structs below (natural alignment).
+
+      dropoff (48 bytes)                    inactivity (24 bytes)
+        0  u8   network_connectivity_state    0  u8   hour
+        1  u8   acc_vs_loc                    1  u8   motion_state
+        2  u8   area_risk (0 low, 1 med,      2  u8   area_risk
+                           2 high)            3  u8   battery_level_percent
+        4  i32  time_since_last_successful    4  u8   is_expected_active
+                _ping                         8  f64  displacement_m
+        8  f64  gps_accuracy[5]              16  i32  time_since_last_interaction_min
+                                             20  i32  missed_ping_count
+
+Both decode straight into one numpy column per field, skipping pydantic, and the
+range checks of the JSON models run vectorized over the whole batch. Responses
+follow the Accept header: JSON by default, msgpack, or packed result records
+(u8 is_anomaly, u8 risk level: 0 LOW, 1 MEDIUM, 2 HIGH).
+
+JSON and msgpack items may also carry a `region` (a string or null), decoded
+into an object column that routes each row to its region's model (see
+model_pool.py). Records have no room for it and are scored by the global model.
+"""
+
+import json
+import math
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+RECORD = 'application/x-safarx-record'
+BINARY_MEDIA_TYPES = (MSGPACK, RECORD)
+
+AREA_RISKS = ('low', 'med', 'high')
+RISK_LEVELS = ('LOW', 'MEDIUM', 'HIGH')
+RESULT_RECORD = np.dtype([('is_anomaly', '<u1'), ('risk_level', '<u1')])
+REGION_FIELD = 'region'
+MAX_REGION_LENGTH = 128
+
+# Validation stops collecting after this many errors so a bad batch cannot
+# produce an arbitrarily large response.
+MAX_ERRORS = 20
+
+
+class WireField(NamedTuple):
+    name: str
+    dtype: str
+    low: Optional[float] = None
+    high: Optional[float] = None
+    shape: Tuple[int, ...] = ()
+    categories: Optional[Tuple[str, ...]] = None
+
+
+class WireSchema:
+    def __init__(self, name: str, fields: List[WireField]):
+        self.name = name
+        self.fields = fields
+        self.record_dtype = np.dtype([(f.name, f.dtype, f.shape) for f in fields], align=True)
+
+
+DROPOFF_SCHEMA = WireSchema('dropoff', [
+    WireField('network_connectivity_state', '<u1'),
+    WireField('acc_vs_loc', '<u1'),
+    WireField('area_risk', '<u1', 0, len(AREA_RISKS) - 1, categories=AREA_RISKS),
+    WireField('time_since_last_successful_ping', '<i4'),
+    WireField('gps_accuracy', '<f8', shape=(5,)),
+])
+
+INACTIVITY_SCHEMA = WireSchema('inactivity', [
+    WireField('hour', '<u1', 0, 23),
+    WireField('motion_state', '<u1', 0, 1),
+    WireField('area_risk', '<u1', 0, len(AREA_RISKS) - 1, categories=AREA_RISKS),
+    WireField('battery_level_percent', '<u1', 0, 100),
+    WireField('is_expected_active', '<u1', 0, 1),
+    WireField('displacement_m', '<f8'),
+    WireField('time_since_last_interaction_min', '<i4'),
+    WireField('missed_ping_count', '<i4'),
+])
+
+
+class WireFormatError(ValueError):
+    """The body could not be decoded; `errors` uses the FastAPI validation error layout."""
+
+    def __init__(self, errors: List[dict]):
+        super().__init__(f"{len(errors)} validation error(s)")
+        self.errors = errors
+
+
+class UnsupportedMediaType(ValueError):
+    pass
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise UnsupportedMediaType("application/msgpack needs the msgpack package") from None
+    return msgpack
+
+
+def media_type(header: Optional[str]) -> str:
+    return (header or JSON).split(';')[0].strip().lower()
+
+
+def is_binary(content_type: Optional[str]) -> bool:
+    return media_type(content_type) in BINARY_MEDIA_TYPES
+
+
+def _json_input(value):
+    """`value` as it may appear in a JSON error body: numpy converted, NaN and infinities as strings."""
+    if isinstance(value, (np.generic, np.ndarray)):
+        value = value.tolist()
+    if isinstance(value, float) and not math.isfinite(value):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return [_json_input(item) for item in value]
+    return value
+
+
+def _contains_none(value) -> bool:
+    if isinstance(value, (list, tuple)):
+        return any(_contains_none(item) for item in value)
+    return value is None
+
+
+class _Errors:
+    def __init__(self, single: bool):
+        self.single = single
+        self.items: List[dict] = []
+
+    def add(self, kind: str, msg: str, row: Optional[int] = None, field: Optional[str] = None, value=None) -> None:
+        if len(self.items) >= MAX_ERRORS:
+            return
+        loc = ['body']
+        if row is not None and not self.single:
+            loc.append(row)
+        if field is not None:
+            loc.append(field)
+        error = {'type': kind, 'loc': loc, 'msg': msg}
+        if value is not None:
+            error['input'] = _json_input(value)
+        self.items.append(error)
+
+    def add_rows(self, kind: str, msg: str, mask: np.ndarray, field: str, values: np.ndarray) -> None:
+        for row in np.flatnonzero(mask)[:MAX_ERRORS]:
+            self.add(kind, msg, int(row), field, values[row])
+
+    def raise_if_any(self) -> None:
+        if self.items:
+            raise WireFormatError(self.items)
+
+
+def decode(body: bytes, content_type: Optional[str], schema: WireSchema, single: bool) -> Dict[str, np.ndarray]:
+    """
+    Decode a request body into one array per field of `schema`.
+
+    Args:
+        body: Raw request body
+        content_type: The request's Content-Type header
+        schema: DROPOFF_SCHEMA or INACTIVITY_SCHEMA
+        single: True for the single-prediction endpoints (exactly one payload)
+
+    Returns:
+        Dictionary of columns, ready for BaseModelHandler.predict_batch
+    """
+    errors = _Errors(single)
+    kind = media_type(content_type)
+    if kind == RECORD:
+        return _decode_records(body, schema, single, errors)
+
+    try:
+        if kind == MSGPACK:
+            msgpack = _msgpack()
+            payload = msgpack.unpackb(body, raw=False)
+        elif kind == JSON:
+            payload = json.loads(body)
+        else:
+            raise UnsupportedMediaType(f"Unsupported content type '{kind}'")
+    except UnsupportedMediaType:
+        raise
+    except Exception as e:
+        errors.add(f"{kind.split('/')[-1]}_invalid", f"Could not decode body: {e}")
+        errors.raise_if_any()
+
+    if single:
+        if not isinstance(payload, dict):
+            errors.add('dict_type', 'Input should be a valid dictionary')
+        items = [payload]
+    else:
+        if not isinstance(payload, list):
+            errors.add('list_type', 'Input should be a valid list')
+        elif not payload:
+            errors.add('too_short', 'List should have at least 1 item')
+        items = payload
+    errors.raise_if_any()
+    return _decode_items(items, schema, errors)
+
+
+def decode_payloads(payloads: list, schema: WireSchema, single: bool = False) -> Dict[str, np.ndarray]:
+    """Decode already-parsed JSON-style payloads (a list of dicts) into columns."""
+    return _decode_items(payloads, schema, _Errors(single))
+
+
+def row(columns: Dict[str, np.ndarray], index: int) -> dict:
+    """Row `index` of decoded columns as a payload dict of plain Python values."""
+    return {name: values[index].tolist() for name, values in columns.items()}
+
+
+def _decode_records(body: bytes, schema: WireSchema, single: bool, errors: _Errors) -> Dict[str, np.ndarray]:
+    itemsize = schema.record_dtype.itemsize
+    if not body or len(body) % itemsize or (single and len(body) != itemsize):
+        expected = f"{itemsize} bytes" if single else f"a multiple of {itemsize} bytes"
+        errors.add('record_size', f"Body should be {expected}, got {len(body)}")
+        errors.raise_if_any()
+
+    records = np.frombuffer(body, dtype=schema.record_dtype)
+    columns = {field.name: records[field.name] for field in schema.fields}
+    _check_ranges(columns, schema, errors)
+    errors.raise_if_any()
+    for field in schema.fields:
+        if field.categories is not None:
+            columns[field.name] = np.asarray(field.categories)[columns[field.name]]
+    return columns
+
+
+def _decode_items(items: list, schema: WireSchema, errors: _Errors) -> Dict[str, np.ndarray]:
+    for row, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.add('dict_type', 'Input should be a valid dictionary', row)
+    errors.raise_if_any()
+
+    columns = {}
+    for field in schema.fields:
+        missing = [row for row, item in enumerate(items) if field.name not in item]
+        for row in missing:
+            errors.add('missing', 'Field required', row, field.name)
+        if missing:
+            continue
+        values = [item[field.name] for item in items]
+
+        if field.categories is not None:
+            expected = ', '.join(repr(c) for c in field.categories[:-1]) + f" or {field.categories[-1]!r}"
+            for row, value in enumerate(values):
+                if not isinstance(value, str):
+                    errors.add('string_type', 'Input should be a valid string', row, field.name, value)
+                elif value not in field.categories:
+                    # Same error as the pydantic models' Literal fields.
+                    errors.add('literal_error', f"Input should be {expected}", row, field.name, value)
+            columns[field.name] = np.asarray(values, dtype=str).reshape(len(values))
+            continue
+
+        try:
+            column = np.asarray(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            column = None
+        if column is not None and column.shape == (len(items),) + field.shape:
+            # numpy turns null into NaN; report it as a missing number, not a non-finite one.
+            for row in np.flatnonzero(np.isnan(column).reshape(len(items), -1).any(axis=1)):
+                if _contains_none(values[row]):
+                    errors.add('float_parsing', 'Input should be a valid number', int(row), field.name)
+        if column is None or column.shape != (len(items),) + field.shape:
+            # Only the slow path looks at individual values, to report which are wrong.
+            for row, value in enumerate(values):
+                _check_value(value, row, field, errors)
+            continue
+        if np.dtype(field.dtype).kind in 'iu':
+            errors.add_rows('int_from_float', 'Input should be a valid integer',
+                            np.isfinite(column) & (column != np.floor(column)), field.name, column)
+        columns[field.name] = column
+
+    regions = None
+    if any(REGION_FIELD in item for item in items):
+        regions = [item.get(REGION_FIELD) for item in items]
+        for row, region in enumerate(regions):
+            if region is not None and not isinstance(region, str):
+                errors.add('string_type', 'Input should be a valid string', row, REGION_FIELD, region)
+            elif region is not None and len(region) > MAX_REGION_LENGTH:
+                errors.add('string_too_long', f"String should have at most {MAX_REGION_LENGTH} characters",
+                           row, REGION_FIELD, region)
+
+    errors.raise_if_any()
+    _check_ranges(columns, schema, errors)
+    errors.raise_if_any()
+    if regions is not None:
+        columns[REGION_FIELD] = np.array(regions, dtype=object)
+    return columns
+
+
+def _check_value(value, row: int, field: WireField, errors: _Errors) -> None:
+    if _contains_none(value):
+        errors.add('float_parsing', 'Input should be a valid number', row, field.name)
+        return
+    try:
+        shape = np.asarray(value, dtype=np.float64).shape
+    except (TypeError, ValueError):
+        errors.add('float_parsing', 'Input should be a valid number', row, field.name, value)
+        return
+    if shape != field.shape:
+        errors.add('value_error', f"Input should have shape {list(field.shape)}", row, field.name, value)
+
+
+def _check_ranges(columns: Dict[str, np.ndarray], schema: WireSchema, errors: _Errors) -> None:
+    for field in schema.fields:
+        values = columns[field.name]
+        if values.dtype.kind not in 'iuf':
+            continue
+        rows = len(values)
+        if values.dtype.kind == 'f':
+            errors.add_rows('finite_number', 'Input should be a finite number',
+                            ~np.isfinite(values).reshape(rows, -1).all(axis=1), field.name, values)
+        if field.low is not None:
+            errors.add_rows('greater_than_equal', f"Input should be greater than or equal to {field.low}",
+                            values < field.low, field.name, values)
+        if field.high is not None:
+            errors.add_rows('less_than_equal', f"Input should be less than or equal to {field.high}",
+                            values > field.high, field.name, values)
+
+
+def encode_records(schema: WireSchema, payloads: List[dict]) -> bytes:
+    """Pack JSON-style payloads into the record format (for clients, tests and benchmarks)."""
+    records = np.zeros(len(payloads), dtype=schema.record_dtype)
+    for field in schema.fields:
+        values = [payload[field.name] for payload in payloads]
+        if field.categories is not None:
+            values = [field.categories.index(value) for value in values]
+        records[field.name] = values
+    return records.tobytes()
+
+
+def encode_results(is_anomaly: np.ndarray, risk_levels: np.ndarray, accept: Optional[str],
+                   single: bool) -> Tuple[bytes, str]:
+    """Encode predictions for the client's Accept header, returning (body, media type)."""
+    accept = (accept or '').lower()
+    if RECORD in accept:
+        records = np.empty(len(is_anomaly), dtype=RESULT_RECORD)
+        records['is_anomaly'] = is_anomaly
+        records['risk_level'] = (risk_levels == 'MEDIUM') + 2 * (risk_levels == 'HIGH')
+        return records.tobytes(), RECORD
+
+    results = [
+        {'is_anomaly': bool(anomaly), 'risk_level': str(level)}
+        for anomaly, level in zip(is_anomaly, risk_levels)
+    ]
+    payload = results[0] if single else results
+    if MSGPACK in accept:
+        try:
+            return _msgpack().packb(payload), MSGPACK
+        except UnsupportedMediaType:
+            pass
+    return json.dumps(payload).encode(), JSON